@@ -32,6 +32,83 @@ import os
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Entrega de audio: el reproductor recibe URLs firmadas que caducan AUDIO_URL_TTL
+# segundos después de lo que dura la canción (el reproductor pide otra si aun así
+# caduca, p. ej. tras una pausa larga) y el backend decide quién transfiere los bytes.
+#   'music.entrega.DjangoBackend'          -> el worker (desarrollo)
+#   'music.entrega.XAccelRedirectBackend'  -> nginx (location interna AUDIO_ACCEL_REDIRECT_PREFIX)
+#   'music.entrega.XSendfileBackend'       -> lighttpd / apache mod_xsendfile
+#   'music.entrega.SendfileBackend'        -> os.sendfile vía wsgi.file_wrapper (gunicorn)
+AUDIO_URLS_FIRMADAS = True
+AUDIO_URL_TTL = 300
+AUDIO_ENTREGA_BACKEND = 'music.entrega.DjangoBackend'
+AUDIO_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+# Segundos tras los que cada proceso reconstruye su índice de trigramas en memoria
+TRIGRAMAS_REFRESCO = 600
+
+# La caché por defecto es la de Django, en la memoria de cada proceso. 'compartida'
+# la ven todos los procesos del servidor y guarda la versión del catálogo para las
+# sugerencias. En producción conviene Redis o Memcached
+# (django.core.cache.backends.redis.RedisCache); basta con cambiar BACKEND y LOCATION.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'compartida': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+    },
+}
+
+# Caché de /api/sugerencias/: entradas por proceso, segundos que vale cada una aunque
+# no cambie la versión del catálogo, max-age (segundos) para navegadores/proxies y
+# segundos que cada proceso reutiliza la versión leída de la caché 'compartida'
+SUGERENCIAS_CACHE_MAX = 5000
+SUGERENCIAS_CACHE_TTL = 300
+SUGERENCIAS_MAX_AGE = 30
+SUGERENCIAS_VERSION_TTL = 1
+
+# Versiones de audio por calidad (manage.py transcode_audio): binario de ffmpeg,
+# conversiones simultáneas y calidad para quien no tiene configuración
+FFMPEG_BINARIO = 'ffmpeg'
+TRANSCODIFICACION_PROCESOS = 2
+AUDIO_CALIDAD_DEFECTO = 'high'
+
+# Duración aproximada (segundos) de los segmentos HLS (manage.py package_hls)
+HLS_SEGUNDOS = 6
+
+# Miniaturas de portadas (music/miniaturas.py): generarlas todas al subir la imagen
+# (si no, se crean al pedirlas) y calidad de WebP/JPEG
+MINIATURAS_AL_SUBIR = True
+MINIATURAS_CALIDAD = 80
+
+# Formas de onda (manage.py build_waveforms): puntos de cada resolución y
+# frecuencia (Hz) a la que se decodifica el audio para calcular los picos
+ONDA_RESOLUCIONES = (256, 1024, 4096)
+ONDA_FRECUENCIA = 8000
+
+# Normalización de sonoridad (manage.py analyze_loudness): objetivo en LUFS y
+# pico real máximo (dBTP) que puede alcanzar una pista tras aplicar la ganancia
+SONORIDAD_OBJETIVO = -14.0
+PICO_MAXIMO = -1.0
+
+# Duplicados (manage.py find_duplicates): fracción de hashes de la huella acústica
+# que deben coincidir con el mismo desfase, y mínimo absoluto de coincidencias
+HUELLAS_UMBRAL = 0.1
+HUELLAS_MINIMO = 20
+
+# Recomendaciones (manage.py build_recommendations): vecinas guardadas por canción y
+# minutos sin escuchar nada a partir de los cuales empieza otra sesión del oyente
+RECOMENDACIONES_VECINAS = 20
+RECOMENDACIONES_SESION_MINUTOS = 30
+
+# Reproducciones: se acumulan en memoria y se vuelcan cada N segundos o al llegar al lote;
+# si la base de datos falla se reintentan, guardando como mucho MAX_PENDIENTES eventos
+REPRODUCCIONES_FLUSH_INTERVALO = 5
+REPRODUCCIONES_LOTE = 500
+REPRODUCCIONES_MAX_PENDIENTES = 50000
+
 # Application definition
 
 INSTALLED_APPS = [
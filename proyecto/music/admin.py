@@ -11,13 +11,16 @@ class ArtistaAdmin(admin.ModelAdmin):
 
 @admin.register(Album)
 class AlbumAdmin(admin.ModelAdmin):
-    list_display = ('titulo', 'artistas_nombres', 'fecha_lanzamiento', 'canciones_count')
+    list_display = ('titulo', 'artistas_nombres', 'fecha_lanzamiento', 'total_canciones')
     list_filter = ('fecha_lanzamiento', 'activo')
     search_fields = ('titulo', 'artistas__nombre')
     filter_horizontal = ('artistas',)
     prepopulated_fields = {'slug': ('titulo',)}
     readonly_fields = ('fecha_creacion', 'duracion_total')
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('artistas')
+
 @admin.register(Cancion)
 class CancionAdmin(admin.ModelAdmin):
     list_display = ('titulo', 'artistas_nombres', 'album', 'duracion_formateada', 'reproducciones', 'favorita')
@@ -27,6 +30,10 @@ class CancionAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('titulo',)}
     readonly_fields = ('fecha_subida', 'fecha_modificacion', 'reproducciones')
     actions = ['marcar_como_favorita', 'activar_canciones']
+    list_select_related = ('album',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('artistas')
     
     def marcar_como_favorita(self, request, queryset):
         queryset.update(favorita=True)
@@ -39,6 +46,7 @@ class CancionAdmin(admin.ModelAdmin):
 @admin.register(Playlist)
 class PlaylistAdmin(admin.ModelAdmin):
     list_display = ('nombre', 'usuario', 'total_canciones', 'publica', 'fecha_creacion')
+    list_select_related = ('usuario',)
     list_filter = ('publica', 'fecha_creacion')
     search_fields = ('nombre', 'usuario__username')
     filter_horizontal = ('canciones',)
@@ -57,6 +65,10 @@ class ReproduccionAdmin(admin.ModelAdmin):
     list_filter = ('fecha_reproduccion',)
     search_fields = ('cancion__titulo', 'usuario__username')
     readonly_fields = ('fecha_reproduccion',)
+    list_select_related = ('cancion', 'usuario')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('cancion__artistas')
 
 @admin.register(Favorito)
 class FavoritoAdmin(admin.ModelAdmin):
@@ -64,8 +76,35 @@ class FavoritoAdmin(admin.ModelAdmin):
     list_filter = ('fecha_agregado',)
     search_fields = ('usuario__username', 'cancion__titulo')
     readonly_fields = ('fecha_agregado',)
+    list_select_related = ('usuario', 'cancion')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('cancion__artistas')
 
 @admin.register(ConfiguracionUsuario)
 class ConfiguracionUsuarioAdmin(admin.ModelAdmin):
-    list_display = ('usuario', 'tema_oscuro', 'calidad_audio', 'volumen_default')
-    search_fields = ('usuario__username',)
\ No newline at end of file
+    list_display = ('usuario', 'tema_oscuro', 'calidad_audio', 'volumen_default', 'normalizacion')
+    list_select_related = ('usuario',)
+    search_fields = ('usuario__username',)
+
+@admin.register(VersionAudio)
+class VersionAudioAdmin(admin.ModelAdmin):
+    list_display = ('cancion', 'calidad', 'bitrate', 'estado', 'fecha_actualizacion')
+    list_filter = ('calidad', 'estado')
+    search_fields = ('cancion__titulo',)
+    list_select_related = ('cancion',)
+    readonly_fields = ('archivo', 'error', 'fecha_actualizacion')
+
+@admin.register(EstadisticaCancion)
+class EstadisticaCancionAdmin(admin.ModelAdmin):
+    list_display = ('cancion', 'periodo', 'inicio', 'total')
+    list_filter = ('periodo',)
+    search_fields = ('cancion__titulo',)
+    list_select_related = ('cancion',)
+
+@admin.register(EstadisticaArtista)
+class EstadisticaArtistaAdmin(admin.ModelAdmin):
+    list_display = ('artista', 'periodo', 'inicio', 'total')
+    list_filter = ('periodo',)
+    search_fields = ('artista__nombre',)
+    list_select_related = ('artista',)
\ No newline at end of file
@@ -0,0 +1,176 @@
+"""
+Almacenamiento de audio direccionado por contenido.
+
+Cada archivo subido se guarda como musica/ab/cd/<sha256>.<ext>, calculando
+el hash por bloques mientras se lee la subida. Dos subidas con los mismos
+bytes acaban en el mismo archivo: la segunda no escribe nada. Como el
+contenido de un nombre no cambia nunca, la huella sirve de ETag fuerte y
+la URL se puede cachear indefinidamente.
+
+Varias canciones (y versiones recodificadas) pueden apuntar al mismo
+archivo. Al borrar una canción o cambiar su audio, el archivo anterior
+sólo se elimina si ya no lo referencia ninguna fila (ver `music.signals`).
+Reutilizar un archivo y borrarlo se hacen bajo un cerrojo entre procesos,
+y reutilizarlo lo toca: `liberar` no borra lo que se ha escrito o
+reutilizado hace menos de ALMACENAMIENTO_GRACIA segundos, porque la fila
+que lo va a referenciar puede no haberse guardado todavía.
+`manage.py collect_audio_garbage` recoge además los huérfanos que queden
+en disco.
+"""
+import hashlib
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File, locks
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+CARPETA = 'musica'
+BLOQUE = 1024 * 1024
+NOMBRE_RE = re.compile(rf'^{CARPETA}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/([0-9a-f]{{64}})(\.\w+)?$')
+# Archivos a medio escribir (ver ruta_temporal); collect_audio_garbage borra los abandonados
+TEMPORAL_RE = re.compile(r'^\.[0-9a-f]{64}(\.\w+)?\.[0-9a-f]{12}\.tmp$')
+
+
+def calcular_hash(origen):
+    """sha256 en hexadecimal de una ruta o de un archivo abierto, leído por bloques"""
+    sha = hashlib.sha256()
+    if isinstance(origen, (str, os.PathLike)):
+        with open(origen, 'rb') as archivo:
+            for bloque in iter(lambda: archivo.read(BLOQUE), b''):
+                sha.update(bloque)
+        return sha.hexdigest()
+
+    if hasattr(origen, 'seek'):
+        origen.seek(0)
+    bloques = origen.chunks(BLOQUE) if hasattr(origen, 'chunks') else iter(lambda: origen.read(BLOQUE), b'')
+    for bloque in bloques:
+        sha.update(bloque)
+    if hasattr(origen, 'seek'):
+        origen.seek(0)
+    return sha.hexdigest()
+
+
+def nombre_contenido(huella, extension=''):
+    return f'{CARPETA}/{huella[:2]}/{huella[2:4]}/{huella}{extension.lower()}'
+
+
+def ruta_temporal(ruta):
+    """
+    Ruta única junto a `ruta` para escribir ahí y después hacer os.replace:
+    en la misma carpeta el cambio de nombre es atómico, así que nunca hay un
+    archivo a medias con el nombre definitivo.
+    """
+    carpeta, nombre = os.path.split(ruta)
+    return os.path.join(carpeta, f'.{nombre}.{uuid.uuid4().hex[:12]}.tmp')
+
+
+def huella(nombre):
+    """Hash de un nombre direccionado por contenido o None si es un nombre normal"""
+    coincidencia = NOMBRE_RE.match(nombre or '')
+    return coincidencia.group(1) if coincidencia else None
+
+
+@deconstructible
+class AlmacenamientoContenido(FileSystemStorage):
+
+    @contextmanager
+    def cerrojo(self):
+        """Exclusión entre procesos (e hilos) para reutilizar, escribir o borrar archivos"""
+        ruta = self.path(f'{CARPETA}/.cerrojo')
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        with open(ruta, 'a') as archivo:
+            locks.lock(archivo, locks.LOCK_EX)
+            try:
+                yield
+            finally:
+                locks.unlock(archivo)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        nombre = nombre_contenido(calcular_hash(content), os.path.splitext(name)[1])
+        ruta = self.path(nombre)
+        with self.cerrojo():
+            try:
+                # Tocarlo aplaza cualquier liberar() hasta que se guarde la fila que lo usa
+                os.utime(ruta)
+                return nombre
+            except FileNotFoundError:
+                pass
+
+        # Se escribe aparte y se renombra sobre el nombre del hash: dos subidas
+        # idénticas a la vez dejan el mismo archivo, nunca uno con sufijo
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        temporal = ruta_temporal(ruta)
+        try:
+            with open(temporal, 'wb') as destino:
+                for bloque in content.chunks(BLOQUE):
+                    destino.write(bloque)
+            if self.file_permissions_mode is not None:
+                os.chmod(temporal, self.file_permissions_mode)
+            with self.cerrojo():
+                os.replace(temporal, ruta)
+        except BaseException:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+        return nombre
+
+    def huella(self, name):
+        return huella(name)
+
+
+almacenamiento = AlmacenamientoContenido()
+
+
+def almacenamiento_audio():
+    """Storage de Cancion.archivo (callable para que las migraciones no lo congelen)"""
+    return almacenamiento
+
+
+def referenciados(nombres=None):
+    """Nombres usados por alguna canción o versión de audio (todos si `nombres` es None)"""
+    from .models import Cancion, VersionAudio
+
+    usados = set()
+    for modelo in (Cancion, VersionAudio):
+        filas = modelo.objects.filter(archivo__startswith=f'{CARPETA}/')
+        if nombres is not None:
+            filas = filas.filter(archivo__in=nombres)
+        usados.update(filas.values_list('archivo', flat=True))
+    return usados
+
+
+def _gracia():
+    return getattr(settings, 'ALMACENAMIENTO_GRACIA', 300)
+
+
+def liberar(nombres):
+    """
+    Borra del disco los archivos direccionados por contenido que nadie
+    referencia. Los escritos o reutilizados hace poco se dejan para
+    collect_audio_garbage: puede haber una subida idéntica en curso.
+    """
+    nombres = {nombre for nombre in nombres if huella(nombre)}
+    if not nombres:
+        return []
+    limite = time.time() - _gracia()
+    borrados = []
+    with almacenamiento.cerrojo():
+        # Las referencias se comprueban con el cerrojo: save() no puede reutilizar mientras tanto
+        for nombre in nombres - referenciados(nombres):
+            try:
+                if os.path.getmtime(almacenamiento.path(nombre)) > limite:
+                    continue
+                os.remove(almacenamiento.path(nombre))
+            except FileNotFoundError:
+                continue
+            borrados.append(nombre)
+    return borrados
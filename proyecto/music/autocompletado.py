@@ -0,0 +1,97 @@
+"""
+Caché de sugerencias de búsqueda por prefijo.
+
+Cada proceso guarda en un LRU acotado (SUGERENCIAS_CACHE_MAX entradas) los
+resultados ya serializados de /api/sugerencias/, indexados por el prefijo
+normalizado. La versión del catálogo se guarda en la caché 'compartida'
+entre procesos (ver CACHES) y cambia con cada escritura (ver
+`music.signals`); las entradas de una versión anterior se descartan y la
+versión forma parte del ETag de la respuesta. Para no leer esa caché en
+cada pulsación, cada proceso reutiliza la versión leída durante
+SUGERENCIAS_VERSION_TTL segundos: otro proceso tarda como mucho eso en ver
+una escritura. Además cada entrada caduca a los SUGERENCIAS_CACHE_TTL
+segundos, por si algún cambio no pasó por las señales (p. ej. un update()
+masivo).
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .difuso import normalizar
+
+CACHE = 'compartida'
+CLAVE_VERSION = 'music:catalogo:version'
+
+# (versión, instante de time.monotonic() hasta el que vale) en este proceso
+_version_local = (None, 0.0)
+
+
+def _recordar(version):
+    global _version_local
+    _version_local = (version, time.monotonic() + getattr(settings, 'SUGERENCIAS_VERSION_TTL', 1))
+    return version
+
+
+def version_catalogo():
+    version, vale_hasta = _version_local
+    if version is not None and time.monotonic() < vale_hasta:
+        return version
+    return _recordar(caches[CACHE].get_or_set(CLAVE_VERSION, lambda: int(time.time() * 1000), timeout=None))
+
+
+def invalidar():
+    """Marca el catálogo como modificado: las sugerencias cacheadas dejan de valer"""
+    version = int(time.time() * 1000)
+    caches[CACHE].set(CLAVE_VERSION, version, timeout=None)
+    _recordar(version)
+
+
+def clave(query):
+    return normalizar(query)
+
+
+def etag(version, clave_query):
+    resumen = hashlib.md5(clave_query.encode('utf-8'), usedforsecurity=False).hexdigest()[:16]
+    return f'"{version:x}-{resumen}"'
+
+
+class CacheLRU:
+    def __init__(self, maximo, ttl=None):
+        self.maximo = maximo
+        self.ttl = ttl
+        self.datos = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, clave_query, version):
+        with self.lock:
+            entrada = self.datos.get(clave_query)
+            if entrada is None:
+                return None
+            guardada_version, caduca, resultados = entrada
+            if guardada_version != version or (caduca is not None and time.monotonic() >= caduca):
+                del self.datos[clave_query]
+                return None
+            self.datos.move_to_end(clave_query)
+            return resultados
+
+    def set(self, clave_query, version, resultados):
+        caduca = time.monotonic() + self.ttl if self.ttl else None
+        with self.lock:
+            self.datos[clave_query] = (version, caduca, resultados)
+            self.datos.move_to_end(clave_query)
+            while len(self.datos) > self.maximo:
+                self.datos.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.datos.clear()
+
+
+sugerencias_cache = CacheLRU(
+    getattr(settings, 'SUGERENCIAS_CACHE_MAX', 5000),
+    ttl=getattr(settings, 'SUGERENCIAS_CACHE_TTL', 300),
+)
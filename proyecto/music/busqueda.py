@@ -0,0 +1,130 @@
+"""
+Índice de búsqueda de texto completo (SQLite FTS5) sobre canciones.
+
+Cada fila del índice usa como rowid el id de la canción y guarda su título,
+los nombres de sus artistas y el título de su álbum. Se mantiene
+sincronizado desde las señales de `music.signals` y se reconstruye con
+`manage.py rebuild_search_index`. Con otros motores de base de datos se
+recurre a la búsqueda con icontains.
+"""
+import re
+from functools import reduce
+
+from django.db import connection
+from django.db.models import Q
+
+TABLA_FTS = 'music_cancion_fts'
+
+# Pesos de bm25 por columna: título, artistas, álbum
+PESOS_BM25 = (10.0, 5.0, 2.0)
+
+SQL_CREAR = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_FTS} USING fts5(
+    titulo, artistas, album,
+    tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+
+SQL_DATOS = """
+SELECT c.id, c.titulo,
+       COALESCE((SELECT group_concat(a.nombre, ' ')
+                 FROM music_cancion_artistas ca
+                 JOIN music_artista a ON a.id = ca.artista_id
+                 WHERE ca.cancion_id = c.id), ''),
+       COALESCE(al.titulo, '')
+FROM music_cancion c
+LEFT JOIN music_album al ON al.id = c.album_id
+"""
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def disponible():
+    return connection.vendor == 'sqlite'
+
+
+def _placeholders(ids):
+    return ', '.join(['%s'] * len(ids))
+
+
+def indexar_canciones(ids):
+    """Vuelve a indexar las canciones indicadas (o las elimina si ya no existen)"""
+    ids = [int(i) for i in ids]
+    if not ids or not disponible():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLA_FTS} WHERE rowid IN ({_placeholders(ids)})", ids)
+        cursor.execute(
+            f"INSERT INTO {TABLA_FTS} (rowid, titulo, artistas, album) "
+            f"{SQL_DATOS} WHERE c.id IN ({_placeholders(ids)})",
+            ids,
+        )
+
+
+def eliminar_canciones(ids):
+    ids = [int(i) for i in ids]
+    if not ids or not disponible():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLA_FTS} WHERE rowid IN ({_placeholders(ids)})", ids)
+
+
+def reconstruir_indice():
+    """Vacía y rellena el índice con todo el catálogo. Devuelve el número de filas"""
+    if not disponible():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(SQL_CREAR)
+        cursor.execute(f"DELETE FROM {TABLA_FTS}")
+        cursor.execute(f"INSERT INTO {TABLA_FTS} (rowid, titulo, artistas, album) {SQL_DATOS}")
+        cursor.execute(f"INSERT INTO {TABLA_FTS} ({TABLA_FTS}) VALUES ('optimize')")
+        cursor.execute(f"SELECT count(*) FROM {TABLA_FTS}")
+        return cursor.fetchone()[0]
+
+
+def construir_consulta(query, todas=True):
+    """
+    Convierte el texto del usuario en una expresión MATCH de FTS5.
+    Cada palabra se entrecomilla (para que no se interprete como operador)
+    y se busca como prefijo. `todas` exige todas las palabras; si no, basta una.
+    """
+    tokens = TOKEN_RE.findall(query)
+    if not tokens:
+        return ''
+    operador = ' AND ' if todas else ' OR '
+    return operador.join(f'"{token}"*' for token in tokens)
+
+
+def buscar_ids(query, limit=10, todas=True):
+    """Ids de canciones activas que coinciden con `query`, ordenados por relevancia"""
+    if not disponible():
+        return _buscar_ids_icontains(query, limit, todas)
+
+    expresion = construir_consulta(query, todas)
+    if not expresion:
+        return []
+    pesos = ', '.join(str(p) for p in PESOS_BM25)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT f.rowid FROM {TABLA_FTS} f "
+            f"JOIN music_cancion c ON c.id = f.rowid "
+            f"WHERE {TABLA_FTS} MATCH %s AND c.activa "
+            f"ORDER BY bm25({TABLA_FTS}, {pesos}) LIMIT %s",
+            [expresion, limit],
+        )
+        return [fila[0] for fila in cursor.fetchall()]
+
+
+def _buscar_ids_icontains(query, limit, todas):
+    from .models import Cancion
+
+    palabras = [query] if todas else query.split()
+    if not palabras:
+        return []
+    filtro = reduce(
+        lambda x, y: x | y,
+        [Q(titulo__icontains=p) | Q(artistas__nombre__icontains=p) for p in palabras],
+    )
+    return list(
+        Cancion.objects.filter(filtro, activa=True).distinct().values_list('id', flat=True)[:limit]
+    )
@@ -0,0 +1,99 @@
+"""
+Contadores desnormalizados de Artista (total_canciones, total_albums),
+Album (total_canciones, duracion_segundos) y Playlist (duracion_segundos).
+
+Las señales de `music.signals` los ajustan con UPDATE ... SET x = x ± n
+(F()) y `manage.py reconcile_counters` los recalcula todos de una vez,
+por ejemplo después de cargas masivas que no disparan señales.
+"""
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest
+
+
+def ajustar(modelo, campo, ids, delta):
+    """Suma `delta` al contador `campo` de las filas `ids`"""
+    ids = list(ids)
+    if not ids or not delta:
+        return
+    # Greatest evita que un contador desfasado baje de cero (columna sin signo)
+    modelo.objects.filter(pk__in=ids).update(**{campo: Greatest(F(campo) + delta, 0)})
+
+
+def ajustar_por_id(modelo, campo, deltas):
+    """Aplica {id: delta}, agrupando los ids con el mismo delta en un único UPDATE"""
+    por_delta = {}
+    for objeto_id, delta in deltas.items():
+        if objeto_id is not None and delta:
+            por_delta.setdefault(delta, []).append(objeto_id)
+    for delta, ids in por_delta.items():
+        ajustar(modelo, campo, ids, delta)
+
+
+def duracion():
+    """Duración de una canción en segundos como expresión SQL"""
+    return F('minutos') * 60 + F('segundos')
+
+
+def duraciones(Cancion, ids):
+    """{cancion_id: segundos} de las canciones `ids` en una consulta"""
+    return {
+        cancion_id: total
+        for cancion_id, total in Cancion.objects.filter(pk__in=ids)
+        .annotate(total=duracion()).values_list('id', 'total')
+    }
+
+
+def _conteo(through, campo_filtro, campo_grupo):
+    return Coalesce(
+        Subquery(
+            through.objects.filter(**{campo_filtro: OuterRef('pk')})
+            .order_by().values(campo_filtro).annotate(n=Count(campo_grupo)).values('n'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def recalcular(Artista, Album, Cancion):
+    """Recalcula todos los contadores con un UPDATE por columna"""
+    Artista.objects.update(
+        total_canciones=_conteo(Cancion.artistas.through, 'artista_id', 'cancion_id'),
+        total_albums=_conteo(Album.artistas.through, 'artista_id', 'album_id'),
+    )
+    Album.objects.update(
+        total_canciones=Coalesce(
+            Subquery(
+                Cancion.objects.filter(album_id=OuterRef('pk')).order_by()
+                .values('album_id').annotate(n=Count('id')).values('n'),
+                output_field=IntegerField(),
+            ),
+            0,
+        ),
+    )
+
+
+def _suma_duracion(consulta, campo):
+    return Coalesce(
+        Subquery(
+            consulta.filter(**{campo: OuterRef('pk')}).order_by()
+            .values(campo).annotate(total=Sum(duracion())).values('total'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def recalcular_duraciones(Album, Playlist, Cancion, albums=None, playlists=None):
+    """
+    Recalcula la duración total de álbumes y playlists con un UPDATE por
+    tabla. `albums`/`playlists` limitan el recálculo a esos ids.
+    """
+    filas_albums = Album.objects.all()
+    if albums is not None:
+        filas_albums = filas_albums.filter(pk__in=[pk for pk in albums if pk is not None])
+    filas_albums.update(duracion_segundos=_suma_duracion(Cancion.objects.all(), 'album_id'))
+
+    filas_playlists = Playlist.objects.all()
+    if playlists is not None:
+        filas_playlists = filas_playlists.filter(pk__in=playlists)
+    filas_playlists.update(duracion_segundos=_suma_duracion(Cancion.objects.all(), 'playlists'))
@@ -0,0 +1,197 @@
+"""
+Índice de trigramas en memoria para sugerencias tolerantes a errores
+("Shakria" -> "Shakira").
+
+Se indexan los títulos de las canciones activas y los nombres de los
+artistas. Las listas de apariciones de cada trigrama son `array('I')`
+con posiciones de entrada, de modo que el índice ocupa pocos bytes por
+término. Las actualizaciones (desde `music.signals`) marcan la entrada
+antigua como borrada y añaden una nueva; cuando hay demasiadas entradas
+borradas el índice se compacta.
+"""
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from collections import Counter, defaultdict
+from itertools import chain
+
+from django.conf import settings
+
+CANCION = 'cancion'
+ARTISTA = 'artista'
+
+NO_ALFANUMERICO_RE = re.compile(r'[^a-z0-9]+')
+
+
+def normalizar(texto):
+    """Minúsculas, sin tildes y sólo letras/números separados por un espacio"""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+    return NO_ALFANUMERICO_RE.sub(' ', texto).strip()
+
+
+def trigramas(texto):
+    """Trigramas de cada palabra con relleno, al estilo de pg_trgm"""
+    resultado = set()
+    for palabra in normalizar(texto).split():
+        palabra = f'  {palabra} '
+        for i in range(len(palabra) - 2):
+            resultado.add(palabra[i:i + 3])
+    return resultado
+
+
+class IndiceTrigramas:
+    def __init__(self):
+        self.tipos = []                  # CANCION / ARTISTA por entrada
+        self.ids = array('Q')            # id del objeto por entrada
+        self.textos = []                 # texto original por entrada
+        self.tamanos = array('H')        # número de trigramas por entrada
+        self.vivas = bytearray()         # 1 si la entrada sigue vigente
+        self.posiciones = {}             # (tipo, id) -> entrada vigente
+        self.apariciones = defaultdict(lambda: array('I'))
+        self.borradas = 0
+
+    def __len__(self):
+        return len(self.posiciones)
+
+    def agregar(self, tipo, objeto_id, texto):
+        self.eliminar(tipo, objeto_id)
+        grams = trigramas(texto)
+        if not grams:
+            return
+        entrada = len(self.tipos)
+        self.tipos.append(tipo)
+        self.ids.append(objeto_id)
+        self.textos.append(texto)
+        self.tamanos.append(min(len(grams), 0xFFFF))
+        self.vivas.append(1)
+        self.posiciones[(tipo, objeto_id)] = entrada
+        for gram in grams:
+            self.apariciones[gram].append(entrada)
+
+    def eliminar(self, tipo, objeto_id):
+        entrada = self.posiciones.pop((tipo, objeto_id), None)
+        if entrada is None:
+            return
+        self.vivas[entrada] = 0
+        self.borradas += 1
+        if self.borradas > 1000 and self.borradas > len(self.tipos) // 4:
+            self.compactar()
+
+    def compactar(self):
+        """Reconstruye los arrays descartando las entradas borradas"""
+        vigentes = [(self.tipos[i], self.ids[i], self.textos[i]) for i in self.posiciones.values()]
+        self.__init__()
+        for tipo, objeto_id, texto in vigentes:
+            self.agregar(tipo, objeto_id, texto)
+
+    def buscar(self, query, limit=5, umbral=0.3, tipo=None):
+        """
+        Devuelve [(puntuacion, tipo, id, texto)] ordenados por similitud.
+        La similitud es el índice de Jaccard entre conjuntos de trigramas.
+        """
+        grams = trigramas(query)
+        if not grams:
+            return []
+        listas = [self.apariciones[g] for g in grams if g in self.apariciones]
+        # Counter sobre la concatenación cuenta los trigramas compartidos en C
+        comunes = Counter(chain.from_iterable(listas))
+
+        n = len(grams)
+        candidatos = []
+        for entrada, compartidos in comunes.items():
+            if not self.vivas[entrada]:
+                continue
+            if tipo is not None and self.tipos[entrada] != tipo:
+                continue
+            puntuacion = compartidos / (n + self.tamanos[entrada] - compartidos)
+            if puntuacion >= umbral:
+                candidatos.append((puntuacion, entrada))
+
+        mejores = heapq.nlargest(limit, candidatos)
+        return [
+            (round(puntuacion, 3), self.tipos[e], self.ids[e], self.textos[e])
+            for puntuacion, e in mejores
+        ]
+
+
+# --- ÍNDICE DEL PROCESO ---
+
+_indice = None
+_construido_en = 0.0
+_lock = threading.Lock()
+
+
+def _construir():
+    from .models import Artista, Cancion
+
+    indice = IndiceTrigramas()
+    for cancion_id, titulo in Cancion.objects.filter(activa=True).values_list('id', 'titulo').iterator():
+        indice.agregar(CANCION, cancion_id, titulo)
+    for artista_id, nombre in Artista.objects.values_list('id', 'nombre').iterator():
+        indice.agregar(ARTISTA, artista_id, nombre)
+    return indice
+
+
+def get_indice():
+    """
+    Devuelve el índice del proceso, construyéndolo la primera vez. Se
+    reconstruye cada TRIGRAMAS_REFRESCO segundos para recoger los cambios
+    hechos por otros procesos (las señales sólo llegan al proceso propio).
+    """
+    global _indice, _construido_en
+    refresco = getattr(settings, 'TRIGRAMAS_REFRESCO', 600)
+    if _indice is None or (refresco and time.monotonic() - _construido_en > refresco):
+        with _lock:
+            if _indice is None or (refresco and time.monotonic() - _construido_en > refresco):
+                _indice = _construir()
+                _construido_en = time.monotonic()
+    return _indice
+
+
+def actualizar(tipo, objeto_id, texto=None):
+    """Aplica un cambio al índice si ya está construido (texto None = eliminar)"""
+    if _indice is None:
+        return
+    with _lock:
+        if texto is None:
+            _indice.eliminar(tipo, objeto_id)
+        else:
+            _indice.agregar(tipo, objeto_id, texto)
+
+
+def invalidar():
+    global _indice
+    with _lock:
+        _indice = None
+
+
+def quisiste_decir(query, limit=5):
+    indice = get_indice()
+    with _lock:
+        return indice.buscar(query, limit=limit)
+
+
+def canciones_sugeridas(query, limit=5):
+    """
+    Ids de canciones para `query` a partir de los candidatos difusos.
+    Un artista candidato aporta sus canciones activas más recientes.
+    """
+    from .models import Cancion
+
+    ids = []
+    for _, tipo, objeto_id, _ in quisiste_decir(query, limit=limit):
+        if len(ids) >= limit:
+            break
+        if tipo == CANCION:
+            if objeto_id not in ids:
+                ids.append(objeto_id)
+        else:
+            for cancion_id in Cancion.objects.filter(artistas=objeto_id, activa=True) \
+                    .order_by('-fecha_subida').values_list('id', flat=True)[:limit - len(ids)]:
+                if cancion_id not in ids:
+                    ids.append(cancion_id)
+    return ids[:limit]
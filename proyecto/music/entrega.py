@@ -0,0 +1,187 @@
+"""
+Entrega de audio mediante URLs firmadas y con caducidad.
+
+La vista firmada sólo valida la firma y delega en un backend configurable
+(`AUDIO_ENTREGA_BACKEND`) la transferencia de los bytes:
+
+- DjangoBackend: el propio worker sirve el archivo por bloques (desarrollo).
+- XAccelRedirectBackend: nginx sirve el archivo mediante X-Accel-Redirect.
+- XSendfileBackend: lighttpd/apache sirven el archivo mediante X-Sendfile.
+- SendfileBackend: alternativa en Python puro; entrega el descriptor al
+  servidor WSGI (wsgi.file_wrapper) para que use os.sendfile en Linux.
+"""
+import mimetypes
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.module_loading import import_string
+
+from .almacenamiento import huella
+from .streaming import CHUNK_SIZE, servir_archivo
+from .transcodificacion import calidad_defecto, seleccionar_archivo
+
+SALT_FIRMA = 'music.entrega.audio'
+
+
+def _ttl():
+    return getattr(settings, 'AUDIO_URL_TTL', 300)
+
+
+def _calcular_firma(cancion_id, expira, contenido=None):
+    # La huella de ?v= entra en la firma: no se puede cambiar por la de otra versión
+    mensaje = f'{cancion_id}:{expira}:{contenido or ""}'
+    return salted_hmac(SALT_FIRMA, mensaje, algorithm='sha256').hexdigest()[:32]
+
+
+def firmar_url_audio(cancion_id, ttl=None, contenido=None):
+    """
+    Devuelve la URL firmada para reproducir una canción durante `ttl`
+    segundos; `contenido` (prefijo de la huella) fija el archivo entregado.
+    """
+    expira = int(time.time()) + (ttl if ttl is not None else _ttl())
+    url = reverse('audio_firmado', kwargs={'cancion_id': cancion_id})
+    url = f'{url}?e={expira}&s={_calcular_firma(cancion_id, expira, contenido)}'
+    return f'{url}&v={contenido}' if contenido else url
+
+
+def verificar_firma(cancion_id, expira, firma, contenido=None):
+    """Comprueba que la firma corresponde a la canción (y a su ?v=) y que no ha caducado"""
+    try:
+        expira = int(expira)
+    except (TypeError, ValueError):
+        return False
+    if expira < time.time() or not firma:
+        return False
+    return constant_time_compare(firma, _calcular_firma(cancion_id, expira, contenido))
+
+
+def url_audio(cancion, calidad=None):
+    """
+    URL que debe usar el reproductor según el modo configurado. Lleva la
+    huella del archivo elegido para `calidad` (?v=): cada URL entrega siempre
+    los mismos bytes aunque después termine otra versión, así que las
+    peticiones de rango en curso no mezclan archivos y se puede cachear
+    para siempre.
+    """
+    archivo = seleccionar_archivo(cancion, calidad or calidad_defecto()) if cancion.archivo else None
+    contenido = huella(archivo.name) if archivo else None
+    contenido = contenido[:16] if contenido else None
+    if getattr(settings, 'AUDIO_URLS_FIRMADAS', False):
+        # La firma se comprueba en cada petición de rango: debe durar al menos la canción
+        return firmar_url_audio(cancion.id, _ttl() + cancion.duracion_en_segundos, contenido)
+    url = reverse('stream_cancion', kwargs={'cancion_id': cancion.id})
+    return f'{url}?v={contenido}' if contenido else url
+
+
+def url_hls(cancion):
+    """URL de la lista maestra HLS o None si la canción no está empaquetada"""
+    if not cancion.hls:
+        return None
+    return reverse('hls_archivo', kwargs={'ruta': cancion.hls.split('/', 1)[1]})
+
+
+# --- BACKENDS ---
+
+class BaseBackend:
+    def responder(self, request, field_file):
+        raise NotImplementedError
+
+    def _content_type(self, field_file):
+        return mimetypes.guess_type(field_file.name)[0] or 'application/octet-stream'
+
+
+class DjangoBackend(BaseBackend):
+    """Sirve el archivo desde el worker (igual que /stream/)"""
+
+    def responder(self, request, field_file):
+        return servir_archivo(request, field_file)
+
+
+class XAccelRedirectBackend(BaseBackend):
+    """
+    nginx: el worker sólo responde con la ruta interna y nginx hace el sendfile.
+
+        location /protected-media/ {
+            internal;
+            alias /ruta/a/media/;
+        }
+    """
+
+    def responder(self, request, field_file):
+        prefijo = getattr(settings, 'AUDIO_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+        respuesta = HttpResponse(content_type=self._content_type(field_file))
+        respuesta['X-Accel-Redirect'] = prefijo.rstrip('/') + '/' + field_file.name.lstrip('/')
+        return respuesta
+
+
+class XSendfileBackend(BaseBackend):
+    """lighttpd/apache (mod_xsendfile): se indica la ruta absoluta del archivo"""
+
+    def responder(self, request, field_file):
+        respuesta = HttpResponse(content_type=self._content_type(field_file))
+        respuesta['X-Sendfile'] = field_file.path
+        return respuesta
+
+
+class RangoArchivo:
+    """
+    Envoltorio de un archivo abierto y ya posicionado que limita la lectura
+    a `longitud` bytes. Expone fileno() para que el servidor WSGI pueda
+    transferirlo con os.sendfile a través de wsgi.file_wrapper.
+    """
+
+    def __init__(self, archivo, inicio, longitud):
+        self.archivo = archivo
+        self.restante = longitud
+        archivo.seek(inicio)
+
+    def fileno(self):
+        return self.archivo.fileno()
+
+    def read(self, size=-1):
+        if self.restante <= 0:
+            return b''
+        if size is None or size < 0 or size > self.restante:
+            size = self.restante
+        bloque = self.archivo.read(size)
+        self.restante -= len(bloque)
+        return bloque
+
+    def __iter__(self):
+        while True:
+            bloque = self.read(CHUNK_SIZE)
+            if not bloque:
+                break
+            yield bloque
+
+    def close(self):
+        self.archivo.close()
+
+
+class SendfileBackend(BaseBackend):
+    """
+    Alternativa sin proxy: el worker no copia los bytes en Python, sino que
+    entrega el descriptor al servidor WSGI, que en Linux usa os.sendfile
+    (p. ej. gunicorn). Si el servidor no lo soporta se lee por bloques.
+    Range, HEAD y las cabeceras condicionales son las de servir_archivo.
+    """
+
+    @staticmethod
+    def _abrir(field_file, inicio, longitud):
+        return RangoArchivo(open(field_file.path, 'rb'), inicio, longitud)
+
+    def responder(self, request, field_file):
+        return servir_archivo(request, field_file, self._content_type(field_file), abrir=self._abrir)
+
+
+@lru_cache(maxsize=None)
+def _cargar_backend(ruta):
+    return import_string(ruta)()
+
+
+def get_backend():
+    return _cargar_backend(getattr(settings, 'AUDIO_ENTREGA_BACKEND', 'music.entrega.DjangoBackend'))
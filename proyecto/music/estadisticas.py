@@ -0,0 +1,99 @@
+"""
+Agregación incremental de Reproduccion en EstadisticaCancion/EstadisticaArtista.
+
+Se procesan sólo las filas con id mayor que la marca guardada en
+MarcaAgregacion, por tramos, y la marca avanza en la misma transacción que
+los totales: volver a ejecutar el proceso no cuenta dos veces nada.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import EstadisticaArtista, EstadisticaCancion, MarcaAgregacion, Reproduccion
+
+MARCA = 'reproducciones'
+PERIODOS = (
+    ('hora', TruncHour),
+    ('dia', TruncDay),
+)
+
+
+def _acumular(modelo, campo, periodo, filas):
+    """Suma los conteos `filas` ({campo, inicio, n}) a las filas agregadas existentes"""
+    conteos = {}
+    for fila in filas:
+        clave = (fila[campo], fila['inicio'])
+        conteos[clave] = conteos.get(clave, 0) + fila['n']
+    if not conteos:
+        return
+
+    inicios = [clave[1] for clave in conteos]
+    existentes = modelo.objects.filter(
+        periodo=periodo, inicio__gte=min(inicios), inicio__lte=max(inicios),
+        **{f'{campo}_id__in': {clave[0] for clave in conteos}},
+    )
+    actualizar = []
+    for estadistica in existentes:
+        clave = (getattr(estadistica, f'{campo}_id'), estadistica.inicio)
+        if clave in conteos:
+            estadistica.total += conteos.pop(clave)
+            actualizar.append(estadistica)
+
+    modelo.objects.bulk_update(actualizar, ['total'], batch_size=500)
+    modelo.objects.bulk_create(
+        [
+            modelo(**{f'{campo}_id': objeto_id}, periodo=periodo, inicio=inicio, total=n)
+            for (objeto_id, inicio), n in conteos.items()
+        ],
+        batch_size=500,
+    )
+
+
+def agregar_reproducciones(lote=50000):
+    """Incorpora las reproducciones nuevas a las tablas agregadas. Devuelve cuántas"""
+    procesadas = 0
+    while True:
+        with transaction.atomic():
+            marca, _ = MarcaAgregacion.objects.select_for_update().get_or_create(nombre=MARCA)
+            pendientes = Reproduccion.objects.filter(id__gt=marca.ultimo_id).order_by('id')
+            tope = list(pendientes.values_list('id', flat=True)[lote - 1:lote])
+            if not tope:
+                tope = list(pendientes.reverse().values_list('id', flat=True)[:1])
+            if not tope:
+                return procesadas
+
+            filas = Reproduccion.objects.filter(id__gt=marca.ultimo_id, id__lte=tope[0]).order_by()
+            for periodo, truncar in PERIODOS:
+                por_cancion = filas.annotate(inicio=truncar('fecha_reproduccion')) \
+                    .values('cancion', 'inicio').annotate(n=Count('id'))
+                _acumular(EstadisticaCancion, 'cancion', periodo, por_cancion)
+
+                por_artista = filas.filter(cancion__artistas__isnull=False) \
+                    .annotate(inicio=truncar('fecha_reproduccion')) \
+                    .values('inicio', artista=F('cancion__artistas')).annotate(n=Count('id'))
+                _acumular(EstadisticaArtista, 'artista', periodo, por_artista)
+
+            procesadas += filas.count()
+            marca.ultimo_id = tope[0]
+            marca.save(update_fields=['ultimo_id', 'fecha_actualizacion'])
+
+
+def resumen_reproducciones(dias=7, top=5):
+    """Totales para el panel de administración leídos de las tablas diarias"""
+    hoy = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    desde = hoy - timedelta(days=dias - 1)
+    diarias = EstadisticaCancion.objects.filter(periodo='dia', inicio__gte=desde)
+
+    return {
+        'reproducciones_hoy': diarias.filter(inicio=hoy).aggregate(total=Sum('total'))['total'] or 0,
+        'reproducciones_periodo': diarias.aggregate(total=Sum('total'))['total'] or 0,
+        'top_canciones': list(
+            diarias.values('cancion__id', 'cancion__titulo')
+            .annotate(total_periodo=Sum('total'))
+            .order_by('-total_periodo')[:top]
+        ),
+        'dias_resumen': dias,
+    }
@@ -1,6 +1,11 @@
+import os
+
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import UploadedFile
+from .metadatos import ErrorMetadatos, leer_metadatos
 from .models import Artista, Album, Cancion
 
 class CustomUserCreationForm(UserCreationForm):
@@ -44,4 +49,65 @@ class AlbumForm(StyleMixin, forms.ModelForm):
 class CancionForm(StyleMixin, forms.ModelForm):
     class Meta:
         model = Cancion
-        fields = ['titulo', 'artistas', 'album', 'archivo', 'portada', 'minutos', 'segundos', 'activa'] 
+        fields = ['titulo', 'artistas', 'album', 'archivo', 'portada', 'minutos', 'segundos', 'activa']
+
+    # Se pueden dejar vacíos: se completan con lo que se lee del MP3
+    OPCIONALES = ('titulo', 'artistas', 'minutos', 'segundos')
+    EXTENSIONES_PORTADA = {'image/jpeg': 'jpg', 'image/png': 'png', 'image/gif': 'gif', 'image/webp': 'webp'}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metadatos = {}
+        for nombre in self.OPCIONALES:
+            self.fields[nombre].required = False
+            self.fields[nombre].help_text = 'Si se deja vacío se toma del archivo de audio.'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        archivo = cleaned_data.get('archivo')
+        # Sólo se analizan los archivos recién subidos (cabeceras ID3/MPEG). Los
+        # que no se reconocen (OGG, FLAC, M4A...) se aceptan sin metadatos: los
+        # campos se rellenan a mano
+        if isinstance(archivo, UploadedFile):
+            try:
+                self.metadatos = leer_metadatos(archivo)
+            except ErrorMetadatos:
+                self.metadatos = {}
+            finally:
+                archivo.seek(0)
+
+        if not cleaned_data.get('titulo'):
+            if self.metadatos.get('titulo'):
+                cleaned_data['titulo'] = self.metadatos['titulo'][:100]
+            else:
+                self.add_error('titulo', 'Este campo es obligatorio.')
+        if 'duracion' in self.metadatos and not cleaned_data.get('minutos') and not cleaned_data.get('segundos'):
+            cleaned_data['minutos'], cleaned_data['segundos'] = divmod(round(self.metadatos['duracion']), 60)
+        for nombre in ('minutos', 'segundos'):
+            if cleaned_data.get(nombre) is None:
+                cleaned_data[nombre] = 0
+        return cleaned_data
+
+    def save(self, commit=True):
+        cancion = self.instance
+        if self.metadatos:
+            cancion.bitrate = self.metadatos['bitrate']
+            if not cancion.album_id and self.metadatos.get('album'):
+                titulo = self.metadatos['album'][:100]
+                cancion.album = Album.objects.filter(titulo=titulo).first() or Album.objects.create(titulo=titulo)
+            if not cancion.portada and self.metadatos.get('portada'):
+                mime, datos = self.metadatos['portada']
+                extension = self.EXTENSIONES_PORTADA.get(mime, 'jpg')
+                nombre = os.path.splitext(os.path.basename(cancion.archivo.name))[0]
+                # Sin guardar todavía: FileField escribe el archivo al guardar la canción
+                # (con commit=False, cuando quien llama haga cancion.save())
+                cancion.portada = ContentFile(datos, name=f'{nombre}.{extension}')
+        return super().save(commit)
+
+    def _save_m2m(self):
+        super()._save_m2m()
+        if not self.cleaned_data.get('artistas') and self.metadatos.get('artista'):
+            self.instance.artistas.set([
+                Artista.objects.get_or_create(nombre=nombre[:100])[0]
+                for nombre in self.metadatos['artista']
+            ])
@@ -0,0 +1,182 @@
+"""
+Empaquetado HLS de las canciones para streaming adaptativo.
+
+Cada variante (el original y las versiones de music/transcodificacion.py
+ya listas) se corta en segmentos de unos HLS_SEGUNDOS segundos siguiendo
+los límites de los frames MPEG. No hace falta recodificar: un segmento es
+un trozo de MP3 ("packed audio" de HLS) precedido de la etiqueta ID3 con
+su marca de tiempo. Todas las variantes se cortan cada el mismo número de
+frames, así que los segmentos coinciden y el reproductor puede cambiar de
+calidad entre uno y otro.
+
+El paquete se guarda junto al audio en hls/<ab>/<sha256 del original>-<variantes>/
+(master.m3u8, <variante>/index.m3u8 y <variante>/NNN.mp3). La ruta depende
+del contenido y del conjunto de variantes, así que los archivos no cambian
+nunca y se pueden cachear indefinidamente en cualquier caché HTTP. Cuando
+termina una versión nueva se vacía Cancion.hls (ver music/transcodificacion.py)
+y `package_hls` escribe otro paquete que la incluye.
+"""
+import os
+import shutil
+import struct
+import tempfile
+
+from django.conf import settings
+
+from . import lotes
+from .almacenamiento import almacenamiento, calcular_hash, huella
+from .metadatos import buscar_frame, leer_cabecera_frame, leer_vbr
+
+CARPETA = 'hls'
+MAESTRA = 'master.m3u8'
+# Códec de MP3 en el atributo CODECS de HLS
+CODEC_MP3 = 'mp4a.40.34'
+
+
+def segundos_segmento():
+    return getattr(settings, 'HLS_SEGUNDOS', 6)
+
+
+def carpeta_paquete(contenido, etiquetas):
+    return f'{CARPETA}/{contenido[:2]}/{contenido}-{"-".join(sorted(etiquetas))}'
+
+
+def frames(datos):
+    """Genera (inicio, fin, cabecera) de cada frame de audio de un MP3 completo"""
+    inicio = 0
+    if datos[:3] == b'ID3' and len(datos) >= 10:
+        inicio = 10 + ((datos[6] << 21) | (datos[7] << 14) | (datos[8] << 7) | datos[9])
+        if datos[5] & 0x10:
+            inicio += 10
+    desplazamiento, frame = buscar_frame(datos[inicio:inicio + 64 * 1024])
+    if frame is None:
+        return
+    posicion = inicio + desplazamiento
+    # El frame con la cabecera Xing/Info no lleva audio
+    if leer_vbr(datos, posicion, frame):
+        posicion += frame['longitud']
+
+    while posicion < len(datos):
+        frame = leer_cabecera_frame(datos, posicion)
+        if frame is None:
+            if datos[posicion:posicion + 3] == b'TAG':
+                return
+            # Basura entre frames: se busca la siguiente sincronía
+            siguiente = datos.find(b'\xff', posicion + 1)
+            if siguiente < 0:
+                return
+            posicion = siguiente
+            continue
+        fin = min(posicion + frame['longitud'], len(datos))
+        yield posicion, fin, frame
+        posicion = fin
+
+
+def etiqueta_tiempo(segundos):
+    """ID3 PRIV con la marca de tiempo MPEG-TS (90 kHz) que HLS exige en packed audio"""
+    datos = b'com.apple.streaming.transportStreamTimestamp\x00' \
+        + struct.pack('>Q', round(segundos * 90000) & ((1 << 33) - 1))
+    marco = b'PRIV' + _syncsafe(len(datos)) + b'\x00\x00' + datos
+    return b'ID3\x04\x00\x00' + _syncsafe(len(marco)) + marco
+
+
+def _syncsafe(n):
+    return bytes((n >> desplazamiento) & 0x7F for desplazamiento in (21, 14, 7, 0))
+
+
+def segmentar(datos, segundos=None):
+    """Lista de (bytes, duración) de segmentos con el mismo número de frames"""
+    segundos = segundos or segundos_segmento()
+    segmentos = []
+    actual, inicio_actual, muestras, por_segmento, frecuencia = [], 0.0, 0, None, None
+    for inicio, fin, frame in frames(datos):
+        if por_segmento is None:
+            frecuencia = frame['frecuencia']
+            por_segmento = max(1, round(segundos * frecuencia / frame['muestras']))
+        actual.append(datos[inicio:fin])
+        muestras += frame['muestras']
+        if len(actual) == por_segmento:
+            duracion = muestras / frecuencia
+            segmentos.append((etiqueta_tiempo(inicio_actual) + b''.join(actual), duracion))
+            inicio_actual += duracion
+            actual, muestras = [], 0
+    if actual:
+        segmentos.append((etiqueta_tiempo(inicio_actual) + b''.join(actual), muestras / frecuencia))
+    return segmentos
+
+
+def lista_media(duraciones):
+    objetivo = max((int(d) + 1 for d in duraciones), default=1)
+    lineas = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{objetivo}',
+              '#EXT-X-PLAYLIST-TYPE:VOD', '#EXT-X-MEDIA-SEQUENCE:0']
+    for numero, duracion in enumerate(duraciones):
+        lineas += [f'#EXTINF:{duracion:.3f},', f'{numero:03d}.mp3']
+    lineas.append('#EXT-X-ENDLIST')
+    return '\n'.join(lineas) + '\n'
+
+
+def lista_maestra(variantes):
+    lineas = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for etiqueta, bitrate in sorted(variantes, key=lambda v: v[1]):
+        # BANDWIDTH es el pico en bits/s: se deja margen para la etiqueta ID3 y el relleno
+        lineas += [f'#EXT-X-STREAM-INF:BANDWIDTH={round(bitrate * 1000 * 1.05)},CODECS="{CODEC_MP3}"',
+                   f'{etiqueta}/index.m3u8']
+    return '\n'.join(lineas) + '\n'
+
+
+def empaquetar_rutas(contenido, variantes):
+    """
+    Escribe el paquete de `variantes` [(etiqueta, ruta, bitrate)] en la
+    carpeta del contenido y devuelve el nombre de la lista maestra. No toca
+    la base de datos, para poder ejecutarse en un pool de procesos.
+    """
+    carpeta = carpeta_paquete(contenido, [etiqueta for etiqueta, _, _ in variantes])
+    destino = almacenamiento.path(carpeta)
+    if os.path.exists(os.path.join(destino, MAESTRA)):
+        return f'{carpeta}/{MAESTRA}'
+
+    # Se escribe en una carpeta temporal y se mueve al final: nunca hay paquetes a medias
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    temporal = tempfile.mkdtemp(dir=os.path.dirname(destino), prefix='.tmp-')
+    try:
+        escritas = []
+        for etiqueta, ruta, bitrate in variantes:
+            with open(ruta, 'rb') as archivo:
+                segmentos = segmentar(archivo.read())
+            if not segmentos:
+                continue
+            os.makedirs(os.path.join(temporal, etiqueta))
+            for numero, (datos, _) in enumerate(segmentos):
+                with open(os.path.join(temporal, etiqueta, f'{numero:03d}.mp3'), 'wb') as archivo:
+                    archivo.write(datos)
+            with open(os.path.join(temporal, etiqueta, 'index.m3u8'), 'w') as archivo:
+                archivo.write(lista_media([duracion for _, duracion in segmentos]))
+            escritas.append((etiqueta, bitrate))
+        if not escritas:
+            return None
+        with open(os.path.join(temporal, MAESTRA), 'w') as archivo:
+            archivo.write(lista_maestra(escritas))
+        try:
+            os.rename(temporal, destino)
+        except OSError:
+            # Otro proceso empaquetó el mismo contenido a la vez
+            if not os.path.exists(os.path.join(destino, MAESTRA)):
+                raise
+    finally:
+        shutil.rmtree(temporal, ignore_errors=True)
+    return f'{carpeta}/{MAESTRA}'
+
+
+def variantes(cancion):
+    """(contenido, [(etiqueta, ruta, bitrate)]) de una canción: original y versiones listas"""
+    contenido = huella(cancion.archivo.name) or calcular_hash(cancion.archivo.path)
+    lista = [('original', cancion.archivo.path, cancion.bitrate or 320)]
+    for version in cancion.versiones.all():
+        if version.estado == 'lista' and version.archivo and version.bitrate < (cancion.bitrate or 320):
+            lista.append((version.calidad, version.archivo.path, version.bitrate))
+    return contenido, lista
+
+
+def empaquetar_en_lote(tareas, procesos=None):
+    """Genera (cancion_id, maestra, error) para tareas (cancion_id, contenido, variantes)"""
+    return lotes.en_lote(empaquetar_rutas, tareas, procesos, chunksize=4)
@@ -0,0 +1,183 @@
+"""
+Huellas acústicas para encontrar la misma grabación subida varias veces.
+
+`manage.py fingerprint_audio` decodifica cada audio (mono, FRECUENCIA Hz) y
+calcula con NumPy su espectrograma (ventanas de Hann de VENTANA muestras
+cada SALTO). Los picos son los máximos locales de la magnitud en un
+vecindario tiempo x frecuencia, limitados a PICOS_POR_SEGUNDO de los más
+fuertes. Cada pico (ancla) se empareja con los ABANICO siguientes dentro
+de una zona de hasta DT_MAXIMO ventanas, y cada par da un hash de 24 bits
+(frecuencia del ancla, frecuencia del destino y distancia en ventanas)
+que no depende del nombre, las etiquetas, el volumen ni el códec.
+
+Los hashes se guardan en HuellaAcustica con el instante del ancla: es un
+índice invertido hash -> (canción, tiempo). `manage.py find_duplicates`
+busca los hashes de una canción en el índice (un puñado de consultas por
+valor indexado, sin comparar con todo el catálogo) y cuenta, para cada
+canción encontrada, cuántos coinciden con el mismo desfase de tiempo: la
+misma grabación acumula muchos hashes alineados; dos canciones distintas
+solo comparten algunos sueltos.
+"""
+import subprocess
+
+import numpy as np
+from django.conf import settings
+from numpy.lib.stride_tricks import sliding_window_view
+
+from . import lotes, onda
+from .models import HuellaAcustica
+
+FRECUENCIA = 8000
+VENTANA = 1024
+SALTO = 256
+VECINDARIO_TIEMPO = 10
+VECINDARIO_FRECUENCIA = 10
+PICOS_POR_SEGUNDO = 20
+ABANICO = 5
+DT_MAXIMO = 63
+# Un pico debe superar esta fracción del pico más fuerte del audio (-60 dB)
+NIVEL_MINIMO = 1e-3
+# Hashes de la canción que se buscan en el índice y valores por consulta
+CONSULTA_MAXIMA = 3000
+LOTE_CONSULTA = 500
+
+VENTANAS_POR_SEGUNDO = FRECUENCIA / SALTO
+
+
+def umbral():
+    """Fracción de hashes alineados a partir de la cual dos canciones son la misma grabación"""
+    return getattr(settings, 'HUELLAS_UMBRAL', 0.1)
+
+
+def minimo_coincidencias():
+    return getattr(settings, 'HUELLAS_MINIMO', 20)
+
+
+def espectrograma(muestras):
+    """Magnitud (ventanas x bins) de la STFT, sin el bin de continua ni el de Nyquist"""
+    muestras = np.asarray(muestras, dtype=np.float32)
+    if len(muestras) < VENTANA:
+        return np.zeros((0, VENTANA // 2 - 1), dtype=np.float32)
+    tramas = sliding_window_view(muestras, VENTANA)[::SALTO]
+    espectro = np.abs(np.fft.rfft(tramas * np.hanning(VENTANA).astype(np.float32), axis=1))
+    return espectro[:, 1:VENTANA // 2].astype(np.float32)
+
+
+def _maximo_local(magnitud):
+    """Máximo de cada celda en su vecindario (filtro separable: frecuencia y luego tiempo)"""
+    resultado = magnitud
+    for eje, radio in ((1, VECINDARIO_FRECUENCIA), (0, VECINDARIO_TIEMPO)):
+        relleno = [(0, 0), (0, 0)]
+        relleno[eje] = (radio, radio)
+        ampliado = np.pad(resultado, relleno, constant_values=-1)
+        resultado = sliding_window_view(ampliado, 2 * radio + 1, axis=eje).max(axis=-1)
+    return resultado
+
+
+def picos(magnitud):
+    """(tiempos, frecuencias) de los picos, ordenados por tiempo y frecuencia"""
+    if not magnitud.size or magnitud.max() <= 0:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+    mascara = (magnitud == _maximo_local(magnitud)) & (magnitud > magnitud.max() * NIVEL_MINIMO)
+    tiempos, frecuencias = np.nonzero(mascara)
+    fuerza = magnitud[tiempos, frecuencias]
+
+    # Como mucho PICOS_POR_SEGUNDO por segundo: los más fuertes de cada uno
+    segundo = (tiempos / VENTANAS_POR_SEGUNDO).astype(np.int64)
+    orden = np.lexsort((-fuerza, segundo))
+    agrupado = segundo[orden]
+    rango = np.arange(len(orden)) - np.searchsorted(agrupado, agrupado, side='left')
+    elegidos = orden[rango < PICOS_POR_SEGUNDO]
+
+    elegidos = elegidos[np.lexsort((frecuencias[elegidos], tiempos[elegidos]))]
+    # Los bins empiezan en 1 porque se quitó el de continua
+    return tiempos[elegidos].astype(np.int32), (frecuencias[elegidos] + 1).astype(np.int32)
+
+
+def hashes(tiempos, frecuencias):
+    """
+    (valores, tiempos) de los pares ancla-destino: cada ancla se une a los
+    ABANICO primeros picos que empiezan al menos una ventana después y como
+    mucho DT_MAXIMO ventanas después.
+    """
+    inicio = np.searchsorted(tiempos, tiempos + 1, side='left')
+    valores, anclas = [], []
+    for k in range(ABANICO):
+        destino = inicio + k
+        validos = destino < len(tiempos)
+        origen, destino = np.nonzero(validos)[0], destino[validos]
+        distancia = tiempos[destino] - tiempos[origen]
+        cerca = distancia <= DT_MAXIMO
+        origen, destino, distancia = origen[cerca], destino[cerca], distancia[cerca]
+        # 9 bits por frecuencia (bins 1..511) y 6 bits de distancia
+        valores.append((frecuencias[origen] << 15) | (frecuencias[destino] << 6) | distancia)
+        anclas.append(tiempos[origen])
+    if not valores:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+    return np.concatenate(valores).astype(np.int32), np.concatenate(anclas).astype(np.int32)
+
+
+def calcular(muestras):
+    """(valores, tiempos) de la huella de unas muestras mono a FRECUENCIA Hz"""
+    return hashes(*picos(espectrograma(muestras)))
+
+
+def coincidencias(valores, tiempos, excluir=None):
+    """
+    {cancion_id: hashes alineados} de las canciones del índice que comparten
+    hashes con la huella dada. La puntuación de cada canción es el mayor
+    número de coincidencias con un mismo desfase (contando también el
+    desfase contiguo, porque un pico puede caer en la ventana de al lado).
+    """
+    if len(valores) > CONSULTA_MAXIMA:
+        muestra = np.linspace(0, len(valores) - 1, CONSULTA_MAXIMA).astype(int)
+        valores, tiempos = valores[muestra], tiempos[muestra]
+    orden = np.argsort(valores, kind='stable')
+    valores, tiempos = np.asarray(valores)[orden], np.asarray(tiempos)[orden]
+
+    filas = []
+    unicos = np.unique(valores).tolist()
+    for inicio in range(0, len(unicos), LOTE_CONSULTA):
+        consulta = HuellaAcustica.objects.filter(valor__in=unicos[inicio:inicio + LOTE_CONSULTA])
+        if excluir is not None:
+            consulta = consulta.exclude(cancion_id=excluir)
+        filas.extend(consulta.values_list('valor', 'cancion_id', 'tiempo'))
+    if not filas:
+        return {}
+    encontrados = np.array(filas, dtype=np.int64)
+
+    # Cada fila del índice se cruza con todas las apariciones de su valor en la consulta
+    bajo = np.searchsorted(valores, encontrados[:, 0], side='left')
+    cuantos = np.searchsorted(valores, encontrados[:, 0], side='right') - bajo
+    fila = np.repeat(np.arange(len(encontrados)), cuantos)
+    desplazamiento = np.arange(cuantos.sum()) - np.repeat(np.cumsum(cuantos) - cuantos, cuantos)
+    propio = np.repeat(bajo, cuantos) + desplazamiento
+    pares = np.stack([encontrados[fila, 1], encontrados[fila, 2] - tiempos[propio]], axis=1)
+
+    # Histograma por (canción, desfase); filas ordenadas por canción y desfase
+    pares, cuenta = np.unique(pares, axis=0, return_counts=True)
+    canciones, desfases = pares[:, 0], pares[:, 1]
+    vecino = np.zeros_like(cuenta)
+    contiguo = (canciones[1:] == canciones[:-1]) & (desfases[1:] == desfases[:-1] + 1)
+    vecino[:-1][contiguo] = cuenta[1:][contiguo]
+    puntuacion = cuenta + vecino
+
+    resultado = {}
+    for cancion_id, valor in zip(canciones.tolist(), puntuacion.tolist()):
+        if valor > resultado.get(cancion_id, 0):
+            resultado[cancion_id] = valor
+    return resultado
+
+
+def consultados(valores):
+    """Hashes que coincidencias() busca en realidad (base para el umbral relativo)"""
+    return min(len(valores), CONSULTA_MAXIMA)
+
+
+def calcular_archivo(ruta):
+    return calcular(onda.decodificar(ruta, FRECUENCIA))
+
+
+def calcular_en_lote(tareas, procesos=None):
+    """Genera (clave, (valores, tiempos), error) para tareas (clave, ruta)"""
+    return lotes.en_lote(calcular_archivo, tareas, procesos, errores=(OSError, ValueError, subprocess.SubprocessError))
@@ -0,0 +1,223 @@
+"""
+Importación masiva de una carpeta de MP3 al catálogo.
+
+Las etiquetas y duraciones se leen en un pool de procesos
+(`metadatos.leer_en_lote`). Artistas y álbumes se resuelven con mapas en
+memoria cargados al empezar, y cada lote de pistas se escribe en una
+transacción con bulk_create (artistas, álbumes, canciones y filas de las
+tablas intermedias). Como bulk_create no dispara señales, al final de
+cada lote se indexan las canciones para la búsqueda y se encolan sus
+versiones de audio, y al terminar se recalculan los contadores.
+
+Los archivos se guardan por contenido (`music.almacenamiento`): una pista
+cuyos bytes ya figuran en el catálogo se salta. Así no se duplican archivos
+idénticos y, tras una interrupción, basta con volver a lanzarla.
+"""
+import os
+import shutil
+import time
+
+from django.db import transaction
+from django.utils.text import slugify
+
+from . import autocompletado, busqueda, contadores
+from .almacenamiento import CARPETA, almacenamiento, nombre_contenido, ruta_temporal
+from .metadatos import leer_en_lote
+from .models import Album, Artista, Cancion, Playlist, VersionAudio
+from .transcodificacion import CALIDADES, calidades_necesarias
+
+EXTENSIONES = ('.mp3',)
+
+
+def buscar_archivos(raiz):
+    """Rutas de audio bajo `raiz` en orden estable (para poder reanudar)"""
+    for carpeta, subcarpetas, archivos in os.walk(raiz):
+        subcarpetas.sort()
+        for nombre in sorted(archivos):
+            if nombre.lower().endswith(EXTENSIONES):
+                yield os.path.join(carpeta, nombre)
+
+
+def _slug_unico(texto, usados, largo=110):
+    base = (slugify(texto) or 'sin-titulo')[:largo - 8]
+    slug, n = base, 2
+    while slug in usados:
+        slug = f'{base}-{n}'
+        n += 1
+    usados.add(slug)
+    return slug
+
+
+class Importador:
+    def __init__(self, raiz, modo='copiar', lote=1000, procesos=None, simular=False, informar=None):
+        self.raiz = os.path.abspath(raiz)
+        self.modo = modo
+        self.lote = lote
+        self.procesos = procesos
+        self.simular = simular
+        self.informar = informar or (lambda mensaje: None)
+        self.estadisticas = {'leidas': 0, 'importadas': 0, 'existentes': 0, 'errores': 0,
+                             'artistas': 0, 'albums': 0}
+        self.albums_tocados = set()
+
+    def _cargar_mapas(self):
+        self.artistas = dict(Artista.objects.values_list('nombre', 'id'))
+        self.slugs = {
+            modelo: set(modelo.objects.values_list('slug', flat=True))
+            for modelo in (Artista, Album, Cancion)
+        }
+        # Un álbum se identifica por su título y el nombre de su artista principal
+        self.albums = {}
+        for album_id, titulo, artista in Album.artistas.through.objects \
+                .values_list('album_id', 'album__titulo', 'artista__nombre'):
+            self.albums.setdefault((titulo, artista), album_id)
+        for album_id, titulo in Album.objects.filter(artistas__isnull=True).values_list('id', 'titulo'):
+            self.albums.setdefault((titulo, None), album_id)
+        self.importados = set(
+            Cancion.objects.filter(archivo__startswith=f'{CARPETA}/')
+            .values_list('archivo', flat=True)
+        )
+
+    def _colocar(self, ruta, nombre):
+        final = almacenamiento.path(nombre)
+        # El nombre sale del contenido y sólo se ocupa con el archivo completo
+        if os.path.exists(final) and os.path.getsize(final) == os.path.getsize(ruta):
+            return
+        os.makedirs(os.path.dirname(final), exist_ok=True)
+        temporal = ruta_temporal(final)
+        try:
+            if self.modo == 'enlazar':
+                try:
+                    os.link(ruta, temporal)
+                except OSError:
+                    # Otro sistema de archivos: enlace simbólico
+                    os.symlink(ruta, temporal)
+            else:
+                shutil.copy2(ruta, temporal)
+            os.replace(temporal, final)
+        except BaseException:
+            if os.path.lexists(temporal):
+                os.remove(temporal)
+            raise
+
+    def ejecutar(self):
+        self._cargar_mapas()
+        pendientes = list(buscar_archivos(self.raiz))
+
+        inicio = time.monotonic()
+        grupo = []
+        for ruta, metadatos, error in leer_en_lote(pendientes, procesos=self.procesos, contenido=True):
+            self.estadisticas['leidas'] += 1
+            if error:
+                self.estadisticas['errores'] += 1
+                self.informar(f'{ruta}: {error}')
+                continue
+            metadatos['archivo'] = nombre_contenido(metadatos['sha256'], os.path.splitext(ruta)[1])
+            if metadatos['archivo'] in self.importados:
+                self.estadisticas['existentes'] += 1
+                continue
+            self.importados.add(metadatos['archivo'])
+            grupo.append((ruta, metadatos))
+            if len(grupo) >= self.lote:
+                self._guardar(grupo)
+                grupo = []
+                self._progreso(inicio, len(pendientes))
+        if grupo:
+            self._guardar(grupo)
+            self._progreso(inicio, len(pendientes))
+
+        if not self.simular and self.estadisticas['importadas']:
+            contadores.recalcular(Artista, Album, Cancion)
+            contadores.recalcular_duraciones(Album, Playlist, Cancion, albums=self.albums_tocados, playlists=[])
+            autocompletado.invalidar()
+        self.estadisticas['segundos'] = time.monotonic() - inicio
+        return self.estadisticas
+
+    def _progreso(self, inicio, total):
+        transcurrido = time.monotonic() - inicio
+        leidas = self.estadisticas['leidas']
+        self.informar(
+            f'{leidas}/{total} pistas leídas, {self.estadisticas["importadas"]} importadas '
+            f'({leidas / transcurrido if transcurrido else 0:.0f} pistas/s)'
+        )
+
+    def _artista(self, nombre, nuevos):
+        if nombre not in self.artistas:
+            artista = Artista(nombre=nombre, slug=_slug_unico(nombre, self.slugs[Artista]))
+            nuevos.append(artista)
+            self.artistas[nombre] = artista
+        return self.artistas[nombre]
+
+    def _guardar(self, grupo):
+        nuevos_artistas, nuevos_albums, filas = [], [], []
+        for ruta, metadatos in grupo:
+            titulo = (metadatos.get('titulo') or os.path.splitext(os.path.basename(ruta))[0])[:100]
+            nombres = list(dict.fromkeys(n[:100] for n in metadatos.get('artista', [])))
+            artistas = [self._artista(nombre, nuevos_artistas) for nombre in nombres]
+            album = None
+            if metadatos.get('album'):
+                titulo_album = metadatos['album'][:100]
+                clave = (titulo_album, nombres[0] if nombres else None)
+                album = self.albums.get(clave)
+                if album is None:
+                    album = Album(titulo=titulo_album, slug=_slug_unico(titulo_album, self.slugs[Album]))
+                    album.artistas_importacion = artistas[:1]
+                    nuevos_albums.append(album)
+                    self.albums[clave] = album
+            minutos, segundos = divmod(round(metadatos['duracion']), 60)
+            cancion = Cancion(
+                titulo=titulo,
+                slug=_slug_unico(titulo, self.slugs[Cancion]),
+                archivo=metadatos['archivo'],
+                minutos=minutos,
+                segundos=segundos,
+                bitrate=metadatos['bitrate'],
+            )
+            filas.append((ruta, cancion, artistas, album))
+
+        self.estadisticas['artistas'] += len(nuevos_artistas)
+        self.estadisticas['albums'] += len(nuevos_albums)
+        if self.simular:
+            self.estadisticas['importadas'] += len(filas)
+            return
+
+        with transaction.atomic():
+            Artista.objects.bulk_create(nuevos_artistas, batch_size=500)
+            for artista in nuevos_artistas:
+                self.artistas[artista.nombre] = artista.pk
+            Album.objects.bulk_create(nuevos_albums, batch_size=500)
+            Album.artistas.through.objects.bulk_create([
+                Album.artistas.through(album_id=album.pk, artista_id=self._id(artista))
+                for album in nuevos_albums for artista in album.artistas_importacion
+            ], batch_size=500)
+
+            canciones = []
+            for ruta, cancion, artistas, album in filas:
+                cancion.album_id = self._id(album)
+                canciones.append(cancion)
+            Cancion.objects.bulk_create(canciones, batch_size=500)
+            Cancion.artistas.through.objects.bulk_create([
+                Cancion.artistas.through(cancion_id=cancion.pk, artista_id=self._id(artista))
+                for _, cancion, artistas, _ in filas for artista in artistas
+            ], batch_size=500)
+            busqueda.indexar_canciones([cancion.pk for cancion in canciones])
+            VersionAudio.objects.bulk_create([
+                VersionAudio(cancion_id=cancion.pk, calidad=calidad, bitrate=CALIDADES[calidad])
+                for cancion in canciones for calidad in calidades_necesarias(cancion)
+            ], batch_size=500)
+
+            for ruta, cancion, _, _ in filas:
+                self._colocar(ruta, cancion.archivo.name)
+
+        # Tras guardar, los mapas guardan ids y no objetos
+        for clave, album in list(self.albums.items()):
+            if isinstance(album, Album):
+                self.albums[clave] = album.pk
+        self.albums_tocados.update(c.album_id for c in canciones if c.album_id)
+        self.estadisticas['importadas'] += len(canciones)
+
+    @staticmethod
+    def _id(objeto):
+        if objeto is None or isinstance(objeto, int):
+            return objeto
+        return objeto.pk
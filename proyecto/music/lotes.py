@@ -0,0 +1,57 @@
+"""
+Cálculos por lotes en un pool de procesos.
+
+Formas de onda, sonoridad, huellas acústicas, paquetes HLS y paletas se
+calculan igual: una función sobre muchos archivos repartida entre
+procesos, sin que un archivo dañado aborte el resto del lote. Aquí está
+ese envoltorio, el texto de error que se guarda o se muestra (el final
+del stderr de ffmpeg) y los argumentos comunes de sus comandos.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+
+def detalle_error(error, limite=500):
+    """Texto de un error; de un proceso fallido, el final de su stderr"""
+    detalle = getattr(error, 'stderr', None) or str(error)
+    if isinstance(detalle, bytes):
+        detalle = detalle.decode('utf-8', 'replace')
+    return detalle[-limite:]
+
+
+def _seguro(funcion, errores, tarea):
+    clave, *argumentos = tarea
+    try:
+        return clave, funcion(*argumentos), None
+    except errores as error:
+        return clave, None, detalle_error(error)
+
+
+def en_lote(funcion, tareas, procesos=None, errores=(OSError, ValueError), chunksize=1):
+    """
+    Genera (clave, resultado, error) para tareas (clave, *argumentos)
+    llamando a funcion(*argumentos) en un pool de procesos (procesos=1
+    trabaja en el proceso actual). `funcion` tiene que estar definida a
+    nivel de módulo para poder enviarla a otro proceso; las excepciones de
+    `errores` se devuelven como texto en vez de propagarse.
+    """
+    seguro = partial(_seguro, funcion, errores)
+    if procesos == 1:
+        yield from map(seguro, tareas)
+        return
+    executor = ProcessPoolExecutor(max_workers=procesos)
+    try:
+        yield from executor.map(seguro, tareas, chunksize=chunksize)
+    finally:
+        # Si quien consume el generador para antes, no se calcula el resto
+        executor.shutdown(cancel_futures=True)
+
+
+def anadir_argumentos(parser, todas=None):
+    """--procesos y, si se da su ayuda, --todas: los argumentos comunes de los comandos por lotes"""
+    if todas:
+        parser.add_argument('--todas', action='store_true', help=todas)
+    parser.add_argument(
+        '--procesos', type=int, default=None,
+        help='Procesos de cálculo (por defecto uno por CPU; 1 trabaja en este proceso)',
+    )
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from music import tendencias
+from music.estadisticas import agregar_reproducciones
+
+
+class Command(BaseCommand):
+    help = 'Agrega las reproducciones nuevas en las tablas de estadísticas por hora y por día'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote', type=int, default=50000,
+            help='Número máximo de reproducciones por transacción (por defecto 50000)',
+        )
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        total = agregar_reproducciones(lote=options['lote'])
+        tendencias.refrescar()
+        segundos = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} reproducciones agregadas en {segundos:.2f}s'
+        ))
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from music import lotes, sonoridad
+from music.almacenamiento import almacenamiento
+from music.models import Cancion
+
+
+class Command(BaseCommand):
+    help = 'Mide sonoridad integrada y pico real de las canciones y guarda su ganancia y la de sus álbumes'
+
+    def add_arguments(self, parser):
+        lotes.anadir_argumentos(
+            parser, todas='Vuelve a medir también las canciones ya medidas (p. ej. tras cambiar SONORIDAD_OBJETIVO)',
+        )
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        canciones = Cancion.objects.exclude(archivo='').exclude(archivo__isnull=True)
+        if not options['todas']:
+            canciones = canciones.filter(sonoridad__isnull=True)
+        # Las canciones que comparten archivo se miden una sola vez
+        por_archivo, album_de = {}, {}
+        for cancion_id, nombre, album_id in canciones.values_list('id', 'archivo', 'album_id').iterator():
+            por_archivo.setdefault(nombre, []).append(cancion_id)
+            album_de[cancion_id] = album_id
+
+        tareas = [(nombre, almacenamiento.path(nombre)) for nombre in por_archivo]
+        medidas, errores = [], 0
+        for nombre, resultado, error in sonoridad.analizar_en_lote(tareas, procesos=options['procesos']):
+            if error:
+                errores += 1
+                self.stderr.write(f'{nombre}: {error}')
+                continue
+            lufs, pico = resultado
+            for cancion_id in por_archivo[nombre]:
+                medidas.append(Cancion(
+                    pk=cancion_id, sonoridad=lufs, pico_real=pico, ganancia=sonoridad.ganancia(lufs, pico),
+                ))
+
+        with transaction.atomic():
+            # bulk_update no dispara señales: no se tocan contadores ni índices
+            Cancion.objects.bulk_update(medidas, ['sonoridad', 'pico_real', 'ganancia'], batch_size=500)
+            albums = {album_de[c.pk] for c in medidas if album_de[c.pk]}
+            sonoridad.actualizar_albums(albums)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(medidas)} canciones medidas y {len(albums)} álbumes actualizados, '
+            f'{errores} errores en {time.monotonic() - inicio:.2f}s'
+        ))
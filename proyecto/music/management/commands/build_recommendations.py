@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from music import recomendaciones
+
+
+class Command(BaseCommand):
+    help = ('Actualiza la matriz de coocurrencia con las reproducciones nuevas y las canciones '
+            'recomendadas de las canciones afectadas')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--completo', action='store_true',
+            help='Reconstruye la matriz desde cero con todas las reproducciones, favoritos y playlists',
+        )
+        parser.add_argument(
+            '--lote', type=int, default=50000,
+            help='Número máximo de reproducciones nuevas por ejecución incremental (por defecto 50000)',
+        )
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        if options['completo']:
+            pares, canciones = recomendaciones.reconstruir()
+            mensaje = f'Matriz reconstruida: {pares} pares, {canciones} canciones con recomendaciones'
+        else:
+            reproducciones, canciones = recomendaciones.actualizar(lote=options['lote'])
+            mensaje = f'{reproducciones} reproducciones nuevas, {canciones} canciones recalculadas'
+        self.stdout.write(self.style.SUCCESS(f'{mensaje} en {time.monotonic() - inicio:.2f}s'))
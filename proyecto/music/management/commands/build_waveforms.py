@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from music import lotes, onda
+from music.almacenamiento import CARPETA, almacenamiento, huella
+from music.models import Cancion, FormaOnda
+
+
+class Command(BaseCommand):
+    help = 'Decodifica cada audio una vez y guarda sus picos de forma de onda en varias resoluciones'
+
+    def add_arguments(self, parser):
+        lotes.anadir_argumentos(
+            parser, todas='Vuelve a calcular también los audios que ya tienen forma de onda',
+        )
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        resoluciones = onda.resoluciones()
+        # Un audio compartido por varias canciones se decodifica una sola vez
+        contenidos = {}
+        for nombre in Cancion.objects.filter(archivo__startswith=f'{CARPETA}/') \
+                .values_list('archivo', flat=True).distinct().iterator():
+            contenidos.setdefault(huella(nombre), nombre)
+        if not options['todas']:
+            hechos = set(FormaOnda.objects.filter(puntos=resoluciones[-1]).values_list('contenido', flat=True))
+            contenidos = {contenido: nombre for contenido, nombre in contenidos.items() if contenido not in hechos}
+
+        tareas = [(contenido, almacenamiento.path(nombre)) for contenido, nombre in contenidos.items()]
+        calculadas = errores = 0
+        for contenido, picos, error in onda.calcular_en_lote(tareas, procesos=options['procesos']):
+            if error:
+                errores += 1
+                self.stderr.write(f'{contenidos[contenido]}: {error}')
+                continue
+            with transaction.atomic():
+                FormaOnda.objects.filter(contenido=contenido).delete()
+                FormaOnda.objects.bulk_create([
+                    FormaOnda(contenido=contenido, puntos=puntos, datos=datos)
+                    for puntos, datos in picos.items()
+                ])
+            calculadas += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{calculadas} formas de onda calculadas, {errores} errores en {time.monotonic() - inicio:.2f}s'
+        ))
@@ -0,0 +1,113 @@
+import os
+import shutil
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from music import hls
+from music.almacenamiento import CARPETA, TEMPORAL_RE, almacenamiento, huella, referenciados
+from music.models import Cancion, FormaOnda
+
+
+class Command(BaseCommand):
+    help = 'Borra los archivos de audio direccionados por contenido, paquetes HLS y formas de onda que nadie referencia'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--gracia', type=int, default=3600,
+            help='Sólo borra archivos con más de N segundos, para no tocar subidas en curso (por defecto 3600)',
+        )
+        parser.add_argument(
+            '--migrar', action='store_true',
+            help='Antes, mueve al almacenamiento por contenido los archivos con nombre antiguo',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Informa sin borrar nada')
+
+    def handle(self, *args, **options):
+        if options['migrar']:
+            self.migrar(options['dry_run'])
+
+        usados = referenciados()
+        limite = time.time() - options['gracia']
+        raiz = almacenamiento.path(CARPETA)
+        huerfanos, liberados = [], 0
+        for carpeta, _, archivos in os.walk(raiz):
+            for nombre_archivo in archivos:
+                ruta = os.path.join(carpeta, nombre_archivo)
+                nombre = os.path.relpath(ruta, almacenamiento.location).replace(os.sep, '/')
+                abandonado = TEMPORAL_RE.match(nombre_archivo)
+                if (abandonado or (huella(nombre) and nombre not in usados)) and os.path.getmtime(ruta) < limite:
+                    huerfanos.append(nombre)
+                    liberados += os.path.getsize(ruta)
+
+        if not options['dry_run']:
+            # save() toca con el cerrojo lo que reutiliza: si se tocó mientras se recorría el disco, se queda
+            with almacenamiento.cerrojo():
+                for nombre in huerfanos:
+                    ruta = almacenamiento.path(nombre)
+                    if os.path.exists(ruta) and os.path.getmtime(ruta) < limite:
+                        almacenamiento.delete(nombre)
+        accion = 'Se borrarían' if options['dry_run'] else 'Borrados'
+        self.stdout.write(self.style.SUCCESS(
+            f'{accion} {len(huerfanos)} archivos huérfanos ({liberados / 1024 / 1024:.1f} MiB)'
+        ))
+        self.paquetes_hls(limite, options['dry_run'])
+        self.formas_onda(options['dry_run'])
+
+    def paquetes_hls(self, limite, simular):
+        """Borra los paquetes HLS (hls/<ab>/<sha256>/) que ninguna canción usa"""
+        usados = {
+            os.path.dirname(nombre)
+            for nombre in Cancion.objects.exclude(hls='').values_list('hls', flat=True)
+        }
+        raiz = almacenamiento.path(hls.CARPETA)
+        if not os.path.isdir(raiz):
+            return
+        huerfanos = []
+        for prefijo in os.listdir(raiz):
+            for contenido in os.listdir(os.path.join(raiz, prefijo)):
+                carpeta = f'{hls.CARPETA}/{prefijo}/{contenido}'
+                ruta = almacenamiento.path(carpeta)
+                if carpeta not in usados and os.path.getmtime(ruta) < limite:
+                    huerfanos.append(ruta)
+        if not simular:
+            for ruta in huerfanos:
+                shutil.rmtree(ruta, ignore_errors=True)
+        accion = 'Se borrarían' if simular else 'Borrados'
+        self.stdout.write(self.style.SUCCESS(f'{accion} {len(huerfanos)} paquetes HLS sin uso'))
+
+    def formas_onda(self, simular):
+        """Borra los picos de forma de onda de audios que ya no usa ninguna canción"""
+        contenidos = {
+            huella(nombre)
+            for nombre in Cancion.objects.filter(archivo__startswith=f'{CARPETA}/').values_list('archivo', flat=True)
+        }
+        huerfanas = FormaOnda.objects.exclude(contenido__in=contenidos)
+        total = huerfanas.count() if simular else huerfanas.delete()[0]
+        accion = 'Se borrarían' if simular else 'Borradas'
+        self.stdout.write(self.style.SUCCESS(f'{accion} {total} formas de onda sin uso'))
+
+    def migrar(self, simular):
+        """Guarda por contenido los archivos antiguos y apunta las canciones al nuevo nombre"""
+        antiguos = {}
+        for cancion_id, nombre in Cancion.objects.exclude(archivo='').exclude(archivo__isnull=True) \
+                .values_list('id', 'archivo'):
+            if not huella(nombre):
+                antiguos.setdefault(nombre, []).append(cancion_id)
+
+        movidos = 0
+        for nombre, ids in antiguos.items():
+            if not almacenamiento.exists(nombre):
+                self.stderr.write(f'No existe {nombre}')
+                continue
+            if simular:
+                movidos += 1
+                continue
+            with almacenamiento.open(nombre, 'rb') as archivo:
+                nuevo = almacenamiento.save(nombre, archivo)
+            with transaction.atomic():
+                Cancion.objects.filter(id__in=ids).update(archivo=nuevo)
+            almacenamiento.delete(nombre)
+            movidos += 1
+        self.stdout.write(f'{movidos} archivos antiguos movidos al almacenamiento por contenido')
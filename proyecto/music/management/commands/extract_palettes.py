@@ -0,0 +1,49 @@
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from music import lotes, paleta
+from music.models import Album, Artista, Cancion
+
+# Modelo -> campo de imagen
+IMAGENES = {Album: 'portada', Cancion: 'portada', Artista: 'imagen'}
+
+
+class Command(BaseCommand):
+    help = 'Calcula los colores dominante y de acento de portadas e imágenes de artista en un pool de procesos'
+
+    def add_arguments(self, parser):
+        lotes.anadir_argumentos(
+            parser, todas='Vuelve a calcular también las imágenes que ya tienen colores',
+        )
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        tareas = []
+        for modelo, campo in IMAGENES.items():
+            filas = modelo.objects.exclude(**{campo: ''}).exclude(**{f'{campo}__isnull': True})
+            if not options['todas']:
+                filas = filas.filter(color_dominante='')
+            for pk, nombre in filas.values_list('pk', campo).iterator():
+                tareas.append(((modelo, pk), default_storage.path(nombre)))
+
+        cambiadas = {modelo: [] for modelo in IMAGENES}
+        errores = 0
+        for (modelo, pk), colores, error in paleta.extraer_en_lote(tareas, procesos=options['procesos']):
+            if error:
+                errores += 1
+                self.stderr.write(f'{modelo._meta.verbose_name} {pk}: {error}')
+                continue
+            dominante, acento = colores or ('', '')
+            cambiadas[modelo].append(modelo(pk=pk, color_dominante=dominante, color_acento=acento))
+
+        for modelo, filas in cambiadas.items():
+            # bulk_update no dispara señales: no se vuelven a generar miniaturas
+            modelo.objects.bulk_update(filas, ['color_dominante', 'color_acento'], batch_size=500)
+
+        segundos = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(tareas)} imágenes procesadas en {segundos:.2f}s '
+            f'({len(tareas) / segundos if segundos else 0:.0f}/s), {errores} errores'
+        ))
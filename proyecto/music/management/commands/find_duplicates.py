@@ -0,0 +1,146 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F
+
+from music import huellas
+from music.models import (
+    Cancion, CancionGenero, EstadisticaCancion, Favorito, HuellaAcustica, Playlist, Reproduccion,
+)
+
+
+class Command(BaseCommand):
+    help = ('Busca canciones que son la misma grabación (mismo archivo o huella acústica parecida) '
+            'y opcionalmente las fusiona en una sola')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--umbral', type=float, default=None,
+            help='Fracción de hashes alineados para considerar duplicadas dos canciones (por defecto HUELLAS_UMBRAL)',
+        )
+        parser.add_argument(
+            '--fusionar', action='store_true',
+            help='Fusiona cada grupo en la canción de mayor bitrate (o la más antigua) y borra las demás',
+        )
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        umbral = options['umbral'] if options['umbral'] is not None else huellas.umbral()
+        grupos = _UnionFind()
+        motivos = {}
+
+        # Mismo archivo: duplicados exactos, aunque no tengan huella
+        repetidos = Cancion.objects.exclude(archivo='').exclude(archivo__isnull=True) \
+            .values('archivo').annotate(n=Count('id')).filter(n__gt=1).values('archivo')
+        por_archivo = {}
+        for cancion_id, nombre in Cancion.objects.filter(archivo__in=repetidos).values_list('id', 'archivo'):
+            por_archivo.setdefault(nombre, []).append(cancion_id)
+        for ids in por_archivo.values():
+            for otra in ids[1:]:
+                grupos.unir(ids[0], otra)
+                motivos[otra] = 'mismo archivo'
+
+        # Huella parecida: cada canción consulta el índice solo por sus propios hashes
+        con_huella = HuellaAcustica.objects.values_list('cancion_id', flat=True).distinct().order_by('cancion_id')
+        consultadas = 0
+        for cancion_id in con_huella.iterator():
+            filas = np.array(HuellaAcustica.objects.filter(cancion_id=cancion_id).values_list('valor', 'tiempo'))
+            if not len(filas):
+                continue
+            consultadas += 1
+            valores, tiempos = filas[:, 0], filas[:, 1]
+            minimo = max(huellas.minimo_coincidencias(), umbral * huellas.consultados(valores))
+            for otra, puntuacion in huellas.coincidencias(valores, tiempos, excluir=cancion_id).items():
+                if puntuacion >= minimo and grupos.buscar(otra) != grupos.buscar(cancion_id):
+                    grupos.unir(cancion_id, otra)
+                    motivos.setdefault(otra, f'{100 * puntuacion / huellas.consultados(valores):.0f}% de hashes alineados')
+
+        resultado = grupos.grupos()
+        canciones = Cancion.objects.in_bulk([c for grupo in resultado for c in grupo])
+        fusionadas = 0
+        for grupo in resultado:
+            miembros = sorted((canciones[c] for c in grupo if c in canciones), key=_prioridad)
+            conservar, duplicadas = miembros[0], miembros[1:]
+            self.stdout.write(f'Conserva #{conservar.pk} «{conservar.titulo}» ({conservar.bitrate or "?"} kbps)')
+            for cancion in duplicadas:
+                self.stdout.write(f'    #{cancion.pk} «{cancion.titulo}»: {motivos.get(cancion.pk, "mismo grupo")}')
+            if options['fusionar']:
+                self._fusionar(conservar, duplicadas)
+                fusionadas += len(duplicadas)
+
+        mensaje = f'{len(resultado)} grupos de duplicadas entre {consultadas} canciones con huella'
+        if options['fusionar']:
+            mensaje += f', {fusionadas} canciones fusionadas'
+        self.stdout.write(self.style.SUCCESS(f'{mensaje} en {time.monotonic() - inicio:.2f}s'))
+
+    @transaction.atomic
+    def _fusionar(self, conservar, duplicadas):
+        """Pasa playlists, favoritos, historial, estadísticas y géneros a `conservar` y borra las demás"""
+        ids = [c.pk for c in duplicadas]
+        playlists = list(Playlist.objects.filter(canciones__in=ids).distinct())
+        for playlist in playlists:
+            playlist.canciones.add(conservar)
+
+        usuarios = set(Favorito.objects.filter(cancion=conservar).values_list('usuario_id', flat=True))
+        for favorito in Favorito.objects.filter(cancion_id__in=ids):
+            if favorito.usuario_id not in usuarios:
+                usuarios.add(favorito.usuario_id)
+                Favorito.objects.filter(pk=favorito.pk).update(cancion=conservar)
+
+        Reproduccion.objects.filter(cancion_id__in=ids).update(cancion=conservar)
+        propias = {
+            (e.periodo, e.inicio): e.pk for e in EstadisticaCancion.objects.filter(cancion=conservar)
+        }
+        for estadistica in EstadisticaCancion.objects.filter(cancion_id__in=ids):
+            clave = (estadistica.periodo, estadistica.inicio)
+            if clave in propias:
+                EstadisticaCancion.objects.filter(pk=propias[clave]).update(total=F('total') + estadistica.total)
+            else:
+                propias[clave] = estadistica.pk
+                EstadisticaCancion.objects.filter(pk=estadistica.pk).update(cancion=conservar)
+
+        generos = CancionGenero.objects.filter(cancion_id__in=ids).values_list('genero_id', flat=True).distinct()
+        CancionGenero.objects.bulk_create(
+            [CancionGenero(cancion=conservar, genero_id=genero_id) for genero_id in generos],
+            ignore_conflicts=True,
+        )
+
+        Cancion.objects.filter(pk=conservar.pk).update(
+            reproducciones=F('reproducciones') + sum(c.reproducciones for c in duplicadas),
+            favorita=conservar.favorita or any(c.favorita for c in duplicadas),
+        )
+        for cancion in duplicadas:
+            # delete() dispara las señales: contadores, duraciones, índices de búsqueda y liberación del audio
+            cancion.delete()
+
+
+def _prioridad(cancion):
+    """La copia que se conserva: más bitrate, después la más antigua"""
+    return -(cancion.bitrate or 0), cancion.fecha_subida, cancion.pk
+
+
+class _UnionFind:
+    def __init__(self):
+        self.padre = {}
+
+    def buscar(self, x):
+        raiz = x
+        while self.padre.get(raiz, raiz) != raiz:
+            raiz = self.padre[raiz]
+        while x != raiz:
+            self.padre[x], x = raiz, self.padre.get(x, x)
+        return raiz
+
+    def unir(self, a, b):
+        a, b = self.buscar(a), self.buscar(b)
+        if a != b:
+            self.padre[max(a, b)] = min(a, b)
+
+    def grupos(self):
+        resultado = {}
+        for x in list(self.padre):
+            raiz = self.buscar(x)
+            resultado.setdefault(raiz, {raiz}).add(x)
+        return sorted(resultado.values(), key=min)
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from music import huellas, lotes
+from music.almacenamiento import almacenamiento
+from music.models import Cancion, HuellaAcustica
+
+
+class Command(BaseCommand):
+    help = 'Calcula la huella acústica de las canciones y la guarda en el índice de HuellaAcustica'
+
+    def add_arguments(self, parser):
+        lotes.anadir_argumentos(
+            parser, todas='Vuelve a calcular también las canciones que ya tienen huella',
+        )
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        canciones = Cancion.objects.exclude(archivo='').exclude(archivo__isnull=True)
+        if not options['todas']:
+            canciones = canciones.filter(huellas__isnull=True)
+        # Las canciones que comparten archivo se decodifican una sola vez
+        por_archivo = {}
+        for cancion_id, nombre in canciones.values_list('id', 'archivo').distinct().iterator():
+            por_archivo.setdefault(nombre, []).append(cancion_id)
+
+        tareas = [(nombre, almacenamiento.path(nombre)) for nombre in por_archivo]
+        calculadas, filas, errores = 0, 0, 0
+        for nombre, resultado, error in huellas.calcular_en_lote(tareas, procesos=options['procesos']):
+            if error:
+                errores += 1
+                self.stderr.write(f'{nombre}: {error}')
+                continue
+            valores, tiempos = resultado
+            with transaction.atomic():
+                HuellaAcustica.objects.filter(cancion_id__in=por_archivo[nombre]).delete()
+                nuevas = [
+                    HuellaAcustica(cancion_id=cancion_id, valor=valor, tiempo=tiempo)
+                    for cancion_id in por_archivo[nombre]
+                    for valor, tiempo in zip(valores.tolist(), tiempos.tolist())
+                ]
+                HuellaAcustica.objects.bulk_create(nuevas, batch_size=2000)
+            calculadas += len(por_archivo[nombre])
+            filas += len(nuevas)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{calculadas} canciones con huella ({filas} hashes), {errores} errores '
+            f'en {time.monotonic() - inicio:.2f}s'
+        ))
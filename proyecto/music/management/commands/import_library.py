@@ -0,0 +1,48 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from music import lotes
+from music.importacion import Importador
+
+
+class Command(BaseCommand):
+    help = 'Importa al catálogo los MP3 de una carpeta (etiquetas leídas en paralelo, inserciones por lotes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('carpeta', help='Carpeta raíz con los archivos de audio')
+        parser.add_argument(
+            '--modo', choices=('copiar', 'enlazar'), default='copiar',
+            help='Copiar los archivos a media/musica/ o crear enlaces (por defecto copiar)',
+        )
+        parser.add_argument(
+            '--lote', type=int, default=1000,
+            help='Pistas por transacción (por defecto 1000)',
+        )
+        lotes.anadir_argumentos(parser)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Lee los archivos e informa de lo que se importaría sin escribir nada',
+        )
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['carpeta']):
+            raise CommandError(f'No existe la carpeta {options["carpeta"]}')
+
+        importador = Importador(
+            options['carpeta'],
+            modo=options['modo'],
+            lote=options['lote'],
+            procesos=options['procesos'],
+            simular=options['dry_run'],
+            informar=self.stdout.write,
+        )
+        resultado = importador.ejecutar()
+        segundos = resultado['segundos']
+        prefijo = 'Simulación: se importarían' if options['dry_run'] else 'Importadas'
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefijo} {resultado["importadas"]} pistas ({resultado["artistas"]} artistas y '
+            f'{resultado["albums"]} álbumes nuevos) en {segundos:.2f}s '
+            f'({resultado["leidas"] / segundos if segundos else 0:.0f} pistas/s); '
+            f'{resultado["existentes"]} ya importadas, {resultado["errores"]} errores'
+        ))
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from music import hls, lotes
+from music.models import Cancion
+
+
+class Command(BaseCommand):
+    help = 'Corta el audio de las canciones en segmentos HLS con su lista maestra (streaming adaptativo)'
+
+    def add_arguments(self, parser):
+        lotes.anadir_argumentos(parser)
+        parser.add_argument(
+            '--incompletas', action='store_true',
+            help='Empaqueta también las canciones con versiones de audio aún pendientes',
+        )
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        canciones = Cancion.objects.filter(hls='').exclude(archivo='').exclude(archivo__isnull=True)
+        if not options['incompletas']:
+            # Cada versión que termina obliga a reempaquetar: se esperan las pendientes
+            canciones = canciones.exclude(
+                Q(versiones__estado='pendiente') | Q(versiones__estado='procesando')
+            )
+        canciones = canciones.distinct().only('id', 'archivo', 'bitrate').prefetch_related('versiones')
+
+        tareas = []
+        for cancion in canciones:
+            try:
+                contenido, variantes = hls.variantes(cancion)
+            except OSError as error:
+                self.stderr.write(f'Canción {cancion.id}: {error}')
+                continue
+            tareas.append((cancion.id, contenido, variantes))
+
+        empaquetadas = errores = 0
+        for cancion_id, maestra, error in hls.empaquetar_en_lote(tareas, procesos=options['procesos']):
+            if maestra:
+                Cancion.objects.filter(id=cancion_id).update(hls=maestra)
+                empaquetadas += 1
+            else:
+                errores += 1
+                self.stderr.write(f'Canción {cancion_id}: {error or "sin frames MPEG"}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{empaquetadas} canciones empaquetadas, {errores} errores en {time.monotonic() - inicio:.2f}s'
+        ))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from music import busqueda
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de búsqueda de texto completo (FTS5) de canciones'
+
+    def handle(self, *args, **options):
+        if not busqueda.disponible():
+            self.stdout.write(self.style.WARNING(
+                'El motor de base de datos no es SQLite: la búsqueda usa icontains y no hay índice.'
+            ))
+            return
+        total = busqueda.reconstruir_indice()
+        self.stdout.write(self.style.SUCCESS(f'Índice reconstruido: {total} canciones'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from music import contadores
+from music.models import Album, Artista, Cancion, Playlist
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los contadores y duraciones totales de artistas, álbumes y playlists'
+
+    def handle(self, *args, **options):
+        contadores.recalcular(Artista, Album, Cancion)
+        contadores.recalcular_duraciones(Album, Playlist, Cancion)
+        self.stdout.write(self.style.SUCCESS(
+            f'Contadores recalculados: {Artista.objects.count()} artistas, '
+            f'{Album.objects.count()} álbumes, {Playlist.objects.count()} playlists'
+        ))
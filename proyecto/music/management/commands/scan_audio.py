@@ -0,0 +1,55 @@
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from music import contadores, lotes
+from music.metadatos import leer_en_lote
+from music.models import Album, Cancion, Playlist
+
+
+class Command(BaseCommand):
+    help = 'Lee duración y bitrate de los MP3 de las canciones (sólo cabeceras) en un pool de procesos'
+
+    def add_arguments(self, parser):
+        lotes.anadir_argumentos(
+            parser, todas='Vuelve a leer también las canciones que ya tienen bitrate',
+        )
+
+    def handle(self, *args, **options):
+        inicio = time.monotonic()
+        canciones = Cancion.objects.exclude(archivo='').exclude(archivo__isnull=True) \
+            .only('id', 'archivo', 'album_id', 'minutos', 'segundos', 'bitrate')
+        if not options['todas']:
+            canciones = canciones.filter(bitrate__isnull=True)
+        por_ruta = {default_storage.path(c.archivo.name): c for c in canciones.iterator()}
+
+        cambiadas, errores = [], 0
+        for ruta, metadatos, error in leer_en_lote(list(por_ruta), procesos=options['procesos']):
+            if error:
+                errores += 1
+                self.stderr.write(f'{ruta}: {error}')
+                continue
+            cancion = por_ruta[ruta]
+            minutos, segundos = divmod(round(metadatos['duracion']), 60)
+            if (cancion.minutos, cancion.segundos, cancion.bitrate) != (minutos, segundos, metadatos['bitrate']):
+                cancion.minutos, cancion.segundos, cancion.bitrate = minutos, segundos, metadatos['bitrate']
+                cambiadas.append(cancion)
+
+        if cambiadas:
+            with transaction.atomic():
+                Cancion.objects.bulk_update(cambiadas, ['minutos', 'segundos', 'bitrate'], batch_size=500)
+                # bulk_update no dispara señales: se recalculan las duraciones afectadas
+                ids = [c.id for c in cambiadas]
+                contadores.recalcular_duraciones(
+                    Album, Playlist, Cancion,
+                    albums={c.album_id for c in cambiadas},
+                    playlists=Playlist.objects.filter(canciones__in=ids).values('id'),
+                )
+
+        segundos = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(por_ruta)} archivos leídos en {segundos:.2f}s: '
+            f'{len(cambiadas)} canciones actualizadas, {errores} errores'
+        ))
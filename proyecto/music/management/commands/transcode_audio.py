@@ -0,0 +1,53 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from music import transcodificacion
+from music.models import Cancion, VersionAudio
+
+
+class Command(BaseCommand):
+    help = 'Genera con ffmpeg las versiones de 128/192/320 kbps pendientes de las canciones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--procesos', type=int, default=getattr(settings, 'TRANSCODIFICACION_PROCESOS', 2),
+            help='Conversiones simultáneas de ffmpeg',
+        )
+        parser.add_argument(
+            '--lote', type=int, default=50,
+            help='Versiones que se reclaman en cada vuelta (por defecto 50)',
+        )
+        parser.add_argument(
+            '--esperar', type=int, default=0,
+            help='Trabaja de forma continua comprobando cada N segundos si hay pendientes',
+        )
+        parser.add_argument(
+            '--encolar', action='store_true',
+            help='Crea antes las versiones que falten de las canciones existentes',
+        )
+
+    def handle(self, *args, **options):
+        if options['encolar']:
+            sin_versiones = Cancion.objects.exclude(archivo='').exclude(archivo__isnull=True) \
+                .filter(versiones__isnull=True)
+            encoladas = 0
+            for cancion in sin_versiones.only('id', 'archivo', 'bitrate').iterator():
+                transcodificacion.encolar(cancion)
+                encoladas += 1
+            self.stdout.write(f'{encoladas} canciones encoladas')
+
+        while True:
+            inicio = time.monotonic()
+            listas, errores = transcodificacion.procesar_pendientes(options['lote'], options['procesos'])
+            if listas or errores:
+                self.stdout.write(self.style.SUCCESS(
+                    f'{listas} versiones generadas, {errores} errores en {time.monotonic() - inicio:.1f}s '
+                    f'({VersionAudio.objects.filter(estado="pendiente").count()} pendientes)'
+                ))
+            elif not options['esperar']:
+                self.stdout.write('No hay versiones pendientes')
+                return
+            else:
+                time.sleep(options['esperar'])
@@ -0,0 +1,361 @@
+"""
+Lectura de duración, bitrate y etiquetas de archivos MP3 sin dependencias.
+
+Sólo se leen las cabeceras: la etiqueta ID3v2 del principio, el primer
+frame MPEG (con la cabecera Xing/Info o VBRI de los VBR y el tag LAME con
+el retardo y relleno del codificador) y los 128 bytes finales de ID3v1.
+Con eso la duración es exacta en VBR y CBR sin recorrer el audio, así que
+volver a escanear una biblioteca grande es barato. `leer_en_lote` reparte
+los archivos entre procesos para los trabajos por lotes.
+"""
+import os
+import struct
+from functools import partial
+
+from . import lotes
+
+# Bytes que se examinan tras la etiqueta ID3v2 buscando el primer frame
+VENTANA_SINCRONIA = 64 * 1024
+
+BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+FRECUENCIAS = {
+    1: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    2.5: (11025, 12000, 8000),
+}
+VERSIONES = {0: 2.5, 2: 2, 3: 1}
+CAPAS = {1: 3, 2: 2, 3: 1}
+
+# Marcos ID3v2 que interesan: (v2.3/v2.4, v2.2)
+MARCOS_TEXTO = {
+    'titulo': ('TIT2', 'TT2'),
+    'artista': ('TPE1', 'TP1'),
+    'album': ('TALB', 'TAL'),
+    'pista': ('TRCK', 'TRK'),
+    'anio': ('TDRC', 'TYE'),
+}
+CODIFICACIONES = ('latin-1', 'utf-16', 'utf-16-be', 'utf-8')
+
+
+class ErrorMetadatos(ValueError):
+    """El archivo no es un MP3 reconocible"""
+
+
+def _syncsafe(datos):
+    return (datos[0] << 21) | (datos[1] << 14) | (datos[2] << 7) | datos[3]
+
+
+def _texto(datos, codificacion):
+    nulo = b'\x00\x00' if codificacion in (1, 2) else b'\x00'
+    # Los textos pueden llevar varios valores separados por nulos
+    valores = []
+    for parte in _partir(datos, nulo):
+        try:
+            valor = parte.decode(CODIFICACIONES[codificacion]).strip('\ufeff').strip()
+        except (UnicodeDecodeError, IndexError):
+            continue
+        if valor:
+            valores.append(valor)
+    return valores
+
+
+def _partir(datos, nulo):
+    ancho = len(nulo)
+    inicio = 0
+    partes = []
+    posicion = 0
+    while posicion <= len(datos) - ancho:
+        if datos[posicion:posicion + ancho] == nulo:
+            partes.append(datos[inicio:posicion])
+            posicion += ancho
+            inicio = posicion
+        else:
+            posicion += ancho
+    partes.append(datos[inicio:])
+    return partes
+
+
+def _cortar_nulo(datos, codificacion):
+    """Separa una cadena terminada en nulo del resto de los datos"""
+    if codificacion in (1, 2):
+        for posicion in range(0, len(datos) - 1, 2):
+            if datos[posicion:posicion + 2] == b'\x00\x00':
+                return datos[:posicion], datos[posicion + 2:]
+        return datos, b''
+    cadena, _, resto = datos.partition(b'\x00')
+    return cadena, resto
+
+
+def _quitar_desincronizacion(datos):
+    return datos.replace(b'\xff\x00', b'\xff')
+
+
+def leer_id3v2(cabecera, cuerpo):
+    """Etiquetas de un ID3v2.2/2.3/2.4 a partir de su cabecera y su contenido"""
+    version, flags = cabecera[3], cabecera[5]
+    if flags & 0x80 and version < 4:
+        cuerpo = _quitar_desincronizacion(cuerpo)
+    posicion = 0
+    if flags & 0x40 and version >= 3:
+        # Cabecera extendida
+        tamano = _syncsafe(cuerpo[:4]) if version == 4 else struct.unpack('>I', cuerpo[:4])[0] + 4
+        posicion = tamano
+
+    ancho_id, ancho_tamano = (3, 3) if version == 2 else (4, 4)
+    por_id = {}
+    while posicion + ancho_id + ancho_tamano <= len(cuerpo):
+        marco = cuerpo[posicion:posicion + ancho_id]
+        if not marco.strip(b'\x00') or not marco.isalnum():
+            break
+        bruto = cuerpo[posicion + ancho_id:posicion + ancho_id + ancho_tamano]
+        if version == 2:
+            tamano = int.from_bytes(bruto, 'big')
+            cabecera_marco = 6
+        else:
+            tamano = _syncsafe(bruto) if version == 4 else struct.unpack('>I', bruto)[0]
+            cabecera_marco = 10
+        datos = cuerpo[posicion + cabecera_marco:posicion + cabecera_marco + tamano]
+        if version == 4 and cuerpo[posicion + 9] & 0x02:
+            datos = _quitar_desincronizacion(datos)
+        por_id.setdefault(marco.decode('latin-1'), datos)
+        posicion += cabecera_marco + tamano
+
+    etiquetas = {}
+    for campo, marcos in MARCOS_TEXTO.items():
+        for marco in marcos:
+            datos = por_id.get(marco)
+            if datos:
+                valores = _texto(datos[1:], datos[0])
+                if valores:
+                    etiquetas[campo] = valores if campo == 'artista' else valores[0]
+                    break
+
+    imagen = por_id.get('APIC') or por_id.get('PIC')
+    if imagen:
+        codificacion = imagen[0]
+        if 'APIC' in por_id:
+            mime, resto = _cortar_nulo(imagen[1:], 0)
+            mime = mime.decode('latin-1').lower() or 'image/jpeg'
+        else:
+            formato = imagen[1:4].decode('latin-1').lower()
+            mime, resto = f'image/{"jpeg" if formato == "jpg" else formato}', imagen[4:]
+        _, datos = _cortar_nulo(resto[1:], codificacion)
+        if datos:
+            etiquetas['portada'] = (mime if '/' in mime else f'image/{mime}', datos)
+    return etiquetas
+
+
+def leer_id3v1(bloque):
+    if len(bloque) != 128 or not bloque.startswith(b'TAG'):
+        return {}
+    etiquetas = {}
+    for campo, inicio, fin in (('titulo', 3, 33), ('artista', 33, 63), ('album', 63, 93), ('anio', 93, 97)):
+        valor = bloque[inicio:fin].split(b'\x00', 1)[0].decode('latin-1').strip()
+        if valor:
+            etiquetas[campo] = [valor] if campo == 'artista' else valor
+    if bloque[125] == 0 and bloque[126]:
+        etiquetas['pista'] = str(bloque[126])
+    return etiquetas
+
+
+def leer_cabecera_frame(datos, posicion=0):
+    """Decodifica la cabecera de 4 bytes de un frame MPEG o devuelve None"""
+    if posicion + 4 > len(datos):
+        return None
+    b1, b2, b3 = datos[posicion + 1], datos[posicion + 2], datos[posicion + 3]
+    if datos[posicion] != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version = VERSIONES.get((b1 >> 3) & 0x03)
+    capa = CAPAS.get((b1 >> 1) & 0x03)
+    indice_bitrate, indice_frecuencia = b2 >> 4, (b2 >> 2) & 0x03
+    if version is None or capa is None or indice_bitrate in (0, 15) or indice_frecuencia == 3:
+        return None
+
+    bitrate = BITRATES[(1 if version == 1 else 2, capa)][indice_bitrate]
+    frecuencia = FRECUENCIAS[version][indice_frecuencia]
+    relleno = (b2 >> 1) & 0x01
+    mono = (b3 >> 6) == 3
+    if capa == 1:
+        muestras = 384
+        longitud = (12 * bitrate * 1000 // frecuencia + relleno) * 4
+    else:
+        muestras = 1152 if capa == 2 or version == 1 else 576
+        longitud = muestras // 8 * bitrate * 1000 // frecuencia + relleno
+    return {
+        'version': version,
+        'capa': capa,
+        'bitrate': bitrate,
+        'frecuencia': frecuencia,
+        'muestras': muestras,
+        'longitud': longitud,
+        'canales': 1 if mono else 2,
+    }
+
+
+def buscar_frame(datos):
+    """Posición y cabecera del primer frame seguido de otro frame válido"""
+    posicion = datos.find(b'\xff')
+    while 0 <= posicion < len(datos) - 4:
+        frame = leer_cabecera_frame(datos, posicion)
+        if frame:
+            siguiente = posicion + frame['longitud']
+            if siguiente + 4 > len(datos) or leer_cabecera_frame(datos, siguiente):
+                return posicion, frame
+        posicion = datos.find(b'\xff', posicion + 1)
+    return None, None
+
+
+def _entero(datos, inicio):
+    """Entero big-endian de 32 bits en `inicio` o None si el bloque está cortado"""
+    bruto = datos[inicio:inicio + 4]
+    return struct.unpack('>I', bruto)[0] if len(bruto) == 4 else None
+
+
+def leer_vbr(datos, posicion, frame):
+    """
+    Número de frames de audio según la cabecera Xing/Info o VBRI del primer
+    frame y, si hay tag LAME, muestras de retardo y relleno del codificador.
+    Una cabecera cortada se trata como si no estuviera (se estima como CBR).
+    """
+    if frame['version'] == 1:
+        lateral = 17 if frame['canales'] == 1 else 32
+    else:
+        lateral = 9 if frame['canales'] == 1 else 17
+    inicio = posicion + 4 + lateral
+    marca = datos[inicio:inicio + 4]
+    if marca in (b'Xing', b'Info'):
+        flags = _entero(datos, inicio + 4)
+        if flags is None:
+            return None
+        cursor = inicio + 8
+        frames = bytes_audio = None
+        if flags & 0x01:
+            frames = _entero(datos, cursor)
+            cursor += 4
+        if flags & 0x02:
+            bytes_audio = _entero(datos, cursor)
+            cursor += 4
+        if flags & 0x04:
+            cursor += 100
+        if flags & 0x08:
+            cursor += 4
+        retardo = relleno = 0
+        # Tag LAME: 9 bytes de versión y, 12 bytes después, retardo y relleno (12 bits cada uno)
+        if datos[cursor:cursor + 4] in (b'LAME', b'Lavf', b'Lavc'):
+            bruto = datos[cursor + 21:cursor + 24]
+            if len(bruto) == 3:
+                retardo = (bruto[0] << 4) | (bruto[1] >> 4)
+                relleno = ((bruto[1] & 0x0F) << 8) | bruto[2]
+        return {'frames': frames, 'bytes': bytes_audio, 'retardo': retardo, 'relleno': relleno,
+                'vbr': marca == b'Xing'}
+
+    inicio = posicion + 36
+    if datos[inicio:inicio + 4] == b'VBRI':
+        bytes_audio, frames = _entero(datos, inicio + 10), _entero(datos, inicio + 14)
+        if frames is None:
+            return None
+        return {'frames': frames, 'bytes': bytes_audio, 'retardo': 0, 'relleno': 0, 'vbr': True}
+    return None
+
+
+def _abrir(origen):
+    if hasattr(origen, 'read'):
+        origen.seek(0)
+        return origen, False
+    return open(origen, 'rb'), True
+
+
+def leer_metadatos(origen):
+    """
+    Lee duración (segundos, float), bitrate (kbps), frecuencia, canales y
+    etiquetas (titulo, artista [lista], album, pista, anio, portada
+    (mime, bytes)) de una ruta o de un archivo abierto en modo binario.
+    """
+    archivo, cerrar = _abrir(origen)
+    try:
+        archivo.seek(0, os.SEEK_END)
+        tamano = archivo.tell()
+        archivo.seek(0)
+
+        etiquetas = {}
+        inicio_audio = 0
+        cabecera = archivo.read(10)
+        if len(cabecera) == 10 and cabecera.startswith(b'ID3'):
+            largo = _syncsafe(cabecera[6:10]) + (10 if cabecera[5] & 0x10 else 0)
+            try:
+                etiquetas = leer_id3v2(cabecera, archivo.read(largo))
+            except (struct.error, IndexError):
+                etiquetas = {}
+            inicio_audio = 10 + largo
+
+        final = 0
+        if tamano >= 128:
+            archivo.seek(tamano - 128)
+            id3v1 = leer_id3v1(archivo.read(128))
+            if id3v1:
+                final = 128
+                for campo, valor in id3v1.items():
+                    etiquetas.setdefault(campo, valor)
+
+        archivo.seek(inicio_audio)
+        datos = archivo.read(VENTANA_SINCRONIA)
+    finally:
+        if cerrar:
+            archivo.close()
+
+    posicion, frame = buscar_frame(datos)
+    if frame is None:
+        raise ErrorMetadatos('No se encontró ningún frame MPEG')
+
+    bytes_audio = tamano - final - inicio_audio - posicion
+    vbr = leer_vbr(datos, posicion, frame)
+    if vbr and vbr['frames']:
+        muestras = vbr['frames'] * frame['muestras'] - vbr['retardo'] - vbr['relleno']
+        duracion = max(muestras, 0) / frame['frecuencia']
+        if vbr['bytes']:
+            bytes_audio = vbr['bytes']
+        bitrate = round(bytes_audio * 8 / duracion / 1000) if duracion else frame['bitrate']
+    else:
+        # CBR sin cabecera: el tamaño del audio da la duración
+        bitrate = frame['bitrate']
+        duracion = bytes_audio * 8 / (bitrate * 1000)
+
+    return {
+        'duracion': duracion,
+        'bitrate': bitrate,
+        'frecuencia': frame['frecuencia'],
+        'canales': frame['canales'],
+        'vbr': bool(vbr and vbr['vbr']),
+        **etiquetas,
+    }
+
+
+def leer_archivo(ruta, portadas=False, contenido=False):
+    """Metadatos de un archivo del lote; con `contenido`, también su sha256"""
+    metadatos = leer_metadatos(ruta)
+    if contenido:
+        from .almacenamiento import calcular_hash
+        metadatos['sha256'] = calcular_hash(ruta)
+    if not portadas:
+        metadatos.pop('portada', None)
+    return metadatos
+
+
+def leer_en_lote(rutas, procesos=None, portadas=False, contenido=False):
+    """
+    Genera (ruta, metadatos, error) para cada ruta leyendo en un pool de
+    procesos (procesos=1 lee en el proceso actual). Las portadas se
+    descartan por defecto para no pasar imágenes entre procesos. Con
+    `contenido` se añade además el sha256 del archivo completo.
+    """
+    leer = partial(leer_archivo, portadas=portadas, contenido=contenido)
+    # Un archivo dañado no debe abortar el resto del lote
+    return lotes.en_lote(leer, ((ruta, ruta) for ruta in rutas), procesos,
+                         errores=(OSError, ErrorMetadatos, struct.error), chunksize=32)
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+TABLA_FTS = 'music_cancion_fts'
+
+
+def crear_indice(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {TABLA_FTS} USING fts5(
+            titulo, artistas, album,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    """)
+    schema_editor.execute(f"""
+        INSERT INTO {TABLA_FTS} (rowid, titulo, artistas, album)
+        SELECT c.id, c.titulo,
+               COALESCE((SELECT group_concat(a.nombre, ' ')
+                         FROM music_cancion_artistas ca
+                         JOIN music_artista a ON a.id = ca.artista_id
+                         WHERE ca.cancion_id = c.id), ''),
+               COALESCE(al.titulo, '')
+        FROM music_cancion c
+        LEFT JOIN music_album al ON al.id = c.album_id
+    """)
+
+
+def borrar_indice(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f"DROP TABLE IF EXISTS {TABLA_FTS}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, borrar_indice),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.10 on 2026-10-18 15:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0002_cancion_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarcaAgregacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=50, unique=True)),
+                ('ultimo_id', models.BigIntegerField(default=0)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Marca de Agregación',
+                'verbose_name_plural': 'Marcas de Agregación',
+            },
+        ),
+        migrations.CreateModel(
+            name='EstadisticaArtista',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('periodo', models.CharField(choices=[('hora', 'Hora'), ('dia', 'Día')], max_length=4)),
+                ('inicio', models.DateTimeField()),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('artista', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='estadisticas', to='music.artista')),
+            ],
+            options={
+                'verbose_name': 'Estadística de Artista',
+                'verbose_name_plural': 'Estadísticas de Artistas',
+                'indexes': [models.Index(fields=['periodo', 'inicio'], name='music_estad_periodo_c5b400_idx')],
+                'unique_together': {('artista', 'periodo', 'inicio')},
+            },
+        ),
+        migrations.CreateModel(
+            name='EstadisticaCancion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('periodo', models.CharField(choices=[('hora', 'Hora'), ('dia', 'Día')], max_length=4)),
+                ('inicio', models.DateTimeField()),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('cancion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='estadisticas', to='music.cancion')),
+            ],
+            options={
+                'verbose_name': 'Estadística de Canción',
+                'verbose_name_plural': 'Estadísticas de Canciones',
+                'indexes': [models.Index(fields=['periodo', 'inicio'], name='music_estad_periodo_757b89_idx')],
+                'unique_together': {('cancion', 'periodo', 'inicio')},
+            },
+        ),
+    ]
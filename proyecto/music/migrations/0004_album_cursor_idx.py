@@ -0,0 +1,17 @@
+# Generated by Django 5.2.10 on 2026-10-18 15:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0003_estadisticas'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='album',
+            index=models.Index(fields=['-fecha_lanzamiento', 'titulo', 'id'], name='album_cursor_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.10 on 2026-10-18 15:24
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _conteo(modelo, campo_filtro, campo_grupo):
+    return Coalesce(
+        Subquery(
+            modelo.objects.filter(**{campo_filtro: OuterRef('pk')})
+            .order_by().values(campo_filtro).annotate(n=Count(campo_grupo)).values('n'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def calcular_contadores(apps, schema_editor):
+    Artista = apps.get_model('music', 'Artista')
+    Album = apps.get_model('music', 'Album')
+    Cancion = apps.get_model('music', 'Cancion')
+
+    Artista.objects.update(
+        total_canciones=_conteo(Cancion.artistas.through, 'artista_id', 'cancion_id'),
+        total_albums=_conteo(Album.artistas.through, 'artista_id', 'album_id'),
+    )
+    Album.objects.update(total_canciones=_conteo(Cancion, 'album_id', 'id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0004_album_cursor_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='total_canciones',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='artista',
+            name='total_albums',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='artista',
+            name='total_canciones',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(calcular_contadores, migrations.RunPython.noop),
+    ]
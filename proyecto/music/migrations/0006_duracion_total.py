@@ -0,0 +1,43 @@
+# Generated by Django 5.2.10 on 2026-10-18 15:26
+
+from django.db import migrations, models
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def _suma_duracion(Cancion, campo):
+    return Coalesce(
+        Subquery(
+            Cancion.objects.filter(**{campo: OuterRef('pk')}).order_by()
+            .values(campo).annotate(total=Sum(F('minutos') * 60 + F('segundos'))).values('total'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def calcular_duraciones(apps, schema_editor):
+    Cancion = apps.get_model('music', 'Cancion')
+    apps.get_model('music', 'Album').objects.update(duracion_segundos=_suma_duracion(Cancion, 'album_id'))
+    apps.get_model('music', 'Playlist').objects.update(duracion_segundos=_suma_duracion(Cancion, 'playlists'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0005_contadores'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='duracion_segundos',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='playlist',
+            name='duracion_segundos',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(calcular_duraciones, migrations.RunPython.noop),
+    ]
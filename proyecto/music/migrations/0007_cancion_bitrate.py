@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-18 15:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0006_duracion_total'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cancion',
+            name='bitrate',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.10 on 2026-10-18 15:32
+
+import music.almacenamiento
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0007_cancion_bitrate'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cancion',
+            name='archivo',
+            field=models.FileField(blank=True, db_index=True, null=True, storage=music.almacenamiento.almacenamiento_audio, upload_to='musica/'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.10 on 2026-10-18 15:33
+
+import django.db.models.deletion
+import music.almacenamiento
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0008_archivo_por_contenido'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionAudio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calidad', models.CharField(choices=[('low', 'Baja (128kbps)'), ('medium', 'Media (192kbps)'), ('high', 'Alta (320kbps)')], max_length=10)),
+                ('bitrate', models.PositiveIntegerField()),
+                ('archivo', models.FileField(blank=True, db_index=True, null=True, storage=music.almacenamiento.almacenamiento_audio, upload_to='musica/')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('procesando', 'Procesando'), ('lista', 'Lista'), ('error', 'Error')], default='pendiente', max_length=10)),
+                ('error', models.TextField(blank=True)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+                ('cancion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='versiones', to='music.cancion')),
+            ],
+            options={
+                'verbose_name': 'Versión de Audio',
+                'verbose_name_plural': 'Versiones de Audio',
+                'indexes': [models.Index(fields=['estado'], name='music_versi_estado_c9ab28_idx')],
+                'unique_together': {('cancion', 'calidad')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-18 15:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0009_versiones_audio'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cancion',
+            name='hls',
+            field=models.CharField(blank=True, editable=False, max_length=200),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.10 on 2026-10-18 15:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0010_cancion_hls'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='color_acento',
+            field=models.CharField(blank=True, editable=False, max_length=7),
+        ),
+        migrations.AddField(
+            model_name='album',
+            name='color_dominante',
+            field=models.CharField(blank=True, editable=False, max_length=7),
+        ),
+        migrations.AddField(
+            model_name='artista',
+            name='color_acento',
+            field=models.CharField(blank=True, editable=False, max_length=7),
+        ),
+        migrations.AddField(
+            model_name='artista',
+            name='color_dominante',
+            field=models.CharField(blank=True, editable=False, max_length=7),
+        ),
+        migrations.AddField(
+            model_name='cancion',
+            name='color_acento',
+            field=models.CharField(blank=True, editable=False, max_length=7),
+        ),
+        migrations.AddField(
+            model_name='cancion',
+            name='color_dominante',
+            field=models.CharField(blank=True, editable=False, max_length=7),
+        ),
+    ]
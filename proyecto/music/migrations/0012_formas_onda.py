@@ -0,0 +1,28 @@
+# Generated by Django 5.2.10 on 2026-10-18 15:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0011_paletas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FormaOnda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('contenido', models.CharField(max_length=64)),
+                ('puntos', models.PositiveIntegerField()),
+                ('datos', models.BinaryField()),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Forma de Onda',
+                'verbose_name_plural': 'Formas de Onda',
+                'unique_together': {('contenido', 'puntos')},
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.10 on 2026-10-18 15:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0012_formas_onda'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='album',
+            name='ganancia',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='cancion',
+            name='ganancia',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='cancion',
+            name='pico_real',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='cancion',
+            name='sonoridad',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='configuracionusuario',
+            name='normalizacion',
+            field=models.CharField(choices=[('no', 'Desactivada'), ('pista', 'Por pista'), ('album', 'Por álbum')], default='pista', max_length=10),
+        ),
+    ]
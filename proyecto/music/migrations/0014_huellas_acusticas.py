@@ -0,0 +1,27 @@
+# Generated by Django 5.2.10 on 2026-10-18 15:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0013_sonoridad'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HuellaAcustica',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('valor', models.IntegerField(db_index=True)),
+                ('tiempo', models.PositiveIntegerField()),
+                ('cancion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='huellas', to='music.cancion')),
+            ],
+            options={
+                'verbose_name': 'Huella Acústica',
+                'verbose_name_plural': 'Huellas Acústicas',
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.10 on 2026-10-18 15:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0014_huellas_acusticas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Coocurrencia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('peso', models.FloatField(default=0)),
+                ('cancion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='music.cancion')),
+                ('otra', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='music.cancion')),
+            ],
+            options={
+                'verbose_name': 'Coocurrencia',
+                'verbose_name_plural': 'Coocurrencias',
+                'unique_together': {('cancion', 'otra')},
+            },
+        ),
+        migrations.CreateModel(
+            name='Recomendacion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('posicion', models.PositiveSmallIntegerField()),
+                ('puntuacion', models.FloatField()),
+                ('cancion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recomendaciones', to='music.cancion')),
+                ('recomendada', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='music.cancion')),
+            ],
+            options={
+                'verbose_name': 'Recomendación',
+                'verbose_name_plural': 'Recomendaciones',
+                'unique_together': {('cancion', 'posicion')},
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.10 on 2026-10-18 17:00
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0015_recomendaciones'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reproduccion',
+            name='fecha_reproduccion',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
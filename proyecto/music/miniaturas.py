@@ -0,0 +1,105 @@
+"""
+Miniaturas de portadas e imágenes de artista en tamaños fijos.
+
+Cada imagen original (p. ej. portadas_albums/x.jpg) tiene derivadas en
+miniaturas/<tamaño>/portadas_albums/x.jpg.<formato>, en WebP y en JPEG
+para los navegadores sin WebP. La ruta sólo depende del nombre original,
+así que las plantillas pueden construir los `srcset` sin tocar el disco:
+la vista `miniatura` genera la que falte la primera vez que se pide. Al
+subir una imagen nueva se generan todas (ver music.signals) y al cambiarla
+o borrarla se eliminan las del nombre anterior.
+"""
+import io
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+CARPETA = 'miniaturas'
+# Lado mayor en píxeles; nunca se amplía una imagen más pequeña
+TAMANOS = (64, 160, 320, 640)
+FORMATOS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpg': ('JPEG', 'image/jpeg'),
+}
+# Carpetas de upload_to de las que se sirven miniaturas
+ORIGENES = ('artistas/', 'portadas_albums/', 'portadas_canciones/', 'playlists/')
+
+
+def calidad():
+    return getattr(settings, 'MINIATURAS_CALIDAD', 80)
+
+
+def nombre_miniatura(nombre, tamano, formato):
+    return f'{CARPETA}/{tamano}/{nombre}.{formato}'
+
+
+def valida(nombre, tamano, formato):
+    partes = nombre.split('/')
+    return (tamano in TAMANOS and formato in FORMATOS and nombre.startswith(ORIGENES)
+            and '..' not in partes and '' not in partes)
+
+
+def url_miniatura(imagen, tamano, formato='webp'):
+    """URL de la miniatura de un ImageField (None si no hay imagen)"""
+    if not imagen:
+        return None
+    return reverse('miniatura', args=[tamano, f'{imagen.name}.{formato}'])
+
+
+def srcset(imagen, formato='webp'):
+    return ', '.join(f'{url_miniatura(imagen, tamano, formato)} {tamano}w' for tamano in TAMANOS)
+
+
+def generar(nombre, tamano, formato):
+    """Crea (si no existe) la miniatura de `nombre` y devuelve su nombre en el storage"""
+    destino = nombre_miniatura(nombre, tamano, formato)
+    if default_storage.exists(destino):
+        return destino
+
+    with default_storage.open(nombre, 'rb') as archivo:
+        imagen = Image.open(archivo)
+        # Con JPEG el decodificador puede reducir la escala al leer (mucho más rápido)
+        imagen.draft('RGB', (tamano, tamano))
+        imagen = ImageOps.exif_transpose(imagen)
+        imagen.thumbnail((tamano, tamano), Image.Resampling.LANCZOS)
+
+    formato_pil = FORMATOS[formato][0]
+    if formato_pil == 'JPEG' and imagen.mode != 'RGB':
+        # JPEG no admite transparencia: se compone sobre blanco
+        fondo = Image.new('RGB', imagen.size, 'white')
+        imagen = imagen.convert('RGBA')
+        fondo.paste(imagen, mask=imagen.getchannel('A'))
+        imagen = fondo
+    elif imagen.mode not in ('RGB', 'RGBA'):
+        imagen = imagen.convert('RGBA')
+
+    salida = io.BytesIO()
+    imagen.save(salida, formato_pil, quality=calidad(), optimize=formato_pil == 'JPEG')
+    guardado = default_storage.save(destino, ContentFile(salida.getvalue()))
+    if guardado != destino:
+        # Otra petición la generó a la vez: el storage renombró la copia
+        default_storage.delete(guardado)
+    return destino
+
+
+def generar_todas(nombre):
+    """Genera todas las miniaturas de una imagen recién subida"""
+    for tamano in TAMANOS:
+        for formato in FORMATOS:
+            try:
+                generar(nombre, tamano, formato)
+            except (OSError, ValueError, Image.DecompressionBombError) as error:
+                logger.warning('No se pudo generar la miniatura de %s: %s', nombre, error)
+                return
+
+
+def eliminar(nombre):
+    for tamano in TAMANOS:
+        for formato in FORMATOS:
+            default_storage.delete(nombre_miniatura(nombre, tamano, formato))
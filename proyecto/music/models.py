@@ -2,14 +2,23 @@ from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils.text import slugify
 from django.urls import reverse
+from django.utils import timezone
 import os
 
+from .almacenamiento import almacenamiento_audio
+
 class Artista(models.Model):
     nombre = models.CharField(max_length=100, unique=True, db_index=True)
     slug = models.SlugField(max_length=110, unique=True, blank=True, db_index=True)
     biografia = models.TextField(blank=True, null=True)
     imagen = models.ImageField(upload_to='artistas/', blank=True, null=True)
+    # Colores de la imagen para pintar el fondo al instante (music/paleta.py)
+    color_dominante = models.CharField(max_length=7, blank=True, editable=False)
+    color_acento = models.CharField(max_length=7, blank=True, editable=False)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
+    # Contadores mantenidos por señales (ver music/contadores.py)
+    total_canciones = models.PositiveIntegerField(default=0, editable=False)
+    total_albums = models.PositiveIntegerField(default=0, editable=False)
     
     class Meta:
         ordering = ['nombre']
@@ -26,14 +35,6 @@ class Artista(models.Model):
     
     def get_absolute_url(self):
         return reverse('artista_detalle', kwargs={'slug': self.slug})
-    
-    @property
-    def total_canciones(self):
-        return self.canciones.count()
-    
-    @property
-    def total_albums(self):
-        return self.albums.count()
 
 
 class Album(models.Model):
@@ -42,9 +43,17 @@ class Album(models.Model):
     artistas = models.ManyToManyField(Artista, related_name="albums")
     descripcion = models.TextField(blank=True, null=True)
     portada = models.ImageField(upload_to='portadas_albums/', null=True, blank=True)
+    # Colores de la portada para pintar el fondo al instante (music/paleta.py)
+    color_dominante = models.CharField(max_length=7, blank=True, editable=False)
+    color_acento = models.CharField(max_length=7, blank=True, editable=False)
     fecha_lanzamiento = models.DateField(null=True, blank=True)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     activo = models.BooleanField(default=True)
+    # Contadores mantenidos por señales (ver music/contadores.py)
+    total_canciones = models.PositiveIntegerField(default=0, editable=False)
+    duracion_segundos = models.PositiveIntegerField(default=0, editable=False)
+    # dB comunes a todas las pistas para normalizar por álbum (music/sonoridad.py)
+    ganancia = models.FloatField(null=True, blank=True, editable=False)
     
     class Meta:
         ordering = ['-fecha_lanzamiento', 'titulo']
@@ -52,6 +61,7 @@ class Album(models.Model):
         verbose_name_plural = 'Álbumes'
         indexes = [
             models.Index(fields=['-fecha_lanzamiento']),
+            models.Index(fields=['-fecha_lanzamiento', 'titulo', 'id'], name='album_cursor_idx'),
         ]
     
     def __str__(self):
@@ -67,17 +77,12 @@ class Album(models.Model):
     
     @property
     def duracion_total(self):
-        canciones = self.cancion_set.all()
-        if canciones.exists():
-            total_segundos = sum(c.duracion_en_segundos for c in canciones)
-            minutos = total_segundos // 60
-            segundos = total_segundos % 60
-            return f"{minutos}:{segundos:02d}"
-        return "0:00"
+        minutos, segundos = divmod(self.duracion_segundos, 60)
+        return f"{minutos}:{segundos:02d}"
     
     @property
     def canciones_count(self):
-        return self.cancion_set.count()
+        return self.total_canciones
     
     def artistas_nombres(self):
         return ", ".join([artista.nombre for artista in self.artistas.all()])
@@ -103,7 +108,21 @@ class Cancion(models.Model):
         validators=[MinValueValidator(0), MaxValueValidator(59)]
     )
     portada = models.ImageField(upload_to='portadas_canciones/', null=True, blank=True)
-    archivo = models.FileField(upload_to='musica/', null=True, blank=True)
+    # Colores de la portada para pintar el fondo al instante (music/paleta.py)
+    color_dominante = models.CharField(max_length=7, blank=True, editable=False)
+    color_acento = models.CharField(max_length=7, blank=True, editable=False)
+    # Guardado por hash de contenido: subidas idénticas comparten archivo (music/almacenamiento.py)
+    archivo = models.FileField(
+        upload_to='musica/', storage=almacenamiento_audio, null=True, blank=True, db_index=True
+    )
+    # kbps leídos de la cabecera MPEG (music/metadatos.py)
+    bitrate = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    # Lista maestra HLS (music/hls.py); vacío si la canción no está empaquetada
+    hls = models.CharField(max_length=200, blank=True, editable=False)
+    # Sonoridad integrada (LUFS), pico real (dBTP) y ganancia (dB) medidos por music/sonoridad.py
+    sonoridad = models.FloatField(null=True, blank=True, editable=False)
+    pico_real = models.FloatField(null=True, blank=True, editable=False)
+    ganancia = models.FloatField(null=True, blank=True, editable=False)
     reproducciones = models.PositiveIntegerField(default=0)
     favorita = models.BooleanField(default=False)
     fecha_subida = models.DateTimeField(auto_now_add=True)
@@ -122,8 +141,10 @@ class Cancion(models.Model):
         ]
     
     def __str__(self):
-        artistas = ", ".join([artista.nombre for artista in self.artistas.all()[:2]])
-        if self.artistas.count() > 2:
+        # all() aprovecha prefetch_related('artistas') si se ha usado
+        todos = list(self.artistas.all())
+        artistas = ", ".join([artista.nombre for artista in todos[:2]])
+        if len(todos) > 2:
             artistas += "..."
         return f"{self.titulo} - {artistas if artistas else 'Sin Artista'}"
     
@@ -144,17 +165,26 @@ class Cancion(models.Model):
         return f"{self.minutos}:{self.segundos:02d}"
     
     @property
-    def get_portada(self):
-        """Obtiene la portada priorizando: canción > álbum > default"""
+    def imagen_portada(self):
+        """Archivo de la portada priorizando: canción > álbum (None si no hay)"""
         if self.portada:
-            return self.portada.url
+            return self.portada
         elif self.album and self.album.portada:
-            return self.album.portada.url
+            return self.album.portada
+        return None
+    
+    @property
+    def get_portada(self):
+        """Obtiene la portada priorizando: canción > álbum > default"""
+        portada = self.imagen_portada
+        if portada:
+            return portada.url
         return '/static/img/default-cover.jpg'
     
-    def incrementar_reproducciones(self):
-        self.reproducciones += 1
-        self.save(update_fields=['reproducciones'])
+    def incrementar_reproducciones(self, n=1):
+        # UPDATE atómico en la BD: evita perder incrementos concurrentes
+        Cancion.objects.filter(pk=self.pk).update(reproducciones=models.F('reproducciones') + n)
+        self.refresh_from_db(fields=['reproducciones'])
     
     def artistas_nombres(self):
         return ", ".join([artista.nombre for artista in self.artistas.all()])
@@ -180,6 +210,8 @@ class Playlist(models.Model):
     )
     publica = models.BooleanField(default=True)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
+    # Mantenido por señales (ver music/contadores.py)
+    duracion_segundos = models.PositiveIntegerField(default=0, editable=False)
     
     class Meta:
         ordering = ['-fecha_creacion']
@@ -203,13 +235,8 @@ class Playlist(models.Model):
     
     @property
     def duracion_total(self):
-        canciones = self.canciones.all()
-        if canciones.exists():
-            total_segundos = sum(c.duracion_en_segundos for c in canciones)
-            minutos = total_segundos // 60
-            segundos = total_segundos % 60
-            return f"{minutos}:{segundos:02d}"
-        return "0:00"
+        minutos, segundos = divmod(self.duracion_segundos, 60)
+        return f"{minutos}:{segundos:02d}"
 
 
 class Genero(models.Model):
@@ -251,7 +278,8 @@ class Reproduccion(models.Model):
         null=True,
         blank=True
     )
-    fecha_reproduccion = models.DateTimeField(auto_now_add=True)
+    # Sin auto_now_add: el buffer de reproducciones guarda la hora de cada evento
+    fecha_reproduccion = models.DateTimeField(default=timezone.now, editable=False)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     user_agent = models.TextField(blank=True, null=True)
     
@@ -294,10 +322,167 @@ class ConfiguracionUsuario(models.Model):
     volumen_default = models.FloatField(default=0.7, validators=[MinValueValidator(0), MaxValueValidator(1)])
     shuffle_default = models.BooleanField(default=False)
     repeat_default = models.BooleanField(default=False)
+    normalizacion = models.CharField(
+        max_length=10,
+        choices=[
+            ('no', 'Desactivada'),
+            ('pista', 'Por pista'),
+            ('album', 'Por álbum'),
+        ],
+        default='pista'
+    )
     
     class Meta:
         verbose_name = 'Configuración de Usuario'
         verbose_name_plural = 'Configuraciones de Usuarios'
     
     def __str__(self):
-        return f"Configuración de {self.usuario.username}"
\ No newline at end of file
+        return f"Configuración de {self.usuario.username}"
+
+class EstadisticaCancion(models.Model):
+    """Reproducciones agregadas por canción y hora/día (ver manage.py aggregate_plays)"""
+    PERIODOS = [
+        ('hora', 'Hora'),
+        ('dia', 'Día'),
+    ]
+
+    cancion = models.ForeignKey(Cancion, on_delete=models.CASCADE, related_name='estadisticas')
+    periodo = models.CharField(max_length=4, choices=PERIODOS)
+    inicio = models.DateTimeField()
+    total = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('cancion', 'periodo', 'inicio')
+        verbose_name = 'Estadística de Canción'
+        verbose_name_plural = 'Estadísticas de Canciones'
+        indexes = [
+            models.Index(fields=['periodo', 'inicio']),
+        ]
+
+    def __str__(self):
+        return f"{self.cancion_id} - {self.periodo} {self.inicio}: {self.total}"
+
+
+class EstadisticaArtista(models.Model):
+    """Reproducciones agregadas por artista y hora/día"""
+    artista = models.ForeignKey(Artista, on_delete=models.CASCADE, related_name='estadisticas')
+    periodo = models.CharField(max_length=4, choices=EstadisticaCancion.PERIODOS)
+    inicio = models.DateTimeField()
+    total = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('artista', 'periodo', 'inicio')
+        verbose_name = 'Estadística de Artista'
+        verbose_name_plural = 'Estadísticas de Artistas'
+        indexes = [
+            models.Index(fields=['periodo', 'inicio']),
+        ]
+
+    def __str__(self):
+        return f"{self.artista_id} - {self.periodo} {self.inicio}: {self.total}"
+
+
+class MarcaAgregacion(models.Model):
+    """Último id de Reproduccion ya incluido en un proceso de agregación"""
+    nombre = models.CharField(max_length=50, unique=True)
+    ultimo_id = models.BigIntegerField(default=0)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Marca de Agregación'
+        verbose_name_plural = 'Marcas de Agregación'
+
+    def __str__(self):
+        return f"{self.nombre}: {self.ultimo_id}"
+
+
+class VersionAudio(models.Model):
+    """Copia recodificada de una canción a otra calidad (ver music/transcodificacion.py)"""
+    ESTADOS = [
+        ('pendiente', 'Pendiente'),
+        ('procesando', 'Procesando'),
+        ('lista', 'Lista'),
+        ('error', 'Error'),
+    ]
+
+    cancion = models.ForeignKey(Cancion, on_delete=models.CASCADE, related_name='versiones')
+    calidad = models.CharField(max_length=10, choices=ConfiguracionUsuario._meta.get_field('calidad_audio').choices)
+    bitrate = models.PositiveIntegerField()
+    archivo = models.FileField(upload_to='musica/', storage=almacenamiento_audio, null=True, blank=True, db_index=True)
+    estado = models.CharField(max_length=10, choices=ESTADOS, default='pendiente')
+    error = models.TextField(blank=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('cancion', 'calidad')
+        verbose_name = 'Versión de Audio'
+        verbose_name_plural = 'Versiones de Audio'
+        indexes = [
+            models.Index(fields=['estado']),
+        ]
+
+    def __str__(self):
+        return f"{self.cancion_id} - {self.calidad} ({self.estado})"
+
+
+class FormaOnda(models.Model):
+    """Picos min/max del audio con un hash dado a una resolución (ver music/onda.py)"""
+    contenido = models.CharField(max_length=64)
+    puntos = models.PositiveIntegerField()
+    # Pares [mínimo, máximo] en int8
+    datos = models.BinaryField()
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('contenido', 'puntos')
+        verbose_name = 'Forma de Onda'
+        verbose_name_plural = 'Formas de Onda'
+
+    def __str__(self):
+        return f"{self.contenido[:12]} ({self.puntos} puntos)"
+
+
+class HuellaAcustica(models.Model):
+    """Hash de un par de picos espectrales de una canción: índice invertido (ver music/huellas.py)"""
+    valor = models.IntegerField(db_index=True)
+    cancion = models.ForeignKey(Cancion, on_delete=models.CASCADE, related_name='huellas')
+    # Ventana del pico ancla dentro del audio
+    tiempo = models.PositiveIntegerField()
+
+    class Meta:
+        verbose_name = 'Huella Acústica'
+        verbose_name_plural = 'Huellas Acústicas'
+
+    def __str__(self):
+        return f"{self.cancion_id} - {self.valor:06x} @ {self.tiempo}"
+
+
+class Coocurrencia(models.Model):
+    """Peso de que dos canciones se escuchen o guarden juntas; la diagonal son las apariciones (ver music/recomendaciones.py)"""
+    cancion = models.ForeignKey(Cancion, on_delete=models.CASCADE, related_name='+')
+    otra = models.ForeignKey(Cancion, on_delete=models.CASCADE, related_name='+')
+    peso = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('cancion', 'otra')
+        verbose_name = 'Coocurrencia'
+        verbose_name_plural = 'Coocurrencias'
+
+    def __str__(self):
+        return f"{self.cancion_id} - {self.otra_id}: {self.peso:.2f}"
+
+
+class Recomendacion(models.Model):
+    """Una de las canciones más parecidas a otra, en orden (ver manage.py build_recommendations)"""
+    cancion = models.ForeignKey(Cancion, on_delete=models.CASCADE, related_name='recomendaciones')
+    recomendada = models.ForeignKey(Cancion, on_delete=models.CASCADE, related_name='+')
+    posicion = models.PositiveSmallIntegerField()
+    puntuacion = models.FloatField()
+
+    class Meta:
+        unique_together = ('cancion', 'posicion')
+        verbose_name = 'Recomendación'
+        verbose_name_plural = 'Recomendaciones'
+
+    def __str__(self):
+        return f"{self.cancion_id} #{self.posicion}: {self.recomendada_id}"
@@ -0,0 +1,94 @@
+"""
+Forma de onda precalculada de cada audio para dibujar la barra de progreso.
+
+`manage.py build_waveforms` decodifica cada archivo una sola vez con ffmpeg
+(mono, ONDA_FRECUENCIA Hz, PCM de 16 bits) y reduce las muestras con NumPy
+a picos mínimo/máximo en varias resoluciones (ONDA_RESOLUCIONES puntos).
+Cada resolución se guarda como un blob de int8 con los pares
+[min0, max0, min1, max1, ...]: 1024 puntos ocupan 2 KB.
+
+Los picos se asocian al hash del audio y no a la canción, así que se
+comparten entre copias idénticas y su URL (/onda/<sha256>/<puntos>.bin)
+nunca cambia de contenido: se sirve con caché inmutable.
+"""
+import subprocess
+
+import numpy as np
+from django.conf import settings
+from django.urls import reverse
+
+from . import lotes
+from .almacenamiento import huella
+
+
+def resoluciones():
+    return tuple(sorted(getattr(settings, 'ONDA_RESOLUCIONES', (256, 1024, 4096))))
+
+
+def frecuencia():
+    return getattr(settings, 'ONDA_FRECUENCIA', 8000)
+
+
+def url_onda(cancion, puntos=1024):
+    """URL de los picos del audio de una canción (None si no está direccionado por contenido)"""
+    contenido = huella(cancion.archivo.name) if cancion.archivo else None
+    if not contenido:
+        return None
+    return reverse('forma_onda', args=[contenido, puntos])
+
+
+def decodificar(ruta, frecuencia_muestreo=None):
+    """Muestras mono int16 del archivo, decodificadas con ffmpeg (por defecto a ONDA_FRECUENCIA)"""
+    binario = getattr(settings, 'FFMPEG_BINARIO', 'ffmpeg')
+    resultado = subprocess.run(
+        [binario, '-nostdin', '-v', 'error', '-i', ruta, '-vn', '-ac', '1',
+         '-ar', str(frecuencia_muestreo or frecuencia()), '-f', 's16le', '-'],
+        check=True, capture_output=True, timeout=getattr(settings, 'FFMPEG_TIMEOUT', 600),
+    )
+    return np.frombuffer(resultado.stdout, dtype='<i2')
+
+
+def picos(muestras, puntos):
+    """
+    {resolución: bytes} con los pares min/max en int8 de cada resolución.
+    La más fina se calcula sobre las muestras y las demás se reducen a
+    partir de ella, sin volver a recorrer el audio.
+    """
+    puntos = tuple(sorted(puntos))
+    fina = puntos[-1]
+    muestras = np.asarray(muestras, dtype=np.int16)
+    if not len(muestras):
+        muestras = np.zeros(1, dtype=np.int16)
+    if len(muestras) < fina:
+        # Audio muy corto: al menos una muestra por punto
+        muestras = np.pad(muestras, (0, fina - len(muestras)), mode='edge')
+    # Trozos consecutivos de tamaño casi igual que cubren exactamente todas las muestras
+    inicios = np.arange(fina) * len(muestras) // fina
+    minimos = np.minimum.reduceat(muestras, inicios)
+    maximos = np.maximum.reduceat(muestras, inicios)
+
+    resultado = {}
+    for n in puntos:
+        if fina % n == 0:
+            paso = fina // n
+            bajo, alto = minimos.reshape(n, paso).min(axis=1), maximos.reshape(n, paso).max(axis=1)
+        else:
+            indices = np.arange(n) * fina // n
+            bajo = np.minimum.reduceat(minimos, indices)
+            alto = np.maximum.reduceat(maximos, indices)
+        pares = np.empty(2 * n, dtype=np.int8)
+        # int16 -> int8 conservando el signo (>> 8 redondea hacia abajo)
+        pares[0::2] = bajo >> 8
+        pares[1::2] = alto >> 8
+        resultado[n] = pares.tobytes()
+    return resultado
+
+
+def calcular(ruta):
+    """{puntos: bytes} de un archivo en todas las resoluciones"""
+    return picos(decodificar(ruta), resoluciones())
+
+
+def calcular_en_lote(tareas, procesos=None):
+    """Genera (contenido, {puntos: bytes}, error) para tareas (contenido, ruta)"""
+    return lotes.en_lote(calcular, tareas, procesos, errores=(OSError, subprocess.SubprocessError))
@@ -0,0 +1,30 @@
+"""
+Paginación por cursor (keyset) para las APIs de scroll infinito.
+
+El cursor es opaco para el cliente: JSON con los valores de las columnas de
+orden de la última fila servida, en base64 url-safe. Como identifica una
+posición en el orden y no un desplazamiento, no se desplaza al insertar filas.
+"""
+import base64
+import json
+
+
+def codificar_cursor(valores):
+    texto = json.dumps(valores, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(texto.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor, longitud):
+    """Devuelve la lista de valores del cursor o lanza ValueError si no es válido"""
+    try:
+        relleno = '=' * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + relleno).decode('utf-8'))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Cursor inválido') from e
+    if not isinstance(valores, list) or len(valores) != longitud:
+        raise ValueError('Cursor inválido')
+    return valores
+
+
+def leer_limite(request, defecto, maximo=50):
+    return min(max(int(request.GET.get('limit', defecto)), 1), maximo)
@@ -0,0 +1,93 @@
+"""
+Colores dominante y de acento de portadas e imágenes de artista.
+
+La imagen se reduce al abrirla (draft de JPEG + thumbnail a LADO px) y sus
+píxeles se agrupan con k-means vectorizado en NumPy. El dominante es el
+grupo más grande; el acento, el más saturado de los que se distinguen
+claramente del dominante. Se guardan en el modelo (color_dominante,
+color_acento) para que las páginas de detalle pinten un degradado sin
+esperar a descargar la portada.
+
+Se calculan al subir la imagen (ver music.signals) y en lote con
+`manage.py extract_palettes`.
+"""
+import numpy as np
+from PIL import Image
+
+from . import lotes
+
+LADO = 64
+GRUPOS = 5
+ITERACIONES = 10
+# Distancia RGB mínima para que un grupo cuente como acento
+DISTANCIA_ACENTO = 60
+LUMINANCIA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+# Lo que puede lanzar una imagen ilegible; DecompressionBombError no es un OSError
+ERRORES_IMAGEN = (OSError, ValueError, Image.DecompressionBombError)
+
+
+def a_hex(color):
+    return '#{:02x}{:02x}{:02x}'.format(*(int(round(c)) for c in np.clip(color, 0, 255)))
+
+
+def pixeles(origen):
+    """Píxeles RGB opacos (n x 3, float32) de una ruta o archivo de imagen, reducida"""
+    with Image.open(origen) as imagen:
+        imagen.draft('RGB', (LADO, LADO))
+        imagen = imagen.convert('RGBA')
+        imagen.thumbnail((LADO, LADO))
+    datos = np.asarray(imagen, dtype=np.float32).reshape(-1, 4)
+    return datos[datos[:, 3] >= 128, :3]
+
+
+def kmeans(datos, grupos=GRUPOS, iteraciones=ITERACIONES):
+    """Devuelve (centros, tamaños) de los grupos no vacíos, del más grande al más pequeño"""
+    # Inicio determinista: píxeles repartidos a lo largo de la luminancia
+    orden = np.argsort(datos @ LUMINANCIA)
+    centros = datos[orden[np.linspace(0, len(datos) - 1, grupos).astype(int)]]
+    for _ in range(iteraciones):
+        distancias = ((datos[:, None, :] - centros[None, :, :]) ** 2).sum(axis=2)
+        etiquetas = distancias.argmin(axis=1)
+        tamanos = np.bincount(etiquetas, minlength=grupos)
+        sumas = np.stack([np.bincount(etiquetas, weights=datos[:, canal], minlength=grupos)
+                          for canal in range(3)], axis=1)
+        nuevos = np.where(tamanos[:, None] > 0, sumas / np.maximum(tamanos, 1)[:, None], centros)
+        if np.allclose(nuevos, centros, atol=0.5):
+            break
+        centros = nuevos
+    usados = tamanos > 0
+    centros, tamanos = centros[usados], tamanos[usados]
+    orden = np.argsort(-tamanos)
+    return centros[orden], tamanos[orden]
+
+
+def extraer(origen):
+    """(dominante, acento) en '#rrggbb' o None si la imagen no tiene píxeles opacos"""
+    datos = pixeles(origen)
+    if not len(datos):
+        return None
+    centros, tamanos = kmeans(datos)
+    dominante = centros[0]
+
+    maximo, minimo = centros.max(axis=1), centros.min(axis=1)
+    saturacion = np.where(maximo > 0, (maximo - minimo) / np.maximum(maximo, 1), 0)
+    lejanos = np.sqrt(((centros - dominante) ** 2).sum(axis=1)) >= DISTANCIA_ACENTO
+    puntuacion = saturacion * np.sqrt(tamanos / tamanos.sum()) * lejanos
+    if puntuacion.max() > 0:
+        acento = centros[puntuacion.argmax()]
+    else:
+        # Imagen casi monocroma: el acento es el dominante oscurecido
+        acento = dominante * 0.55
+    return a_hex(dominante), a_hex(acento)
+
+
+def degradado(objeto, angulo=135):
+    """CSS con el degradado de los colores guardados en `objeto` (None si no tiene)"""
+    if not objeto.color_dominante:
+        return None
+    return f'linear-gradient({angulo}deg, {objeto.color_dominante} 0%, {objeto.color_acento} 100%)'
+
+
+def extraer_en_lote(tareas, procesos=None):
+    """Genera (clave, colores, error) para tareas (clave, ruta); procesos=1 trabaja aquí"""
+    return lotes.en_lote(extraer, tareas, procesos, errores=ERRORES_IMAGEN, chunksize=32)
@@ -0,0 +1,307 @@
+"""
+Recomendaciones canción a canción para el "a continuación" y las similares.
+
+La matriz de coocurrencia es dispersa y simétrica y vive en Coocurrencia
+(una fila por par con peso, más la diagonal con las apariciones de cada
+canción). Se alimenta de:
+
+- Sesiones de Reproduccion: reproducciones del mismo oyente (usuario, o IP
+  si es anónimo) separadas menos de RECOMENDACIONES_SESION_MINUTOS. Cada
+  reproducción se une a las VENTANA_SESION siguientes con peso 1/distancia.
+- Favoritos de cada usuario y canciones de cada playlist, como cestas: todos
+  los pares de la cesta (como mucho MAX_CESTA canciones por cesta).
+
+La puntuación de un par es su peso normalizado por las apariciones de las
+dos canciones (coseno), y Recomendacion guarda las RECOMENDACIONES_VECINAS
+mejores de cada canción en orden: servirlas es leer unas pocas filas por
+índice, sin calcular nada en la petición.
+
+`manage.py build_recommendations --completo` reconstruye todo. Sin
+--completo solo suma las reproducciones nuevas desde la marca guardada en
+MarcaAgregacion (con las anteriores del mismo oyente para completar sus
+sesiones) y recalcula las vecinas de las canciones cuyas filas cambian y
+de las que recomiendan alguna de ellas: sus apariciones entran en la
+puntuación de esas otras listas. Como los pesos sólo crecen, una canción
+cuyas apariciones suben sólo puede bajar en las listas ajenas, así que el
+resultado es el mismo que el de reconstruir. Los cambios de favoritos y
+playlists entran en la siguiente reconstrucción.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, Q
+
+from .models import Coocurrencia, Favorito, MarcaAgregacion, Playlist, Recomendacion, Reproduccion
+
+MARCA = 'recomendaciones'
+VENTANA_SESION = 5
+MAX_CESTA = 100
+PESO_FAVORITO = 2.0
+PESO_PLAYLIST = 1.0
+LOTE = 500
+
+
+def vecinas():
+    return getattr(settings, 'RECOMENDACIONES_VECINAS', 20)
+
+
+def sesion_segundos():
+    return getattr(settings, 'RECOMENDACIONES_SESION_MINUTOS', 30) * 60
+
+
+def recomendadas(cancion_id, limite, excluir=(), reproducibles=False):
+    """
+    Ids de las canciones recomendadas tras `cancion_id`, de mejor a peor;
+    con `reproducibles`, sólo las activas con archivo de audio
+    """
+    consulta = Recomendacion.objects.filter(cancion_id=cancion_id)
+    if excluir:
+        consulta = consulta.exclude(recomendada_id__in=excluir)
+    if reproducibles:
+        # Por el JOIN con la canción recomendada, sin subconsulta sobre todo el catálogo
+        consulta = consulta.filter(recomendada__activa=True).exclude(
+            Q(recomendada__archivo='') | Q(recomendada__archivo__isnull=True)
+        )
+    return list(consulta.order_by('posicion').values_list('recomendada_id', flat=True)[:limite])
+
+
+# --- MATRIZ DE COOCURRENCIA ---
+
+def _pares_sesiones(filas, desde=None):
+    """
+    (a, b, peso) de las reproducciones cercanas en la misma sesión y
+    (canciones, pesos) de sus apariciones. `filas` son tuplas
+    (id, oyente, cancion_id, segundos); con `desde` solo cuentan los pares
+    con alguna reproducción de id mayor y las apariciones de esas.
+    """
+    vacio = np.zeros(0, dtype=np.int64)
+    if not filas:
+        return (vacio, vacio, np.zeros(0)), (vacio, np.zeros(0))
+    ids, oyentes, canciones, segundos = (np.array(columna) for columna in zip(*filas))
+    orden = np.lexsort((ids, segundos, oyentes))
+    ids, oyentes, canciones, segundos = ids[orden], oyentes[orden], canciones[orden], segundos[orden]
+    nuevas = ids > desde if desde is not None else np.ones(len(ids), dtype=bool)
+
+    corte = np.r_[True, (oyentes[1:] != oyentes[:-1]) | (np.diff(segundos) > sesion_segundos())]
+    sesion = np.cumsum(corte)
+    a, b, pesos = [], [], []
+    for distancia in range(1, VENTANA_SESION + 1):
+        validos = (sesion[distancia:] == sesion[:-distancia]) \
+            & (canciones[distancia:] != canciones[:-distancia]) \
+            & (nuevas[distancia:] | nuevas[:-distancia])
+        a.append(canciones[:-distancia][validos])
+        b.append(canciones[distancia:][validos])
+        pesos.append(np.full(validos.sum(), 1.0 / distancia))
+    pares = (np.concatenate(a), np.concatenate(b), np.concatenate(pesos))
+    return pares, (canciones[nuevas], np.ones(nuevas.sum()))
+
+
+def _pares_cestas(cestas, peso):
+    """(a, b, peso) de todos los pares de cada cesta y (canciones, pesos) de sus apariciones"""
+    a, b, miembros = [], [], []
+    for cesta in cestas:
+        cesta = np.unique(np.array(cesta[:MAX_CESTA], dtype=np.int64))
+        i, j = np.triu_indices(len(cesta), 1)
+        a.append(cesta[i])
+        b.append(cesta[j])
+        miembros.append(cesta)
+    a = np.concatenate(a) if a else np.zeros(0, dtype=np.int64)
+    b = np.concatenate(b) if b else np.zeros(0, dtype=np.int64)
+    miembros = np.concatenate(miembros) if miembros else np.zeros(0, dtype=np.int64)
+    return (a, b, np.full(len(a), peso)), (miembros, np.full(len(miembros), peso))
+
+
+def _combinar(fuentes):
+    """
+    Suma las fuentes [((a, b, peso), (canciones, pesos))] en una matriz
+    simétrica (filas, columnas, pesos) con la diagonal de apariciones
+    """
+    filas, columnas, pesos = [], [], []
+    for (a, b, peso), (canciones, apariciones) in fuentes:
+        filas += [a, b, canciones]
+        columnas += [b, a, canciones]
+        pesos += [peso, peso, apariciones]
+    filas, columnas = np.concatenate(filas).astype(np.int64), np.concatenate(columnas).astype(np.int64)
+    pesos = np.concatenate(pesos).astype(np.float64)
+    if not len(filas):
+        return filas, columnas, pesos
+    claves = filas * (int(columnas.max()) + 1) + columnas
+    unicas, posicion = np.unique(claves, return_inverse=True)
+    sumas = np.bincount(posicion, weights=pesos)
+    primera = np.zeros(len(unicas), dtype=np.int64)
+    primera[posicion] = np.arange(len(posicion))
+    return filas[primera], columnas[primera], sumas
+
+
+def _mejores(filas, columnas, pesos, diagonal):
+    """
+    Recomendacion de las `vecinas()` mejores de cada fila. `diagonal` es
+    {cancion_id: apariciones} de todas las canciones que aparecen.
+    """
+    fuera = filas != columnas
+    filas, columnas, pesos = filas[fuera], columnas[fuera], pesos[fuera]
+    if not len(filas):
+        return []
+    apariciones_a = np.array([diagonal.get(c, 0.0) for c in filas.tolist()])
+    apariciones_b = np.array([diagonal.get(c, 0.0) for c in columnas.tolist()])
+    puntuacion = pesos / np.sqrt(np.maximum(apariciones_a * apariciones_b, 1e-9))
+
+    orden = np.lexsort((columnas, -puntuacion, filas))
+    agrupado = filas[orden]
+    rango = np.arange(len(orden)) - np.searchsorted(agrupado, agrupado, side='left')
+    elegidas = orden[rango < vecinas()]
+    return [
+        Recomendacion(cancion_id=fila, recomendada_id=columna, posicion=posicion, puntuacion=valor)
+        for fila, columna, posicion, valor in zip(
+            filas[elegidas].tolist(), columnas[elegidas].tolist(),
+            rango[rango < vecinas()].tolist(), puntuacion[elegidas].tolist(),
+        )
+    ]
+
+
+def _filas_reproduccion(consulta):
+    """Tuplas (id, oyente, cancion_id, segundos) de las reproducciones con oyente conocido"""
+    oyentes, filas = {}, []
+    columnas = ('id', 'usuario_id', 'ip_address', 'cancion_id', 'fecha_reproduccion')
+    for pk, usuario_id, ip, cancion_id, fecha in consulta.order_by().values_list(*columnas).iterator(chunk_size=10000):
+        if usuario_id is None and not ip:
+            continue
+        clave = usuario_id if usuario_id is not None else f'ip:{ip}'
+        oyente = oyentes.setdefault(clave, len(oyentes))
+        filas.append((pk, oyente, cancion_id, fecha.timestamp()))
+    return filas
+
+
+def _cestas_favoritos():
+    cestas = {}
+    for usuario_id, cancion_id in Favorito.objects.order_by('usuario_id', '-fecha_agregado') \
+            .values_list('usuario_id', 'cancion_id').iterator(chunk_size=10000):
+        cestas.setdefault(usuario_id, []).append(cancion_id)
+    return cestas.values()
+
+
+def _cestas_playlists():
+    cestas = {}
+    for playlist_id, cancion_id in Playlist.canciones.through.objects.order_by('playlist_id', 'id') \
+            .values_list('playlist_id', 'cancion_id').iterator(chunk_size=10000):
+        cestas.setdefault(playlist_id, []).append(cancion_id)
+    return cestas.values()
+
+
+def reconstruir():
+    """Recalcula la matriz y todas las recomendaciones. Devuelve (pares, canciones con vecinas)"""
+    with transaction.atomic():
+        marca, _ = MarcaAgregacion.objects.select_for_update().get_or_create(nombre=MARCA)
+        tope = Reproduccion.objects.aggregate(tope=Max('id'))['tope'] or 0
+        filas, columnas, pesos = _combinar([
+            _pares_sesiones(_filas_reproduccion(Reproduccion.objects.filter(id__lte=tope))),
+            _pares_cestas(_cestas_favoritos(), PESO_FAVORITO),
+            _pares_cestas(_cestas_playlists(), PESO_PLAYLIST),
+        ])
+        diagonal = {
+            fila: peso for fila, columna, peso in zip(filas.tolist(), columnas.tolist(), pesos.tolist())
+            if fila == columna
+        }
+        Coocurrencia.objects.all().delete()
+        Coocurrencia.objects.bulk_create(
+            (Coocurrencia(cancion_id=f, otra_id=c, peso=p)
+             for f, c, p in zip(filas.tolist(), columnas.tolist(), pesos.tolist())),
+            batch_size=2000,
+        )
+        mejores = _mejores(filas, columnas, pesos, diagonal)
+        Recomendacion.objects.all().delete()
+        Recomendacion.objects.bulk_create(mejores, batch_size=2000)
+
+        marca.ultimo_id = tope
+        marca.save(update_fields=['ultimo_id', 'fecha_actualizacion'])
+    return int((filas != columnas).sum()) // 2, len({r.cancion_id for r in mejores})
+
+
+def _acumular(filas, columnas, pesos):
+    """Suma los pesos a las filas de Coocurrencia existentes y crea las que faltan"""
+    deltas = dict(zip(zip(filas.tolist(), columnas.tolist()), pesos.tolist()))
+    afectadas = sorted(set(filas.tolist()))
+    for inicio in range(0, len(afectadas), LOTE):
+        actualizar = []
+        for coocurrencia in Coocurrencia.objects.filter(cancion_id__in=afectadas[inicio:inicio + LOTE]):
+            clave = (coocurrencia.cancion_id, coocurrencia.otra_id)
+            if clave in deltas:
+                coocurrencia.peso += deltas.pop(clave)
+                actualizar.append(coocurrencia)
+        Coocurrencia.objects.bulk_update(actualizar, ['peso'], batch_size=500)
+    Coocurrencia.objects.bulk_create(
+        [Coocurrencia(cancion_id=fila, otra_id=columna, peso=peso) for (fila, columna), peso in deltas.items()],
+        batch_size=2000,
+    )
+    return afectadas
+
+
+def _diagonal(ids):
+    ids, resultado = list(ids), {}
+    for inicio in range(0, len(ids), LOTE):
+        resultado.update(
+            Coocurrencia.objects.filter(cancion_id__in=ids[inicio:inicio + LOTE], otra_id=F('cancion_id'))
+            .values_list('cancion_id', 'peso')
+        )
+    return resultado
+
+
+def _con_quien_las_recomienda(ids):
+    """`ids` más las canciones que recomiendan alguna de ellas"""
+    ids, resultado = list(ids), set(ids)
+    for inicio in range(0, len(ids), LOTE):
+        resultado.update(
+            Recomendacion.objects.filter(recomendada_id__in=ids[inicio:inicio + LOTE])
+            .values_list('cancion_id', flat=True)
+        )
+    return sorted(resultado)
+
+
+def recalcular_vecinas(ids):
+    """Vuelve a elegir las recomendaciones de las canciones `ids` a partir de la matriz guardada"""
+    ids = list(ids)
+    for inicio in range(0, len(ids), LOTE):
+        lote = ids[inicio:inicio + LOTE]
+        datos = list(Coocurrencia.objects.filter(cancion_id__in=lote).values_list('cancion_id', 'otra_id', 'peso'))
+        Recomendacion.objects.filter(cancion_id__in=lote).delete()
+        if not datos:
+            continue
+        filas, columnas, pesos = (np.array(columna) for columna in zip(*datos))
+        diagonal = _diagonal(set(columnas.tolist()))
+        Recomendacion.objects.bulk_create(_mejores(filas, columnas, pesos, diagonal), batch_size=2000)
+
+
+def actualizar(lote=50000):
+    """Incorpora las reproducciones nuevas a la matriz. Devuelve (reproducciones, canciones recalculadas)"""
+    with transaction.atomic():
+        marca, _ = MarcaAgregacion.objects.select_for_update().get_or_create(nombre=MARCA)
+        nuevas = Reproduccion.objects.filter(id__gt=marca.ultimo_id).order_by('id')
+        tope = list(nuevas.values_list('id', flat=True)[lote - 1:lote])
+        if not tope:
+            tope = list(nuevas.reverse().values_list('id', flat=True)[:1])
+        if not tope:
+            return 0, 0
+        nuevas = Reproduccion.objects.filter(id__gt=marca.ultimo_id, id__lte=tope[0])
+        inicio = nuevas.order_by('fecha_reproduccion').values_list('fecha_reproduccion', flat=True).first()
+        usuarios = set(nuevas.exclude(usuario__isnull=True).values_list('usuario_id', flat=True))
+        ips = set(nuevas.filter(usuario__isnull=True).exclude(ip_address__isnull=True)
+                  .values_list('ip_address', flat=True))
+
+        # Reproducciones previas de los mismos oyentes que pueden compartir sesión con las nuevas
+        contexto = Reproduccion.objects.filter(
+            Q(usuario_id__in=usuarios) | Q(usuario__isnull=True, ip_address__in=ips),
+            id__lte=tope[0],
+            fecha_reproduccion__gte=inicio - timedelta(seconds=VENTANA_SESION * sesion_segundos()),
+        )
+        filas, columnas, pesos = _combinar([_pares_sesiones(_filas_reproduccion(contexto), desde=marca.ultimo_id)])
+        afectadas = _acumular(filas, columnas, pesos) if len(filas) else []
+        # La puntuación de un par depende de las apariciones de las dos canciones
+        afectadas = _con_quien_las_recomienda(afectadas)
+        recalcular_vecinas(afectadas)
+
+        procesadas = nuevas.count()
+        marca.ultimo_id = tope[0]
+        marca.save(update_fields=['ultimo_id', 'fecha_actualizacion'])
+    return procesadas, len(afectadas)
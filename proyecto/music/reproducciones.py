@@ -0,0 +1,155 @@
+"""
+Registro de reproducciones en memoria con volcado por lotes.
+
+Cada evento de reproducción se añade a un buffer del proceso. El buffer se
+vuelca cada REPRODUCCIONES_FLUSH_INTERVALO segundos (hilo en segundo plano),
+cuando acumula REPRODUCCIONES_LOTE eventos y al terminar el proceso. Un
+volcado hace un único UPDATE con F('reproducciones') + n por canción y un
+bulk_create de las filas de Reproduccion, todo en una transacción. Cada
+evento guarda la hora en que se registró, no la del volcado, para que los
+agregados por hora y día no dependan de cuándo se escribió. Si la
+transacción falla, los eventos vuelven al buffer para el siguiente volcado
+(como mucho REPRODUCCIONES_MAX_PENDIENTES; si se superan, se pierden los
+más antiguos).
+"""
+import atexit
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class BufferReproducciones:
+    def __init__(self, intervalo=5, lote=500, max_pendientes=50000):
+        self.intervalo = intervalo
+        self.lote = lote
+        self.max_pendientes = max_pendientes
+        self.eventos = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.hilo = None
+        self.parar = threading.Event()
+
+    def registrar(self, cancion_id, usuario_id=None, ip_address=None, user_agent=None):
+        self._arrancar()
+        with self.lock:
+            self.eventos.append((cancion_id, usuario_id, ip_address, user_agent, timezone.now()))
+            lleno = len(self.eventos) >= self.lote
+        if lleno:
+            try:
+                self.flush()
+            except Exception:
+                # Los eventos siguen en el buffer: se reintenta en el próximo volcado
+                logger.exception('Error al volcar las reproducciones')
+
+    def pendientes(self):
+        with self.lock:
+            return len(self.eventos)
+
+    def flush(self):
+        """Escribe los eventos acumulados. Devuelve cuántos se guardaron"""
+        from .models import Cancion, Reproduccion
+
+        with self.flush_lock:
+            with self.lock:
+                eventos, self.eventos = self.eventos, []
+            if not eventos:
+                return 0
+
+            try:
+                # Canciones y usuarios borrados desde que se registró el evento se descartan
+                canciones = set(
+                    Cancion.objects.filter(id__in={e[0] for e in eventos}).values_list('id', flat=True)
+                )
+                usuarios = set(
+                    get_user_model().objects.filter(id__in={e[1] for e in eventos if e[1] is not None})
+                    .values_list('id', flat=True)
+                )
+                eventos = [e for e in eventos if e[0] in canciones and (e[1] is None or e[1] in usuarios)]
+                conteos = Counter(evento[0] for evento in eventos)
+
+                with transaction.atomic():
+                    for cancion_id, n in conteos.items():
+                        Cancion.objects.filter(id=cancion_id).update(
+                            reproducciones=F('reproducciones') + n
+                        )
+                    Reproduccion.objects.bulk_create(
+                        [
+                            Reproduccion(
+                                cancion_id=cancion_id,
+                                usuario_id=usuario_id,
+                                ip_address=ip_address,
+                                user_agent=user_agent,
+                                fecha_reproduccion=fecha,
+                            )
+                            for cancion_id, usuario_id, ip_address, user_agent, fecha in eventos
+                        ],
+                        batch_size=self.lote,
+                    )
+            except Exception:
+                self._devolver(eventos)
+                raise
+            return len(eventos)
+
+    def _devolver(self, eventos):
+        """Vuelve a poner delante del buffer los eventos de un volcado fallido"""
+        with self.lock:
+            self.eventos = eventos + self.eventos
+            sobran = len(self.eventos) - self.max_pendientes
+            if sobran > 0:
+                del self.eventos[:sobran]
+        if sobran > 0:
+            logger.warning('Buffer de reproducciones lleno: se descartan %d eventos', sobran)
+
+    def _arrancar(self):
+        if self.hilo is not None or not self.intervalo:
+            return
+        with self.lock:
+            if self.hilo is None:
+                self.hilo = threading.Thread(
+                    target=self._bucle, name='music-reproducciones', daemon=True
+                )
+                self.hilo.start()
+                atexit.register(self.detener)
+
+    def _bucle(self):
+        while not self.parar.wait(self.intervalo):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Error al volcar las reproducciones')
+            finally:
+                connections.close_all()
+
+    def detener(self):
+        """Detiene el hilo y vuelca lo pendiente (se llama al terminar el proceso)"""
+        self.parar.set()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Error al volcar las reproducciones al terminar')
+
+
+buffer = BufferReproducciones(
+    intervalo=getattr(settings, 'REPRODUCCIONES_FLUSH_INTERVALO', 5),
+    lote=getattr(settings, 'REPRODUCCIONES_LOTE', 500),
+    max_pendientes=getattr(settings, 'REPRODUCCIONES_MAX_PENDIENTES', 50000),
+)
+
+
+def registrar(request, cancion_id):
+    """Añade al buffer una reproducción con los datos de la petición"""
+    usuario = request.user if request.user.is_authenticated else None
+    buffer.registrar(
+        cancion_id,
+        usuario_id=usuario.id if usuario else None,
+        ip_address=request.META.get('REMOTE_ADDR') or None,
+        user_agent=request.headers.get('User-Agent', ''),
+    )
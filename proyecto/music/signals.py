@@ -0,0 +1,380 @@
+"""
+Señales que mantienen sincronizadas las estructuras derivadas del catálogo.
+"""
+import logging
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import (
+    almacenamiento, autocompletado, busqueda, contadores, difuso, miniaturas, paleta, sonoridad, transcodificacion,
+)
+from .models import Album, Artista, Cancion, HuellaAcustica, Playlist, VersionAudio
+
+logger = logging.getLogger(__name__)
+
+
+# --- ÍNDICE DE BÚSQUEDA ---
+
+@receiver(post_save, sender=Cancion)
+def indexar_cancion_guardada(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    busqueda.indexar_canciones([instance.pk])
+
+
+@receiver(post_delete, sender=Cancion)
+def desindexar_cancion_eliminada(sender, instance, **kwargs):
+    busqueda.eliminar_canciones([instance.pk])
+
+
+@receiver(m2m_changed, sender=Cancion.artistas.through)
+def indexar_cambio_artistas(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        busqueda.indexar_canciones([instance.pk])
+    elif pk_set:
+        busqueda.indexar_canciones(pk_set)
+    elif action == 'post_clear':
+        # artista.canciones.clear(): las canciones afectadas se guardaron en pre_clear
+        busqueda.indexar_canciones(getattr(instance, '_canciones_indexadas', []))
+
+
+@receiver(m2m_changed, sender=Cancion.artistas.through)
+def recordar_canciones_antes_de_clear(sender, instance, action, reverse, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._canciones_indexadas = list(instance.canciones.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Artista)
+def indexar_canciones_de_artista(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    busqueda.indexar_canciones(instance.canciones.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Album)
+def indexar_canciones_de_album(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    busqueda.indexar_canciones(instance.canciones.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Artista)
+@receiver(pre_delete, sender=Album)
+def recordar_canciones_antes_de_borrar(sender, instance, **kwargs):
+    instance._canciones_indexadas = list(instance.canciones.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Artista)
+@receiver(post_delete, sender=Album)
+def indexar_canciones_tras_borrar(sender, instance, **kwargs):
+    busqueda.indexar_canciones(getattr(instance, '_canciones_indexadas', []))
+
+
+# --- ÍNDICE DE TRIGRAMAS (sugerencias difusas) ---
+
+@receiver(post_save, sender=Cancion)
+def actualizar_trigramas_cancion(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    difuso.actualizar(difuso.CANCION, instance.pk, instance.titulo if instance.activa else None)
+
+
+@receiver(post_delete, sender=Cancion)
+def eliminar_trigramas_cancion(sender, instance, **kwargs):
+    difuso.actualizar(difuso.CANCION, instance.pk)
+
+
+@receiver(post_save, sender=Artista)
+def actualizar_trigramas_artista(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    difuso.actualizar(difuso.ARTISTA, instance.pk, instance.nombre)
+
+
+@receiver(post_delete, sender=Artista)
+def eliminar_trigramas_artista(sender, instance, **kwargs):
+    difuso.actualizar(difuso.ARTISTA, instance.pk)
+
+
+# --- CACHÉ DE SUGERENCIAS ---
+
+@receiver(post_save, sender=Cancion)
+@receiver(post_save, sender=Artista)
+@receiver(post_save, sender=Album)
+@receiver(post_delete, sender=Cancion)
+@receiver(post_delete, sender=Artista)
+@receiver(post_delete, sender=Album)
+def invalidar_sugerencias(sender, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    # Los guardados que sólo tocan contadores no cambian las sugerencias
+    if update_fields and set(update_fields) <= {'reproducciones'}:
+        return
+    autocompletado.invalidar()
+
+
+@receiver(m2m_changed, sender=Cancion.artistas.through)
+def invalidar_sugerencias_artistas(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        autocompletado.invalidar()
+
+
+# --- CONTADORES DESNORMALIZADOS ---
+
+def _relaciones_m2m(through, instance, action, reverse, pk_set, campo_origen, campo_destino):
+    """
+    Devuelve (signo, [(origen_id, destino_id)]) de las filas añadidas o
+    quitadas de una relación M2M, o None si no hay nada que ajustar. Antes
+    de quitar filas se calcula qué relaciones existían de verdad, porque
+    pk_set en remove/clear no está filtrado.
+    """
+    atributo = f'_quitadas_{through._meta.model_name}'
+    if action in ('pre_remove', 'pre_clear'):
+        filas = through.objects.filter(**{campo_origen if not reverse else campo_destino: instance.pk})
+        if action == 'pre_remove':
+            filas = filas.filter(**{f'{campo_destino if not reverse else campo_origen}__in': pk_set})
+        setattr(instance, atributo, list(filas.values_list(campo_origen, campo_destino)))
+        return None
+
+    if action == 'post_add' and pk_set:
+        relaciones = [(instance.pk, pk) if not reverse else (pk, instance.pk) for pk in pk_set]
+    elif action in ('post_remove', 'post_clear'):
+        relaciones = getattr(instance, atributo, [])
+        setattr(instance, atributo, [])
+    else:
+        return None
+    if not relaciones:
+        return None
+    return (1 if action == 'post_add' else -1), relaciones
+
+
+def _contar_destinos(modelo, campo, cambio):
+    if cambio is None:
+        return
+    signo, relaciones = cambio
+    deltas = {}
+    for _, destino_id in relaciones:
+        deltas[destino_id] = deltas.get(destino_id, 0) + signo
+    contadores.ajustar_por_id(modelo, campo, deltas)
+
+
+@receiver(m2m_changed, sender=Cancion.artistas.through)
+def contar_artistas_de_cancion(sender, instance, action, reverse, pk_set, **kwargs):
+    _contar_destinos(Artista, 'total_canciones', _relaciones_m2m(
+        sender, instance, action, reverse, pk_set, 'cancion_id', 'artista_id'))
+
+
+@receiver(m2m_changed, sender=Album.artistas.through)
+def contar_artistas_de_album(sender, instance, action, reverse, pk_set, **kwargs):
+    _contar_destinos(Artista, 'total_albums', _relaciones_m2m(
+        sender, instance, action, reverse, pk_set, 'album_id', 'artista_id'))
+
+
+@receiver(m2m_changed, sender=Playlist.canciones.through)
+def sumar_duracion_playlist(sender, instance, action, reverse, pk_set, **kwargs):
+    cambio = _relaciones_m2m(sender, instance, action, reverse, pk_set, 'playlist_id', 'cancion_id')
+    if cambio is None:
+        return
+    signo, relaciones = cambio
+    duraciones = contadores.duraciones(Cancion, {cancion_id for _, cancion_id in relaciones})
+    deltas = {}
+    for playlist_id, cancion_id in relaciones:
+        deltas[playlist_id] = deltas.get(playlist_id, 0) + signo * duraciones.get(cancion_id, 0)
+    contadores.ajustar_por_id(Playlist, 'duracion_segundos', deltas)
+
+
+# album_id sin cargar (.only() / .defer()): no se sabe en qué álbum estaba
+ALBUM_DIFERIDO = object()
+
+
+def _duracion_cargada(instance):
+    datos = instance.__dict__
+    if 'minutos' not in datos or 'segundos' not in datos:
+        return None
+    return instance.duracion_en_segundos
+
+
+def _medida(instance):
+    # sonoridad diferida cuenta como medida: recalcular de más no cambia la ganancia
+    return instance.__dict__.get('sonoridad', True) is not None
+
+
+@receiver(post_init, sender=Cancion)
+def recordar_album_original(sender, instance, **kwargs):
+    instance._album_original = instance.__dict__.get('album_id', ALBUM_DIFERIDO)
+    instance._duracion_original = _duracion_cargada(instance)
+
+
+@receiver(pre_save, sender=Cancion)
+def leer_album_diferido(sender, instance, raw=False, **kwargs):
+    # album_id diferido pero asignado después de cargar: el álbum anterior se lee de la BD
+    if instance._album_original is ALBUM_DIFERIDO and 'album_id' in instance.__dict__ and instance.pk:
+        instance._album_original = Cancion.objects.filter(pk=instance.pk) \
+            .values_list('album_id', flat=True).first()
+
+
+@receiver(post_save, sender=Cancion)
+def contar_cancion_en_album(sender, instance, created, raw=False, **kwargs):
+    anterior, duracion_anterior = instance._album_original, instance._duracion_original
+    if anterior is ALBUM_DIFERIDO:
+        # Ni cargado ni asignado: este guardado no cambia el álbum
+        anterior = instance.album_id
+    instance._album_original = instance.album_id
+    instance._duracion_original = duracion = _duracion_cargada(instance)
+    if raw:
+        return
+
+    if created:
+        contadores.ajustar_por_id(Album, 'total_canciones', {instance.album_id: 1})
+        contadores.ajustar_por_id(Album, 'duracion_segundos', {instance.album_id: duracion})
+        if _medida(instance):
+            sonoridad.actualizar_albums([instance.album_id])
+        return
+
+    if instance.album_id != anterior:
+        contadores.ajustar_por_id(Album, 'total_canciones', {anterior: -1, instance.album_id: 1})
+        # La ganancia de álbum sale de sus pistas medidas: cambia en los dos
+        sonoridad.actualizar_albums([anterior, instance.album_id])
+    if duracion is None or duracion_anterior is None:
+        # Campos diferidos: no se conoce la diferencia y se recalcula
+        contadores.recalcular_duraciones(Album, Playlist, Cancion, albums=[anterior, instance.album_id],
+                                         playlists=instance.playlists.values('id'))
+    elif instance.album_id != anterior or duracion != duracion_anterior:
+        contadores.ajustar_por_id(Album, 'duracion_segundos', {anterior: -duracion_anterior})
+        contadores.ajustar_por_id(Album, 'duracion_segundos', {instance.album_id: duracion})
+        if duracion != duracion_anterior:
+            contadores.ajustar(Playlist, 'duracion_segundos',
+                               instance.playlists.values_list('id', flat=True), duracion - duracion_anterior)
+
+
+@receiver(pre_delete, sender=Cancion)
+def recordar_relaciones_de_cancion(sender, instance, **kwargs):
+    instance._artistas_contados = list(instance.artistas.values_list('id', flat=True))
+    instance._playlists_contadas = list(instance.playlists.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Cancion)
+def descontar_cancion_eliminada(sender, instance, **kwargs):
+    duracion = instance.duracion_en_segundos
+    contadores.ajustar(Artista, 'total_canciones', getattr(instance, '_artistas_contados', []), -1)
+    contadores.ajustar_por_id(Album, 'total_canciones', {instance.album_id: -1})
+    contadores.ajustar_por_id(Album, 'duracion_segundos', {instance.album_id: -duracion})
+    contadores.ajustar(Playlist, 'duracion_segundos', getattr(instance, '_playlists_contadas', []), -duracion)
+    if _medida(instance):
+        sonoridad.actualizar_albums([instance.album_id])
+
+
+@receiver(pre_delete, sender=Album)
+def recordar_artistas_de_album(sender, instance, **kwargs):
+    instance._artistas_contados = list(instance.artistas.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Album)
+def descontar_album_eliminado(sender, instance, **kwargs):
+    contadores.ajustar(Artista, 'total_albums', getattr(instance, '_artistas_contados', []), -1)
+
+
+# --- ARCHIVOS DE AUDIO ---
+
+def _nombre_archivo(instance):
+    valor = instance.__dict__.get('archivo')
+    return getattr(valor, 'name', valor) or None
+
+
+@receiver(post_init, sender=Cancion)
+def recordar_archivo_original(sender, instance, **kwargs):
+    instance._archivo_original = _nombre_archivo(instance)
+
+
+@receiver(post_save, sender=Cancion)
+def liberar_archivo_reemplazado(sender, instance, created, raw=False, **kwargs):
+    anterior, instance._archivo_original = instance._archivo_original, _nombre_archivo(instance)
+    nuevo = instance._archivo_original
+    if anterior and anterior != nuevo:
+        # Tras el commit, para no perder el archivo si la transacción se deshace
+        transaction.on_commit(lambda: almacenamiento.liberar([anterior]))
+    if not raw and nuevo and (created or anterior != nuevo):
+        transcodificacion.encolar(instance)
+    if not created and anterior != nuevo and (instance.hls or instance.sonoridad is not None):
+        # El paquete HLS y la medida de sonoridad eran del audio anterior
+        instance.hls, instance.sonoridad, instance.pico_real, instance.ganancia = '', None, None, None
+        Cancion.objects.filter(pk=instance.pk).update(hls='', sonoridad=None, pico_real=None, ganancia=None)
+        # Sin la medida de esta pista la ganancia del álbum se calcula con las demás
+        sonoridad.actualizar_albums([instance.album_id])
+    if not created and anterior != nuevo:
+        # La huella acústica también: se vuelve a calcular con fingerprint_audio
+        HuellaAcustica.objects.filter(cancion=instance).delete()
+
+
+@receiver(post_delete, sender=Cancion)
+@receiver(post_delete, sender=VersionAudio)
+def liberar_archivo_eliminado(sender, instance, **kwargs):
+    nombre = _nombre_archivo(instance)
+    if nombre:
+        transaction.on_commit(lambda: almacenamiento.liberar([nombre]))
+
+
+# --- MINIATURAS Y COLORES DE IMÁGENES ---
+
+CAMPOS_IMAGEN = {Artista: 'imagen', Album: 'portada', Cancion: 'portada', Playlist: 'portada'}
+# Modelos con color_dominante / color_acento (music/paleta.py)
+CON_PALETA = (Artista, Album, Cancion)
+
+
+def _nombre_imagen(instance):
+    valor = instance.__dict__.get(CAMPOS_IMAGEN[type(instance)])
+    return getattr(valor, 'name', valor) or None
+
+
+def _actualizar_paleta(instance, nombre):
+    colores = ('', '')
+    if nombre:
+        try:
+            with default_storage.open(nombre, 'rb') as archivo:
+                colores = paleta.extraer(archivo) or colores
+        except paleta.ERRORES_IMAGEN as error:
+            logger.warning('No se pudo extraer la paleta de %s: %s', nombre, error)
+    instance.color_dominante, instance.color_acento = colores
+    type(instance).objects.filter(pk=instance.pk).update(color_dominante=colores[0], color_acento=colores[1])
+
+
+@receiver(post_init, sender=Artista)
+@receiver(post_init, sender=Album)
+@receiver(post_init, sender=Cancion)
+@receiver(post_init, sender=Playlist)
+def recordar_imagen_original(sender, instance, **kwargs):
+    instance._imagen_original = _nombre_imagen(instance)
+
+
+@receiver(post_save, sender=Artista)
+@receiver(post_save, sender=Album)
+@receiver(post_save, sender=Cancion)
+@receiver(post_save, sender=Playlist)
+def actualizar_imagen_derivada(sender, instance, raw=False, **kwargs):
+    anterior, instance._imagen_original = instance._imagen_original, _nombre_imagen(instance)
+    nueva = instance._imagen_original
+    if raw or anterior == nueva:
+        return
+    if sender in CON_PALETA:
+        # Sobre 64 px: es rápido y así la página ya sale con los colores nuevos
+        _actualizar_paleta(instance, nueva)
+    if anterior:
+        transaction.on_commit(lambda: miniaturas.eliminar(anterior))
+    if nueva and getattr(settings, 'MINIATURAS_AL_SUBIR', True):
+        transaction.on_commit(lambda: miniaturas.generar_todas(nueva))
+
+
+@receiver(post_delete, sender=Artista)
+@receiver(post_delete, sender=Album)
+@receiver(post_delete, sender=Cancion)
+@receiver(post_delete, sender=Playlist)
+def eliminar_miniaturas(sender, instance, **kwargs):
+    nombre = _nombre_imagen(instance)
+    if nombre:
+        transaction.on_commit(lambda: miniaturas.eliminar(nombre))
@@ -0,0 +1,175 @@
+"""
+Sonoridad integrada y pico real de cada pista (al estilo de EBU R128).
+
+`manage.py analyze_loudness` decodifica cada audio con ffmpeg a 48 kHz
+(PCM float, con sus canales originales) en un pool de procesos y mide:
+
+- Sonoridad integrada (LUFS): el audio se parte en subbloques de 100 ms;
+  la potencia ponderada K de cada uno se calcula en el dominio de la
+  frecuencia (Parseval sobre la FFT, multiplicando por |H(f)|² de los dos
+  filtros de la norma) y los bloques de 400 ms con solapamiento del 75 %
+  son la media de cuatro subbloques. Después se aplican las puertas
+  absoluta (-70 LUFS) y relativa (-10 LU).
+- Pico real (dBTP): máximo de la señal sobremuestreada x4 por FFT.
+
+Con ello se guarda en cada canción la ganancia que la lleva a
+SONORIDAD_OBJETIVO sin superar PICO_MAXIMO, y en cada álbum una ganancia
+común para todas sus pistas (conserva las diferencias entre ellas). El
+reproductor aplica una u otra según ConfiguracionUsuario.normalizacion.
+"""
+import math
+import struct
+import subprocess
+
+import numpy as np
+from django.conf import settings
+from django.db.models import F
+
+from . import lotes
+from .metadatos import ErrorMetadatos, leer_metadatos
+from .models import Album, Cancion
+
+FRECUENCIA = 48000
+SUBBLOQUE = FRECUENCIA // 10
+PUERTA_ABSOLUTA = -70.0
+PUERTA_RELATIVA = -10.0
+SOBREMUESTREO = 4
+# Subbloques por FFT y muestras por trozo del pico real: limitan la memoria por proceso
+SUBBLOQUES_POR_LOTE = 256
+TROZO_PICO = FRECUENCIA
+MARGEN_PICO = 256
+
+# Filtros de ponderación K de ITU-R BS.1770 a 48 kHz (estantería y paso alto)
+ESTANTERIA = ([1.53512485958697, -2.69169618940638, 1.19839281085285],
+              [1.0, -1.69065929318241, 0.73248077421585])
+PASO_ALTO = ([1.0, -2.0, 1.0], [1.0, -1.99004745483398, 0.99007225036621])
+
+
+def objetivo():
+    return getattr(settings, 'SONORIDAD_OBJETIVO', -14.0)
+
+
+def pico_maximo():
+    return getattr(settings, 'PICO_MAXIMO', -1.0)
+
+
+def decodificar(ruta):
+    """Muestras float32 (n x canales) a 48 kHz, decodificadas con ffmpeg"""
+    try:
+        canales = leer_metadatos(ruta)['canales']
+    except (ErrorMetadatos, struct.error):
+        # Cabeceras ilegibles: ffmpeg decide si el audio se puede decodificar
+        canales = 2
+    binario = getattr(settings, 'FFMPEG_BINARIO', 'ffmpeg')
+    resultado = subprocess.run(
+        [binario, '-nostdin', '-v', 'error', '-i', ruta, '-vn', '-ac', str(canales),
+         '-ar', str(FRECUENCIA), '-f', 'f32le', '-'],
+        check=True, capture_output=True, timeout=getattr(settings, 'FFMPEG_TIMEOUT', 600),
+    )
+    return np.frombuffer(resultado.stdout, dtype='<f4').reshape(-1, canales)
+
+
+def ponderacion_k(n):
+    """|H(f)|² de la ponderación K en los bins de una rfft de `n` muestras"""
+    z = np.exp(-2j * np.pi * np.fft.rfftfreq(n, 1 / FRECUENCIA) / FRECUENCIA)
+    respuesta = np.ones_like(z)
+    for b, a in (ESTANTERIA, PASO_ALTO):
+        respuesta *= np.polyval(b[::-1], z) / np.polyval(a[::-1], z)
+    return np.abs(respuesta) ** 2
+
+
+def potencias_subbloques(muestras):
+    """Potencia ponderada K de cada subbloque de 100 ms, sumada sobre los canales"""
+    n = len(muestras) // SUBBLOQUE
+    if not n:
+        return np.zeros(0)
+    bloques = muestras[:n * SUBBLOQUE].reshape(n, SUBBLOQUE, -1)
+    peso = ponderacion_k(SUBBLOQUE)[None, :, None]
+    # Parseval para la rfft: los bins intermedios cuentan dos veces
+    peso = peso * np.r_[1, np.full(SUBBLOQUE // 2 - 1, 2), 1][None, :, None]
+    potencias = np.empty(n)
+    for inicio in range(0, n, SUBBLOQUES_POR_LOTE):
+        espectro = np.fft.rfft(bloques[inicio:inicio + SUBBLOQUES_POR_LOTE], axis=1)
+        energia = (np.abs(espectro) ** 2 * peso).sum(axis=(1, 2))
+        potencias[inicio:inicio + SUBBLOQUES_POR_LOTE] = energia / SUBBLOQUE ** 2
+    return potencias
+
+
+def sonoridad_integrada(muestras):
+    """LUFS integrados o None si todo queda por debajo de la puerta absoluta"""
+    subbloques = potencias_subbloques(muestras)
+    if len(subbloques) < 4:
+        return None
+    # Bloques de 400 ms cada 100 ms: media de 4 subbloques consecutivos
+    acumulado = np.concatenate(([0.0], np.cumsum(subbloques)))
+    bloques = (acumulado[4:] - acumulado[:-4]) / 4
+    with np.errstate(divide='ignore'):
+        sonoridad = -0.691 + 10 * np.log10(bloques)
+    bloques = bloques[sonoridad > PUERTA_ABSOLUTA]
+    if not len(bloques):
+        return None
+    relativa = -0.691 + 10 * np.log10(bloques.mean()) + PUERTA_RELATIVA
+    bloques = bloques[-0.691 + 10 * np.log10(bloques) > relativa]
+    return float(-0.691 + 10 * np.log10(bloques.mean()))
+
+
+def pico_real(muestras):
+    """Pico real en dBTP (sobremuestreo x4 por trozos con margen para evitar bordes)"""
+    total = len(muestras)
+    if not total:
+        return None
+    pico = float(np.abs(muestras).max())
+    for inicio in range(0, total, TROZO_PICO):
+        desde, hasta = max(0, inicio - MARGEN_PICO), min(total, inicio + TROZO_PICO + MARGEN_PICO)
+        trozo = muestras[desde:hasta]
+        sobre = np.fft.irfft(np.fft.rfft(trozo, axis=0), n=len(trozo) * SOBREMUESTREO, axis=0) * SOBREMUESTREO
+        centro = sobre[(inicio - desde) * SOBREMUESTREO:(min(total, inicio + TROZO_PICO) - desde) * SOBREMUESTREO]
+        pico = max(pico, float(np.abs(centro).max()))
+    return 20 * math.log10(pico) if pico > 0 else None
+
+
+def ganancia(sonoridad, pico):
+    """dB para llegar al objetivo sin que el pico real pase de PICO_MAXIMO"""
+    if sonoridad is None:
+        return None
+    resultado = objetivo() - sonoridad
+    if pico is not None:
+        resultado = min(resultado, pico_maximo() - pico)
+    return round(resultado, 2)
+
+
+def ganancia_album(pistas):
+    """
+    Ganancia común de un álbum a partir de [(sonoridad, pico, segundos)]:
+    la sonoridad del álbum es la media de energía ponderada por duración.
+    """
+    medidas = [(s, p, d) for s, p, d in pistas if s is not None and d]
+    if not medidas:
+        return None
+    energia = sum(d * 10 ** (s / 10) for s, _, d in medidas) / sum(d for _, _, d in medidas)
+    picos = [p for _, p, _ in medidas if p is not None]
+    return ganancia(10 * math.log10(energia), max(picos) if picos else None)
+
+
+def analizar(ruta):
+    muestras = decodificar(ruta)
+    return sonoridad_integrada(muestras), pico_real(muestras)
+
+
+def analizar_en_lote(tareas, procesos=None):
+    """Genera (clave, (sonoridad, pico), error) para tareas (clave, ruta)"""
+    return lotes.en_lote(analizar, tareas, procesos, errores=(OSError, ValueError, subprocess.SubprocessError))
+
+
+def actualizar_albums(ids):
+    """Recalcula la ganancia de los álbumes `ids` a partir de sus pistas ya medidas"""
+    ids = [album_id for album_id in ids if album_id]
+    for inicio in range(0, len(ids), 500):
+        lote = ids[inicio:inicio + 500]
+        pistas = {}
+        for album_id, sonoridad, pico, segundos in Cancion.objects.filter(album_id__in=lote) \
+                .annotate(total=F('minutos') * 60 + F('segundos')) \
+                .values_list('album_id', 'sonoridad', 'pico_real', 'total'):
+            pistas.setdefault(album_id, []).append((sonoridad, pico, segundos))
+        albums = [Album(pk=album_id, ganancia=ganancia_album(pistas.get(album_id, []))) for album_id in lote]
+        Album.objects.bulk_update(albums, ['ganancia'])
@@ -12,6 +12,353 @@ window.playSong = function (songId) {
     window.location.href = `/player/?id=${songId}`;
 };
 
+function getCookie(name) {
+    const match = document.cookie.match(new RegExp('(?:^|; )' + name + '=([^;]*)'));
+    return match ? decodeURIComponent(match[1]) : null;
+}
+
+// ============================================
+// REPRODUCCIÓN ADAPTATIVA (HLS)
+// ============================================
+// Con una lista maestra HLS (/hls/...) el audio se pide por segmentos de
+// pocos segundos y antes de cada uno se elige la variante de mayor bitrate
+// que permite el rendimiento medido. Safari reproduce HLS de forma nativa;
+// en el resto se usa Media Source Extensions con segmentos MP3. Si no hay
+// soporte, se usa la URL de audio progresiva de siempre.
+
+function crearReproductorAdaptativo(audio) {
+    const nativo = audio.canPlayType('application/vnd.apple.mpegurl') !== '';
+    const mse = !!(window.MediaSource && MediaSource.isTypeSupported('audio/mpeg'));
+    const BUFFER_OBJETIVO = 30;   // segundos por delante que se intentan tener descargados
+    const MARGEN_ANCHO = 0.8;     // fracción del rendimiento medido que se puede usar
+    let generacion = 0;
+    let rendimiento = null;       // bits/s, media móvil exponencial
+
+    function resolver(url, base) {
+        return new URL(url, base).href;
+    }
+
+    function leerMaestra(texto, base) {
+        const variantes = [];
+        const lineas = texto.split('\n').map(l => l.trim());
+        lineas.forEach((linea, i) => {
+            const ancho = linea.startsWith('#EXT-X-STREAM-INF') && linea.match(/BANDWIDTH=(\d+)/);
+            if (ancho && lineas[i + 1]) {
+                variantes.push({ ancho: parseInt(ancho[1]), url: resolver(lineas[i + 1], base), segmentos: null });
+            }
+        });
+        return variantes.sort((a, b) => a.ancho - b.ancho);
+    }
+
+    function leerMedia(texto, base) {
+        const segmentos = [];
+        let inicio = 0;
+        const lineas = texto.split('\n').map(l => l.trim());
+        lineas.forEach((linea, i) => {
+            if (linea.startsWith('#EXTINF:') && lineas[i + 1]) {
+                const duracion = parseFloat(linea.slice(8));
+                segmentos.push({ url: resolver(lineas[i + 1], base), inicio: inicio, duracion: duracion });
+                inicio += duracion;
+            }
+        });
+        return segmentos;
+    }
+
+    function pedirTexto(url) {
+        return fetch(url).then(r => {
+            if (!r.ok) throw new Error(`HTTP ${r.status}`);
+            return r.text();
+        });
+    }
+
+    function segmentosDe(variante) {
+        if (variante.segmentos) return Promise.resolve(variante.segmentos);
+        return pedirTexto(variante.url).then(texto => {
+            variante.segmentos = leerMedia(texto, variante.url);
+            return variante.segmentos;
+        });
+    }
+
+    function elegirVariante(variantes) {
+        // Sin medidas todavía se empieza por la más ligera para arrancar rápido
+        if (rendimiento === null) return variantes[0];
+        let elegida = variantes[0];
+        variantes.forEach(v => {
+            if (v.ancho <= rendimiento * MARGEN_ANCHO) elegida = v;
+        });
+        return elegida;
+    }
+
+    function medir(bytes, milisegundos) {
+        if (milisegundos <= 0) return;
+        const muestra = bytes * 8 / (milisegundos / 1000);
+        rendimiento = rendimiento === null ? muestra : 0.7 * rendimiento + 0.3 * muestra;
+    }
+
+    function segundosPorDelante() {
+        const buffered = audio.buffered;
+        for (let i = 0; i < buffered.length; i++) {
+            if (buffered.start(i) <= audio.currentTime + 0.5 && audio.currentTime < buffered.end(i)) {
+                return buffered.end(i) - audio.currentTime;
+            }
+        }
+        return 0;
+    }
+
+    function esperarActualizacion(buffer) {
+        return new Promise(resolve => buffer.addEventListener('updateend', resolve, { once: true }));
+    }
+
+    function esperarNecesidad(miGeneracion) {
+        return new Promise(resolve => {
+            const comprobar = () => {
+                if (miGeneracion !== generacion || segundosPorDelante() < BUFFER_OBJETIVO) {
+                    audio.removeEventListener('timeupdate', comprobar);
+                    audio.removeEventListener('seeking', comprobar);
+                    resolve();
+                }
+            };
+            audio.addEventListener('timeupdate', comprobar);
+            audio.addEventListener('seeking', comprobar);
+        });
+    }
+
+    async function alimentar(mediaSource, buffer, variantes, estado, miGeneracion) {
+        while (miGeneracion === generacion) {
+            const referencia = await segmentosDe(variantes[0]);
+            if (estado.indice >= referencia.length) {
+                if (mediaSource.readyState === 'open' && !buffer.updating) mediaSource.endOfStream();
+                await esperarNecesidad(miGeneracion);
+                continue;
+            }
+            if (segundosPorDelante() >= BUFFER_OBJETIVO) {
+                await esperarNecesidad(miGeneracion);
+                continue;
+            }
+
+            const variante = elegirVariante(variantes);
+            const segmentos = await segmentosDe(variante);
+            const indice = estado.indice;
+            const segmento = segmentos[Math.min(indice, segmentos.length - 1)];
+            const t0 = performance.now();
+            const respuesta = await fetch(segmento.url);
+            if (!respuesta.ok) throw new Error(`HTTP ${respuesta.status}`);
+            const datos = await respuesta.arrayBuffer();
+            medir(datos.byteLength, performance.now() - t0);
+            if (miGeneracion !== generacion) return;
+            // Tras un salto el índice ya apunta a otro segmento: éste se descarta
+            if (indice !== estado.indice) continue;
+
+            // Tras endOfStream() (p. ej. al volver atrás después del final) añadir
+            // vuelve a abrir el MediaSource: 'ended' pasa a 'open'
+            buffer.timestampOffset = segmento.inicio;
+            buffer.appendBuffer(datos);
+            await esperarActualizacion(buffer);
+            estado.indice = indice + 1;
+        }
+    }
+
+    function cargar(urlMaestra, urlRespaldo) {
+        generacion++;
+        if (nativo) {
+            audio.src = urlMaestra;
+            return true;
+        }
+        if (!mse) return false;
+
+        const miGeneracion = generacion;
+        const mediaSource = new MediaSource();
+        const respaldo = (error) => {
+            console.log('main.js: Adaptive playback failed, using progressive audio:', error);
+            if (miGeneracion !== generacion || !urlRespaldo) return;
+            generacion++;
+            audio.src = urlRespaldo;
+            audio.play().catch(() => {});
+        };
+
+        mediaSource.addEventListener('sourceopen', () => {
+            URL.revokeObjectURL(audio.src);
+            pedirTexto(urlMaestra).then(texto => {
+                const variantes = leerMaestra(texto, urlMaestra);
+                if (variantes.length === 0) throw new Error('Lista maestra vacía');
+                return segmentosDe(variantes[0]).then(referencia => {
+                    if (miGeneracion !== generacion) return;
+                    const ultimo = referencia[referencia.length - 1];
+                    mediaSource.duration = ultimo ? ultimo.inicio + ultimo.duracion : 0;
+                    const buffer = mediaSource.addSourceBuffer('audio/mpeg');
+                    const estado = { indice: 0 };
+
+                    audio.addEventListener('seeking', function alSaltar() {
+                        if (miGeneracion !== generacion) {
+                            audio.removeEventListener('seeking', alSaltar);
+                            return;
+                        }
+                        if (segundosPorDelante() > 0) return;
+                        const destino = referencia.findIndex(s => audio.currentTime < s.inicio + s.duracion);
+                        estado.indice = destino < 0 ? referencia.length : destino;
+                    });
+                    return alimentar(mediaSource, buffer, variantes, estado, miGeneracion);
+                });
+            }).catch(respaldo);
+        }, { once: true });
+        audio.src = URL.createObjectURL(mediaSource);
+        return true;
+    }
+
+    function detener() {
+        generacion++;
+    }
+
+    return { cargar: cargar, detener: detener, nativo: nativo };
+}
+
+// ============================================
+// NORMALIZACIÓN DE SONORIDAD
+// ============================================
+// La ganancia de cada pista (y la común de su álbum) se mide en el servidor
+// (music/sonoridad.py); aquí sólo se aplica con un GainNode de Web Audio,
+// independiente del control de volumen. Sin Web Audio suena sin normalizar.
+// Con HLS nativo (Safari) tampoco: ese audio no pasa por Web Audio y el
+// elemento conectado sonaría en silencio.
+
+function crearNormalizador(audio, modo) {
+    const Contexto = window.AudioContext || window.webkitAudioContext;
+    let contexto = null;
+    let nodo = null;
+    let factor = 1;
+    let omitido = false;
+
+    function fallo(error) {
+        console.log('main.js: Web Audio not available, playing without normalization:', error);
+        contexto = null;
+        nodo = null;
+    }
+
+    function conectar() {
+        if (contexto || omitido || !Contexto || modo === 'no') return;
+        let nuevo;
+        try {
+            nuevo = new Contexto();
+        } catch (error) {
+            fallo(error);
+            return;
+        }
+        contexto = nuevo;
+        // createMediaElementSource desvía el audio al contexto para siempre: si éste
+        // no llega a arrancar el elemento quedaría mudo, así que se espera a resume()
+        nuevo.resume().then(() => {
+            if (contexto !== nuevo) return;
+            if (omitido) {
+                contexto = null;
+                nuevo.close();
+                return;
+            }
+            nodo = nuevo.createGain();
+            nuevo.createMediaElementSource(audio).connect(nodo);
+            nodo.connect(nuevo.destination);
+            nodo.gain.value = factor;
+        }).catch(fallo);
+    }
+
+    // true mientras suene HLS nativo; sin efecto si el elemento ya está conectado
+    function omitir(valor) {
+        omitido = valor && !nodo;
+    }
+
+    function enUso() {
+        return nodo !== null;
+    }
+
+    function aplicar(data) {
+        if (modo === 'no') return;
+        const db = modo === 'album' && data.ganancia_album != null ? data.ganancia_album : data.ganancia;
+        factor = db == null ? 1 : Math.pow(10, db / 20);
+        if (nodo) {
+            nodo.gain.setTargetAtTime(factor, contexto.currentTime, 0.05);
+        }
+    }
+
+    // El AudioContext sólo puede arrancar tras una interacción del usuario
+    audio.addEventListener('play', () => {
+        // Un resume() nuevo también resuelve el que quedó pendiente sin interacción
+        if (contexto && contexto.state === 'suspended') contexto.resume();
+        conectar();
+    });
+
+    return { aplicar: aplicar, omitir: omitir, enUso: enUso };
+}
+
+// ============================================
+// FORMA DE ONDA
+// ============================================
+// Los picos vienen precalculados del servidor (/onda/<hash>/<puntos>.bin):
+// pares int8 [mínimo, máximo] por punto, unos pocos KB por canción.
+
+function crearFormaOnda(canvas, audio) {
+    const contexto = canvas.getContext('2d');
+    let picos = null;
+    let peticion = 0;
+
+    function dibujar() {
+        const ancho = canvas.clientWidth;
+        const alto = canvas.clientHeight;
+        if (!picos || !ancho) return;
+        const escala = window.devicePixelRatio || 1;
+        if (canvas.width !== Math.round(ancho * escala)) {
+            canvas.width = Math.round(ancho * escala);
+            canvas.height = Math.round(alto * escala);
+        }
+        contexto.setTransform(escala, 0, 0, escala, 0, 0);
+        contexto.clearRect(0, 0, ancho, alto);
+
+        const puntos = picos.length / 2;
+        const progreso = audio.duration ? audio.currentTime / audio.duration : 0;
+        const colorReproducido = getComputedStyle(canvas).getPropertyValue('--main-purple').trim() || '#b366ff';
+        const barra = 2, hueco = 1;
+        const columnas = Math.floor(ancho / (barra + hueco));
+        for (let x = 0; x < columnas; x++) {
+            // Máximo de los picos que caen en esta columna
+            const desde = Math.floor(x * puntos / columnas);
+            const hasta = Math.max(desde + 1, Math.floor((x + 1) * puntos / columnas));
+            let abajo = 0, arriba = 0;
+            for (let i = desde; i < hasta; i++) {
+                abajo = Math.min(abajo, picos[2 * i]);
+                arriba = Math.max(arriba, picos[2 * i + 1]);
+            }
+            const amplitud = Math.max(1, (arriba - abajo) / 256 * alto);
+            contexto.fillStyle = x / columnas < progreso ? colorReproducido : 'rgba(255, 255, 255, 0.25)';
+            contexto.fillRect(x * (barra + hueco), (alto - amplitud) / 2, barra, amplitud);
+        }
+    }
+
+    function cargar(url) {
+        const miPeticion = ++peticion;
+        picos = null;
+        canvas.hidden = true;
+        if (!url) return;
+        fetch(url).then(r => {
+            if (!r.ok) throw new Error(`HTTP ${r.status}`);
+            return r.arrayBuffer();
+        }).then(datos => {
+            if (miPeticion !== peticion) return;
+            picos = new Int8Array(datos);
+            canvas.hidden = false;
+            dibujar();
+        }).catch(error => console.log('main.js: Waveform not available:', error));
+    }
+
+    // Clic sobre la onda: saltar a esa posición
+    canvas.addEventListener('click', (e) => {
+        if (!audio.duration || isNaN(audio.duration)) return;
+        const rect = canvas.getBoundingClientRect();
+        audio.currentTime = Math.max(0, Math.min(1, (e.clientX - rect.left) / rect.width)) * audio.duration;
+        dibujar();
+    });
+    window.addEventListener('resize', dibujar);
+
+    return { cargar: cargar, dibujar: dibujar };
+}
+
 window.openArtist = function (artistId) {
     console.log('main.js: openArtist called for ID:', artistId);
     window.location.href = `/artista/${artistId}/`;
@@ -102,33 +449,44 @@ function setupPlayerFeatures() {
     const currentTimeElement = document.getElementById("currentTime");
     const durationTimeElement = document.getElementById("durationTime");
 
-    // Datos de la playlist
-    const listaCancionesElement = document.getElementById("listaCanciones");
+    // Datos de la cola
     const currentIdElement = document.getElementById("currentId");
+    const COLA_VENTANA = 20;
 
-    let listaIds = [];
-    let currentId = null;
-    let currentIndex = -1;
+    let currentId = currentIdElement ? parseInt(currentIdElement.value) : null;
     let isShuffle = false;
     let isRepeat = false;
-    let originalList = [];
-
-    // Cargar datos de la playlist
-    if (listaCancionesElement && currentIdElement) {
-        try {
-            listaIds = JSON.parse(listaCancionesElement.value);
-            currentId = parseInt(currentIdElement.value);
-            currentIndex = listaIds.indexOf(currentId);
-            originalList = [...listaIds];
-
-            console.log('main.js: Playlist data loaded', {
-                totalSongs: listaIds.length,
-                currentId: currentId,
-                currentIndex: currentIndex
+    // Ventana de ids alrededor de la canción actual, pedida a /api/cola/.
+    // Al acabarse la cola llegan recomendadas; si se pasa a una de ellas, la
+    // cola sigue en modo radio (solo recomendadas, sin repetir las recientes).
+    let cola = { siguientes: [], anteriores: [], recomendadas: new Set() };
+    let colaPromise = null;
+    let modoRadio = false;
+    const RECIENTES_MAX = 50;
+    const recientes = currentId ? [currentId] : [];
+
+    function cargarCola() {
+        if (!currentId) return Promise.resolve(cola);
+        let url = `/api/cola/?id=${currentId}&limit=${COLA_VENTANA}`;
+        if (modoRadio) url += `&radio=1&excluir=${recientes.join(',')}`;
+        colaPromise = fetch(url)
+            .then(response => response.json())
+            .then(data => {
+                cola.siguientes = isShuffle ? shuffleArray(data.siguientes) : data.siguientes;
+                cola.anteriores = data.anteriores;
+                cola.recomendadas = new Set(data.recomendadas || []);
+                console.log('main.js: Queue window loaded', {
+                    currentId: currentId,
+                    siguientes: cola.siguientes.length,
+                    anteriores: cola.anteriores.length
+                });
+                return cola;
+            })
+            .catch(error => {
+                console.error('main.js: Error loading queue:', error);
+                return cola;
             });
-        } catch (error) {
-            console.error('main.js: Error parsing playlist data:', error);
-        }
+        return colaPromise;
     }
 
     // ================= FUNCIONES UTILITARIAS =================
@@ -148,26 +506,206 @@ function setupPlayerFeatures() {
         return newArray;
     }
 
+    // ================= CAMBIO DE CANCIÓN SIN RECARGAR =================
+    // Metadatos ya pedidos (id -> {data, t}); las URLs de audio firmadas caducan,
+    // así que una entrada antigua se vuelve a pedir.
+    const METADATOS_VIGENCIA_MS = 4 * 60 * 1000;
+    const metadatosCache = new Map();
+    let precargaAudio = null;
+
+    function obtenerMetadatos(songId) {
+        const entrada = metadatosCache.get(songId);
+        if (entrada && Date.now() - entrada.t < METADATOS_VIGENCIA_MS) {
+            return Promise.resolve(entrada.data);
+        }
+        return fetch(`/api/cancion/${songId}/`)
+            .then(response => {
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                return response.json();
+            })
+            .then(data => {
+                metadatosCache.set(songId, { data: data, t: Date.now() });
+                return data;
+            });
+    }
+
+    function precargarSiguiente() {
+        if (cola.siguientes.length === 0) return;
+        const nextId = cola.siguientes[0];
+        obtenerMetadatos(nextId).then(data => {
+            // Un <audio> oculto descarga los primeros bytes de la siguiente canción
+            precargaAudio = new Audio();
+            precargaAudio.preload = 'auto';
+            precargaAudio.src = data.audio_url;
+            console.log('main.js: Prefetched next song ID:', nextId);
+        }).catch(error => console.log('main.js: Prefetch failed:', error));
+    }
+
+    function mostrarCancion(data) {
+        const title = document.getElementById('songTitle');
+        const artists = document.getElementById('songArtists');
+        const cover = document.getElementById('playerCover');
+        const noCover = document.getElementById('playerNoCover');
+        const background = document.getElementById('playerBackground');
+        const searchCurrentId = document.querySelector('#searchForm input[name="current_id"]');
+
+        if (title) title.textContent = data.titulo;
+        if (artists) artists.textContent = data.artista;
+        if (cover) {
+            cover.style.display = data.portada ? '' : 'none';
+            if (data.portada) cover.src = data.portada;
+            cover.alt = data.titulo;
+        }
+        if (noCover) noCover.style.display = data.portada ? 'none' : '';
+        if (background) {
+            background.style.backgroundImage = data.portada ? `url('${data.portada}')` : '';
+        }
+        if (currentIdElement) currentIdElement.value = data.id;
+        if (searchCurrentId) searchCurrentId.value = data.id;
+        if (durationTimeElement) durationTimeElement.textContent = data.duracion_formateada;
+        if (progressBar) progressBar.style.width = '0%';
+        if (currentTimeElement) currentTimeElement.textContent = '0:00';
+        document.title = data.titulo;
+    }
+
+    // Se anota una reproducción la primera vez que suena cada canción
+    let reproduccionRegistrada = false;
+
+    function registrarReproduccion() {
+        if (reproduccionRegistrada || !currentId) return;
+        reproduccionRegistrada = true;
+        fetch(`/api/reproduccion/${currentId}/`, {
+            method: 'POST',
+            headers: { 'X-CSRFToken': getCookie('csrftoken') },
+            keepalive: true
+        }).catch(error => console.log('main.js: Error registering play:', error));
+    }
+
+    audio.addEventListener('play', registrarReproduccion);
+
+    // HLS adaptativo si la canción está empaquetada; si no, audio progresivo
+    const adaptativo = crearReproductorAdaptativo(audio);
+
+    const ondaCanvas = document.getElementById('playerWaveform');
+    const formaOnda = ondaCanvas ? crearFormaOnda(ondaCanvas, audio) : null;
+    if (formaOnda) formaOnda.cargar(ondaCanvas.dataset.onda);
+
+    const normalizador = crearNormalizador(audio, audio.dataset.normalizacion || 'pista');
+    normalizador.aplicar({
+        ganancia: audio.dataset.ganancia ? parseFloat(audio.dataset.ganancia) : null,
+        ganancia_album: audio.dataset.gananciaAlbum ? parseFloat(audio.dataset.gananciaAlbum) : null,
+    });
+
+    // HLS nativo y Web Audio no se combinan: con el elemento ya conectado al
+    // normalizador se usa el audio progresivo; si no, se omite la normalización
+    function cargarHls(urlMaestra, urlRespaldo) {
+        const nativo = !!urlMaestra && adaptativo.nativo;
+        if (nativo && normalizador.enUso()) return false;
+        normalizador.omitir(nativo);
+        return !!urlMaestra && adaptativo.cargar(urlMaestra, urlRespaldo);
+    }
+
+    function cargarAudio(data) {
+        if (formaOnda) formaOnda.cargar(data.onda_url);
+        normalizador.aplicar(data);
+        if (cargarHls(data.hls_url, data.audio_url)) return;
+        adaptativo.detener();
+        audio.src = data.audio_url;
+    }
+
+    // Canciones similares precalculadas en el servidor (/api/similares/)
+    const similares = document.getElementById('playerSimilares');
+
+    function cargarSimilares(songId) {
+        if (!similares) return;
+        fetch(`/api/similares/${songId}/?limit=5`)
+            .then(response => response.json())
+            .then(data => {
+                if (songId !== currentId) return;
+                const lista = similares.querySelector('ul');
+                lista.replaceChildren(...data.canciones.map(cancion => {
+                    const item = document.createElement('li');
+                    item.dataset.songId = cancion.id;
+                    if (cancion.portada) {
+                        const portada = document.createElement('img');
+                        portada.src = cancion.portada;
+                        portada.alt = '';
+                        portada.loading = 'lazy';
+                        item.appendChild(portada);
+                    }
+                    const texto = document.createElement('span');
+                    texto.textContent = cancion.titulo;
+                    const artista = document.createElement('small');
+                    artista.textContent = cancion.artista;
+                    texto.appendChild(artista);
+                    item.appendChild(texto);
+                    return item;
+                }));
+                similares.hidden = data.canciones.length === 0;
+            })
+            .catch(error => console.log('main.js: Error loading similar songs:', error));
+    }
+
+    if (similares) {
+        similares.addEventListener('click', function (e) {
+            const item = e.target.closest('li[data-song-id]');
+            if (item) window.playSong(item.dataset.songId);
+        });
+        if (currentId) cargarSimilares(currentId);
+    }
+
+    function cambiarCancion(songId, pushState = true) {
+        obtenerMetadatos(songId).then(data => {
+            currentId = data.id;
+            reproduccionRegistrada = false;
+            recientes.push(data.id);
+            if (recientes.length > RECIENTES_MAX) recientes.shift();
+            mostrarCancion(data);
+            cargarAudio(data);
+            audio.play().catch(err => console.log('main.js: Auto-play prevented:', err));
+            if (pushState) {
+                history.pushState({ songId: data.id }, '', `/player/?id=${data.id}`);
+            }
+            cargarCola().then(precargarSiguiente);
+            cargarSimilares(data.id);
+        }).catch(error => {
+            // Si falla la API, se recurre a la recarga completa
+            console.error('main.js: Error switching song, reloading:', error);
+            window.location.href = `/player/?id=${songId}`;
+        });
+    }
+
     function playNextSong() {
-        if (listaIds.length === 0) return;
-        let nextIndex = currentIndex + 1;
-        if (nextIndex >= listaIds.length) nextIndex = 0;
-        const nextId = listaIds[nextIndex];
-        console.log('main.js: Playing next song ID:', nextId);
-        // Usar /player/ para mantenerse en el reproductor
-        window.location.href = `/player/?id=${nextId}`;
+        (colaPromise || cargarCola()).then(() => {
+            if (cola.siguientes.length === 0) return;
+            const nextId = cola.siguientes[0];
+            if (cola.recomendadas.has(nextId)) modoRadio = true;
+            console.log('main.js: Playing next song ID:', nextId, modoRadio ? '(radio)' : '');
+            cambiarCancion(nextId);
+        });
     }
 
     function playPrevSong() {
-        if (listaIds.length === 0) return;
-        let prevIndex = currentIndex - 1;
-        if (prevIndex < 0) prevIndex = listaIds.length - 1;
-        const prevId = listaIds[prevIndex];
-        console.log('main.js: Playing prev song ID:', prevId);
-        // Usar /player/ para mantenerse en el reproductor
-        window.location.href = `/player/?id=${prevId}`;
+        (colaPromise || cargarCola()).then(() => {
+            if (cola.anteriores.length === 0) return;
+            const prevId = cola.anteriores[0];
+            console.log('main.js: Playing prev song ID:', prevId);
+            modoRadio = false;
+            cambiarCancion(prevId);
+        });
     }
 
+    // En el reproductor, elegir una sugerencia cambia la canción en el sitio
+    window.playSong = function (songId) {
+        modoRadio = false;
+        cambiarCancion(parseInt(songId));
+    };
+
+    window.addEventListener('popstate', (e) => {
+        if (e.state && e.state.songId) cambiarCancion(e.state.songId, false);
+    });
+    if (currentId) history.replaceState({ songId: currentId }, '', window.location.href);
+
     // ================= INICIALIZAR AUDIO =================
     audio.addEventListener('loadedmetadata', function () {
         console.log("main.js: Metadata loaded. Duration:", audio.duration);
@@ -181,7 +719,10 @@ function setupPlayerFeatures() {
     });
 
     // Intentar reproducción automática si hay una canción cargada
-    if (audio.src || audio.querySelector('source')) {
+    const fuenteInicial = audio.querySelector('source');
+    if (cargarHls(audio.dataset.hls, fuenteInicial && fuenteInicial.src)) {
+        audio.play().catch(error => console.log("main.js: Auto-play prevented:", error));
+    } else if (audio.src || fuenteInicial) {
         // En Chrome, a veces hay que llamar a load() antes de play() tras un cambio de página
         audio.load();
 
@@ -248,6 +789,7 @@ function setupPlayerFeatures() {
             requestAnimationFrame(() => {
                 const percent = (audio.currentTime / audio.duration) * 100;
                 progressBar.style.width = `${Math.min(100, percent)}%`;
+                if (formaOnda) formaOnda.dibujar();
                 if (currentTimeElement) {
                     currentTimeElement.textContent = formatTime(audio.currentTime);
                 }
@@ -255,6 +797,26 @@ function setupPlayerFeatures() {
         }
     });
 
+    // Si la URL firmada caduca (403 al pedir otro rango tras una pausa larga) se
+    // pide una nueva y se sigue desde el mismo punto; una sola vez por URL.
+    let urlRenovada = null;
+
+    function renovarAudio() {
+        if (!currentId || !audio.src || audio.src.startsWith('blob:') || audio.src === urlRenovada) return;
+        const posicion = audio.currentTime;
+        const sonando = !audio.paused;
+        const songId = currentId;
+        metadatosCache.delete(songId);
+        obtenerMetadatos(songId).then(data => {
+            if (songId !== currentId) return;
+            urlRenovada = new URL(data.audio_url, window.location.href).href;
+            audio.src = data.audio_url;
+            audio.addEventListener('loadedmetadata', () => { audio.currentTime = posicion; }, { once: true });
+            if (sonando) audio.play().catch(() => {});
+            console.log('main.js: Renewed audio URL for song ID:', songId);
+        }).catch(error => console.log('main.js: Could not renew audio URL:', error));
+    }
+
     // Manejar errores específicos de la fuente de audio
     audio.addEventListener('error', (e) => {
         console.error("main.js: Audio Error Event:", e);
@@ -264,6 +826,7 @@ function setupPlayerFeatures() {
         if (audio.error && audio.error.code === 4) {
             console.warn("main.js: Source not supported or file not found.");
         }
+        renovarAudio();
     });
 
     // ================= BOTÓN PLAY/PAUSE =================
@@ -299,26 +862,19 @@ function setupPlayerFeatures() {
         if (savedShuffle === 'true') {
             isShuffle = true;
             shuffleBtn.classList.add('active');
-            let tempList = [...originalList].filter(id => id !== currentId);
-            listaIds = [currentId, ...shuffleArray(tempList)];
-            currentIndex = 0;
         }
 
         shuffleBtn.addEventListener('click', () => {
             isShuffle = !isShuffle;
             shuffleBtn.classList.toggle('active', isShuffle);
             localStorage.setItem('playerShuffle', isShuffle);
-
-            if (isShuffle) {
-                let tempList = [...originalList].filter(id => id !== currentId);
-                listaIds = [currentId, ...shuffleArray(tempList)];
-            } else {
-                listaIds = [...originalList];
-            }
-            currentIndex = listaIds.indexOf(currentId);
+            // Se reordena la ventana de siguientes canciones
+            cargarCola().then(precargarSiguiente);
         });
     }
 
+    cargarCola().then(precargarSiguiente);
+
     // ================= BOTÓN REPEAT =================
     if (repeatBtn) {
         const savedRepeat = localStorage.getItem('playerRepeat');
@@ -0,0 +1,153 @@
+"""
+Utilidades para servir archivos de audio con soporte de peticiones parciales
+(cabeceras Range / If-Range) leyendo el archivo por bloques.
+"""
+import mimetypes
+import re
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+
+# Tamaño de bloque con el que se lee el archivo del disco
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$', re.IGNORECASE)
+
+
+def parse_range(header, size):
+    """
+    Interpreta una cabecera Range de un único rango de bytes.
+    Devuelve (inicio, fin) inclusivos, None si la cabecera no aplica
+    (ausente, mal formada o con varios rangos) o False si el rango
+    no se puede satisfacer.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header)
+    if not match:
+        return None
+    inicio, fin = match.groups()
+    if not inicio and not fin:
+        return None
+    if not inicio:
+        # Sufijo: los últimos N bytes
+        longitud = int(fin)
+        if longitud == 0:
+            return False
+        return max(size - longitud, 0), size - 1
+    inicio = int(inicio)
+    fin = int(fin) if fin else size - 1
+    if inicio >= size or fin < inicio:
+        return False
+    return inicio, min(fin, size - 1)
+
+
+def iterar_archivo(archivo, inicio, longitud, chunk_size=CHUNK_SIZE):
+    """Genera bloques de `archivo` desde `inicio` hasta completar `longitud` bytes"""
+    try:
+        archivo.seek(inicio)
+        restante = longitud
+        while restante > 0:
+            bloque = archivo.read(min(chunk_size, restante))
+            if not bloque:
+                break
+            restante -= len(bloque)
+            yield bloque
+    finally:
+        archivo.close()
+
+
+def calcular_etag(size, mtime):
+    return f'"{int(mtime):x}-{size:x}"'
+
+
+def _if_range_coincide(if_range, etag, mtime):
+    """Comprueba si el validador de If-Range sigue siendo válido"""
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    fecha = parse_http_date_safe(if_range)
+    return fecha is not None and int(mtime) <= fecha
+
+
+def _etag_en_lista(etag, if_none_match):
+    etiquetas = [e.strip() for e in if_none_match.split(',')]
+    return '*' in etiquetas or etag in etiquetas or f'W/{etag}' in etiquetas
+
+
+def _abrir_bloques(field_file, inicio, longitud):
+    return iterar_archivo(field_file.storage.open(field_file.name, 'rb'), inicio, longitud)
+
+
+def servir_archivo(request, field_file, content_type=None, inmutable=False, abrir=None):
+    """
+    Devuelve la respuesta HTTP para un FileField respetando Range/If-Range.
+    El archivo nunca se carga completo en memoria: se entrega por bloques.
+    Con `inmutable` la respuesta se marca cacheable durante un año.
+    `abrir(field_file, inicio, longitud)` devuelve el cuerpo; si tiene
+    fileno() se pasa a wsgi.file_wrapper para que el servidor use sendfile.
+    """
+    storage = field_file.storage
+    size = field_file.size
+    try:
+        mtime = storage.get_modified_time(field_file.name).timestamp()
+    except NotImplementedError:
+        mtime = 0
+    # Con almacenamiento por contenido el hash es un ETag fuerte que no depende de la fecha
+    huella = getattr(storage, 'huella', lambda nombre: None)(field_file.name)
+    etag = f'"{huella}"' if huella else calcular_etag(size, mtime)
+
+    if content_type is None:
+        content_type = mimetypes.guess_type(field_file.name)[0] or 'application/octet-stream'
+
+    cabeceras = {
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Last-Modified': http_date(mtime),
+    }
+    if inmutable:
+        cabeceras['Cache-Control'] = 'public, max-age=31536000, immutable'
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and _etag_en_lista(etag, if_none_match):
+        respuesta = HttpResponse(status=304)
+        for clave, valor in cabeceras.items():
+            respuesta[clave] = valor
+        return respuesta
+
+    rango = None
+    if _if_range_coincide(request.headers.get('If-Range'), etag, mtime):
+        rango = parse_range(request.headers.get('Range'), size)
+
+    if rango is False:
+        respuesta = HttpResponse(status=416)
+        respuesta['Content-Range'] = f'bytes */{size}'
+        for clave, valor in cabeceras.items():
+            respuesta[clave] = valor
+        return respuesta
+
+    if rango:
+        inicio, fin = rango
+        status = 206
+    else:
+        inicio, fin = 0, size - 1
+        status = 200
+    longitud = fin - inicio + 1 if size else 0
+
+    if request.method == 'HEAD':
+        respuesta = HttpResponse(status=status, content_type=content_type)
+    else:
+        cuerpo = (abrir or _abrir_bloques)(field_file, inicio, longitud)
+        respuesta = StreamingHttpResponse(cuerpo, status=status, content_type=content_type)
+        if hasattr(cuerpo, 'fileno'):
+            # Django pasa file_to_stream a wsgi.file_wrapper cuando existe
+            respuesta.file_to_stream = cuerpo
+            respuesta.block_size = CHUNK_SIZE
+
+    for clave, valor in cabeceras.items():
+        respuesta[clave] = valor
+    respuesta['Content-Length'] = str(longitud)
+    if status == 206:
+        respuesta['Content-Range'] = f'bytes {inicio}-{fin}/{size}'
+    return respuesta
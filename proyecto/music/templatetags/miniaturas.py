@@ -0,0 +1,32 @@
+from django import template
+from django.utils.html import format_html
+
+from music import miniaturas
+
+register = template.Library()
+
+
+@register.simple_tag
+def miniatura(imagen, tamano=320, formato='webp'):
+    """URL de una miniatura: {% miniatura album.portada 640 %}"""
+    return miniaturas.url_miniatura(imagen, tamano, formato) or ''
+
+
+@register.simple_tag
+def imagen_responsive(imagen, alt='', ancho=160, clase=''):
+    """
+    <picture> con las miniaturas WebP y JPEG de una imagen; el navegador
+    elige el tamaño según `ancho` (px CSS) y la densidad de la pantalla.
+    """
+    if not imagen:
+        return ''
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}px">'
+        '<img src="{}" srcset="{}" sizes="{}px" alt="{}"{} loading="lazy" decoding="async">'
+        '</picture>',
+        miniaturas.srcset(imagen, 'webp'), ancho,
+        miniaturas.url_miniatura(imagen, next((t for t in miniaturas.TAMANOS if t >= ancho), miniaturas.TAMANOS[-1]), 'jpg'),
+        miniaturas.srcset(imagen, 'jpg'), ancho, alt,
+        format_html(' class="{}"', clase) if clase else '',
+    )
@@ -0,0 +1,105 @@
+"""
+Listas de tendencias (última hora, 24h, 7 días, 30 días).
+
+La puntuación de cada canción es la suma de sus reproducciones en la
+ventana con decaimiento exponencial según la antigüedad del tramo
+(vida media = ventana / 4), calculada a partir de las tablas agregadas
+de `music.estadisticas`. La ventana abarca los tramos completos que caben
+en su duración más el tramo en curso, que sólo está empezado: la última
+hora son la hora de reloj anterior y la actual. Los rankings ya ordenados
+se guardan en la caché de Django (compartida entre procesos, ver CACHES)
+junto con la marca de agregación y la hora en que se calcularon: sólo se
+recalculan cuando llegan reproducciones nuevas o cambia la hora.
+`aggregate_plays` los refresca al terminar, así que las peticiones leen
+el ranking precalculado.
+"""
+import heapq
+import math
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import EstadisticaCancion, MarcaAgregacion
+from .estadisticas import MARCA
+
+VENTANAS = {
+    '1h': (timedelta(hours=1), 'hora'),
+    '24h': (timedelta(hours=24), 'hora'),
+    '7d': (timedelta(days=7), 'hora'),
+    '30d': (timedelta(days=30), 'dia'),
+}
+VENTANA_DEFECTO = '24h'
+TAMANO_RANKING = 100
+CLAVE_VERSION = 'music:tendencias:version'
+
+
+def version_agregacion():
+    version = cache.get(CLAVE_VERSION)
+    if version is None:
+        version = MarcaAgregacion.objects.filter(nombre=MARCA) \
+            .values_list('ultimo_id', flat=True).first() or 0
+        # refrescar() la borra al agregar; la caducidad cubre agregaciones hechas por otra vía
+        cache.set(CLAVE_VERSION, version, timeout=60)
+    return version
+
+
+def _hora_actual():
+    return timezone.now().replace(minute=0, second=0, microsecond=0)
+
+
+def calcular_ranking(ventana, artista_id=None, genero_id=None, limit=TAMANO_RANKING):
+    """Devuelve [(cancion_id, puntuacion)] de mayor a menor puntuación"""
+    duracion, periodo = VENTANAS[ventana]
+    tramo = timedelta(hours=1) if periodo == 'hora' else timedelta(days=1)
+    ahora = timezone.now()
+    # Tramos completos de la ventana más el tramo en curso
+    desde = _hora_actual() - duracion
+    if periodo == 'dia':
+        desde = desde.replace(hour=0)
+    vida_media = duracion.total_seconds() / 4
+    decaimiento = math.log(2) / vida_media
+
+    filas = EstadisticaCancion.objects.filter(periodo=periodo, inicio__gte=desde)
+    if artista_id:
+        filas = filas.filter(cancion__artistas=artista_id)
+    if genero_id:
+        filas = filas.filter(cancion__generos__genero=genero_id)
+
+    puntuaciones = {}
+    for cancion_id, inicio, total in filas.values_list('cancion_id', 'inicio', 'total').iterator():
+        # Antigüedad del centro del tramo: el anterior pierde peso a medida que avanza el actual
+        antiguedad = max((ahora - inicio - tramo / 2).total_seconds(), 0)
+        puntuaciones[cancion_id] = puntuaciones.get(cancion_id, 0) + total * math.exp(-decaimiento * antiguedad)
+
+    mejores = heapq.nlargest(limit, puntuaciones.items(), key=lambda item: item[1])
+    return [(cancion_id, round(puntuacion, 3)) for cancion_id, puntuacion in mejores]
+
+
+def _clave(ventana, artista_id, genero_id):
+    return f'music:tendencias:{ventana}:{artista_id or "-"}:{genero_id or "-"}'
+
+
+def obtener_ranking(ventana=VENTANA_DEFECTO, artista_id=None, genero_id=None):
+    """Ranking precalculado; se recalcula si hay datos nuevos o ha cambiado la hora"""
+    if ventana not in VENTANAS:
+        raise ValueError(f'Ventana desconocida: {ventana}')
+    clave = _clave(ventana, artista_id, genero_id)
+    version = version_agregacion()
+    hora = _hora_actual()
+
+    guardado = cache.get(clave)
+    if guardado and guardado[0] == version and guardado[1] == hora:
+        return guardado[2]
+
+    ranking = calcular_ranking(ventana, artista_id, genero_id)
+    # Los rankings filtrados caducan antes para no llenar la caché
+    cache.set(clave, (version, hora, ranking), timeout=None if not (artista_id or genero_id) else 3600)
+    return ranking
+
+
+def refrescar():
+    """Recalcula los rankings globales de todas las ventanas (tras aggregate_plays)"""
+    cache.delete(CLAVE_VERSION)
+    for ventana in VENTANAS:
+        obtener_ranking(ventana)
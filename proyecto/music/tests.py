@@ -1,3 +1,1702 @@
-from django.test import TestCase
+import io
+import os
+import struct
+import tempfile
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import autocompletado, busqueda, contadores, difuso
+from .forms import CancionForm
+from .metadatos import leer_metadatos
+from .models import Album, Artista, Cancion, ConfiguracionUsuario, Genero, CancionGenero, Playlist
+
+
+class PresupuestoConsultasMixin:
+    """
+    Crea un catálogo sintético grande y comprueba que cada vista hace un número
+    máximo fijo de consultas, independiente del tamaño del catálogo.
+    """
+    NUM_ARTISTAS = 40
+    NUM_ALBUMS = 30
+    NUM_CANCIONES = 300
+
+    @classmethod
+    def setUpTestData(cls):
+        artistas = Artista.objects.bulk_create([
+            Artista(nombre=f'Artista {i:03d}', slug=f'artista-{i:03d}')
+            for i in range(cls.NUM_ARTISTAS)
+        ])
+        albums = Album.objects.bulk_create([
+            Album(
+                titulo=f'Album {i:03d}',
+                slug=f'album-{i:03d}',
+                fecha_lanzamiento=date(2020, 1, 1) + timedelta(days=i) if i % 5 else None,
+            )
+            for i in range(cls.NUM_ALBUMS)
+        ])
+        Album.artistas.through.objects.bulk_create([
+            Album.artistas.through(album_id=album.id, artista_id=artistas[(i + j) % len(artistas)].id)
+            for i, album in enumerate(albums) for j in range(2)
+        ])
+        canciones = Cancion.objects.bulk_create([
+            Cancion(
+                titulo=f'Cancion {i:04d}',
+                slug=f'cancion-{i:04d}',
+                album=albums[i % len(albums)],
+                minutos=3,
+                segundos=i % 60,
+                archivo=f'musica/cancion-{i:04d}.mp3',
+            )
+            for i in range(cls.NUM_CANCIONES)
+        ])
+        Cancion.artistas.through.objects.bulk_create([
+            Cancion.artistas.through(cancion_id=cancion.id, artista_id=artistas[(i + j) % len(artistas)].id)
+            for i, cancion in enumerate(canciones) for j in range(3)
+        ])
+        genero = Genero.objects.create(nombre='Pop')
+        CancionGenero.objects.bulk_create([
+            CancionGenero(cancion=cancion, genero=genero) for cancion in canciones[::3]
+        ])
+
+        # bulk_create no dispara señales: se recalculan como en reconcile_counters
+        contadores.recalcular(Artista, Album, Cancion)
+        contadores.recalcular_duraciones(Album, Playlist, Cancion)
+
+        cls.artista = artistas[0]
+        cls.album = albums[1]
+        cls.cancion = canciones[0]
+        cls.usuario = User.objects.create_user('oyente', 'oyente@example.com', 'clave-segura-123')
+        cls.usuario.groups.add(Group.objects.create(name='Usuarios'))
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'clave-segura-123')
+
+    def setUp(self):
+        cache.clear()
+        autocompletado.sugerencias_cache.clear()
+        difuso.invalidar()
+        autocompletado.invalidar()
+
+    def assertMaxQueries(self, maximo, url, usuario=None, status=200):
+        if usuario:
+            self.client.force_login(usuario)
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(url)
+            if getattr(response, 'streaming', False):
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, status)
+        self.assertLessEqual(
+            len(consultas), maximo,
+            f'{url} hizo {len(consultas)} consultas (máximo {maximo}):\n'
+            + '\n'.join(q['sql'] for q in consultas.captured_queries),
+        )
+        return response
+
+
+class MediaTemporalMixin:
+    """MEDIA_ROOT en un directorio temporal por test; `ajustes` sobrescribe otros settings"""
+    ajustes = {}
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = media.name
+        self.enterContext(override_settings(MEDIA_ROOT=media.name, **self.ajustes))
+
+
+class PresupuestoVistasTests(PresupuestoConsultasMixin, TestCase):
+
+    def test_biblioteca(self):
+        # Incluye calcular el ranking de tendencias con la caché vacía
+        self.assertMaxQueries(15, '/library/', self.usuario)
+
+    def test_reproductor(self):
+        # Incluye elegir la versión de la calidad del usuario para la URL del audio
+        self.assertMaxQueries(7, f'/player/?id={self.cancion.id}', self.usuario)
+
+    def test_artista_detalle(self):
+        self.assertMaxQueries(6, f'/artista/{self.artista.id}/')
+
+    def test_album_detalle(self):
+        self.assertMaxQueries(5, f'/album/{self.album.id}/')
+
+    def test_dashboard(self):
+        self.assertMaxQueries(10, '/admin-dashboard/', self.admin)
+
+
+class PresupuestoApiTests(PresupuestoConsultasMixin, TestCase):
+
+    def test_sugerencias(self):
+        # Incluye la construcción del índice de trigramas en memoria
+        self.assertMaxQueries(6, '/api/sugerencias/?q=cancion')
+
+    def test_sugerencias_cacheadas(self):
+        self.client.get('/api/sugerencias/?q=cancion 01')
+        self.assertMaxQueries(0, '/api/sugerencias/?q=Cancion  01')
+
+    def test_cola(self):
+        self.assertMaxQueries(3, f'/api/cola/?id={self.cancion.id}&limit=50')
+
+    def test_datos_cancion(self):
+        # Incluye elegir la versión de la calidad pedida para la URL del audio
+        self.assertMaxQueries(3, f'/api/cancion/{self.cancion.id}/')
+
+    def test_artistas(self):
+        response = self.assertMaxQueries(2, '/api/artistas/?limit=12')
+        self.assertMaxQueries(2, f'/api/artistas/?limit=12&cursor={response.json()["next_cursor"]}')
+
+    def test_albums(self):
+        response = self.assertMaxQueries(2, '/api/albums/?limit=8')
+        self.assertMaxQueries(2, f'/api/albums/?limit=8&cursor={response.json()["next_cursor"]}')
+
+    def test_tendencias(self):
+        self.assertMaxQueries(3, '/api/tendencias/?ventana=7d')
+
+
+class PresupuestoCrudTests(PresupuestoConsultasMixin, TestCase):
+
+    def test_lista_canciones(self):
+        self.assertMaxQueries(6, '/canciones/', self.admin)
+
+    def test_lista_albums(self):
+        self.assertMaxQueries(6, '/albums/', self.admin)
+
+    def test_lista_artistas(self):
+        self.assertMaxQueries(6, '/artistas/', self.admin)
+
+    def test_admin_canciones(self):
+        self.assertMaxQueries(8, '/admin/music/cancion/', self.admin)
+
+
+class StreamingTests(MediaTemporalMixin, TestCase):
+    ajustes = {'AUDIO_URLS_FIRMADAS': False}
+    DATOS = bytes(range(256)) * 4
+
+    def setUp(self):
+        super().setUp()
+        self.cancion = Cancion(titulo='rango', slug='rango', bitrate=128)
+        self.cancion.archivo.save('rango.mp3', io.BytesIO(self.DATOS))
+        self.url = f'/stream/{self.cancion.id}/'
+        self.client.force_login(User.objects.create_user('oyente', 'oyente@example.com', 'clave-segura-123'))
+
+    def pedir(self, **cabeceras):
+        response = self.client.get(self.url, headers=cabeceras)
+        contenido = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, contenido
+
+    def test_completo(self):
+        response, contenido = self.pedir()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(contenido, self.DATOS)
+        self.assertEqual(response['Content-Length'], '1024')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_rangos(self):
+        response, contenido = self.pedir(Range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(contenido, self.DATOS[10:20])
+
+        response, contenido = self.pedir(Range='bytes=-100')
+        self.assertEqual(response['Content-Range'], 'bytes 924-1023/1024')
+        self.assertEqual(contenido, self.DATOS[-100:])
+
+        response, contenido = self.pedir(Range='bytes=1000-')
+        self.assertEqual(response['Content-Range'], 'bytes 1000-1023/1024')
+        self.assertEqual(contenido, self.DATOS[1000:])
+
+        # Fin más allá del archivo: se recorta
+        response, contenido = self.pedir(Range='bytes=1020-5000')
+        self.assertEqual(response['Content-Range'], 'bytes 1020-1023/1024')
+        self.assertEqual(len(contenido), 4)
+
+    def test_rango_no_satisfacible(self):
+        response, _ = self.pedir(Range='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+        response, _ = self.pedir(Range='bytes=-0')
+        self.assertEqual(response.status_code, 416)
+
+    def test_varios_rangos_se_ignoran(self):
+        response, contenido = self.pedir(Range='bytes=0-9,20-29')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(contenido, self.DATOS)
+
+    def test_if_range(self):
+        etag = self.pedir()[0]['ETag']
+        response, contenido = self.pedir(Range='bytes=0-9', **{'If-Range': etag})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(contenido, self.DATOS[:10])
+        # Validador antiguo: se entrega el archivo completo
+        response, contenido = self.pedir(Range='bytes=0-9', **{'If-Range': '"otro"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(contenido, self.DATOS)
+        response, _ = self.pedir(Range='bytes=0-9', **{'If-Range': 'Thu, 01 Jan 1970 00:00:00 GMT'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_none_match_y_head(self):
+        etag = self.pedir()[0]['ETag']
+        response, _ = self.pedir(**{'If-None-Match': f'"x", {etag}'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.head(self.url, headers={'Range': 'bytes=0-99'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(response.content, b'')
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+    def test_parse_range(self):
+        from .streaming import parse_range
+        self.assertIsNone(parse_range(None, 100))
+        self.assertIsNone(parse_range('bytes=-', 100))
+        self.assertIsNone(parse_range('items=0-9', 100))
+        self.assertEqual(parse_range('bytes=0-0', 100), (0, 0))
+        self.assertEqual(parse_range('bytes=-500', 100), (0, 99))
+        self.assertIs(parse_range('bytes=100-', 100), False)
+        self.assertIs(parse_range('bytes=9-3', 100), False)
+
+
+class EntregaFirmadaTests(MediaTemporalMixin, TestCase):
+    ajustes = {'AUDIO_URLS_FIRMADAS': True, 'AUDIO_URL_TTL': 300,
+               'AUDIO_ENTREGA_BACKEND': 'music.entrega.DjangoBackend'}
+
+    def setUp(self):
+        super().setUp()
+        self.cancion = Cancion(titulo='firma', slug='firma', bitrate=128, minutos=4, segundos=10)
+        self.cancion.archivo.save('firma.mp3', io.BytesIO(b'audio firmado'))
+
+    def pedir(self, url):
+        response = self.client.get(url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def test_url_valida(self):
+        from .entrega import firmar_url_audio
+        url = firmar_url_audio(self.cancion.id)
+        self.assertTrue(url.startswith(f'/audio/{self.cancion.id}/?e='))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'audio firmado')
+
+    def test_caducidad_segun_duracion(self):
+        import time
+        from urllib.parse import parse_qs, urlsplit
+        from .entrega import url_audio
+        expira = int(parse_qs(urlsplit(url_audio(self.cancion)).query)['e'][0])
+        self.assertAlmostEqual(expira - time.time(), 300 + 250, delta=5)
+
+    def test_caducada(self):
+        from .entrega import firmar_url_audio
+        self.assertEqual(self.pedir(firmar_url_audio(self.cancion.id, ttl=-1)).status_code, 403)
+
+    def test_manipulada(self):
+        from .entrega import firmar_url_audio
+        url = firmar_url_audio(self.cancion.id)
+        ruta, consulta = url.split('?')
+        expira, firma = (parte.split('=')[1] for parte in consulta.split('&'))
+        otra = Cancion.objects.create(titulo='otra', slug='otra', archivo=self.cancion.archivo.name)
+        # Firma de otra canción, otra caducidad, firma alterada o ausente
+        self.assertEqual(self.pedir(f'/audio/{otra.id}/?{consulta}').status_code, 403)
+        self.assertEqual(self.pedir(f'{ruta}?e={int(expira) + 3600}&s={firma}').status_code, 403)
+        alterada = firma[:-1] + ('1' if firma.endswith('0') else '0')
+        self.assertEqual(self.pedir(f'{ruta}?e={expira}&s={alterada}').status_code, 403)
+        self.assertEqual(self.pedir(f'{ruta}?e={expira}').status_code, 403)
+        self.assertEqual(self.pedir(f'{ruta}?e=nunca&s={firma}').status_code, 403)
+
+    def test_stream_requiere_sesion_o_firma(self):
+        from .entrega import firmar_url_audio
+        url = f'/stream/{self.cancion.id}/'
+        self.assertEqual(self.pedir(url).status_code, 403)
+        consulta = firmar_url_audio(self.cancion.id).split('?')[1]
+        self.assertEqual(self.pedir(f'{url}?{consulta}').status_code, 200)
+        self.client.force_login(User.objects.create_user('oyente', 'oyente@example.com', 'clave-segura-123'))
+        self.assertEqual(self.pedir(url).status_code, 200)
+
+    def test_huella_firmada(self):
+        from .entrega import url_audio
+        url = url_audio(self.cancion)
+        ruta, consulta = url.split('?')
+        huella = consulta.split('&v=')[1]
+        self.assertEqual(self.pedir(url).status_code, 200)
+        # La huella de ?v= no se puede cambiar por la de otra versión ni quitar
+        self.assertEqual(self.pedir(url.replace(huella, '0' * 16)).status_code, 403)
+        self.assertEqual(self.pedir(url.replace(f'&v={huella}', '')).status_code, 403)
+
+    @override_settings(AUDIO_ENTREGA_BACKEND='music.entrega.SendfileBackend')
+    def test_sendfile_rango_head_y_condicional(self):
+        from .entrega import firmar_url_audio
+        url = firmar_url_audio(self.cancion.id)
+        response = self.client.get(url, HTTP_RANGE='bytes=6-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'firmado')
+        self.assertEqual(response['Content-Range'], 'bytes 6-12/13')
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.head(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Length'], '13')
+        self.assertFalse(response.streaming)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class ColaReproduccionTests(TestCase):
+
+    def setUp(self):
+        self.ids = [
+            Cancion.objects.create(titulo=f'c{i}', slug=f'c{i}', archivo=f'musica/c{i}.mp3').id
+            for i in range(5)
+        ]
+        # Ni las inactivas ni las que no tienen audio entran en la cola
+        Cancion.objects.create(titulo='inactiva', slug='inactiva', archivo='musica/x.mp3', activa=False)
+        Cancion.objects.create(titulo='muda', slug='muda')
+
+    def cola(self, **parametros):
+        response = self.client.get('/api/cola/', parametros)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_ventana_alrededor_de_la_actual(self):
+        datos = self.cola(id=self.ids[2], limit=2)
+        self.assertEqual(datos['siguientes'], self.ids[3:5])
+        self.assertEqual(datos['anteriores'], [self.ids[1], self.ids[0]])
+        self.assertEqual(datos['recomendadas'], [])
+
+    def test_da_la_vuelta(self):
+        datos = self.cola(id=self.ids[4], limit=3)
+        self.assertEqual(datos['siguientes'], self.ids[:3])
+        datos = self.cola(id=self.ids[0], limit=3)
+        self.assertEqual(datos['anteriores'], [self.ids[4], self.ids[3], self.ids[2]])
+
+    def test_limite_y_parametros_invalidos(self):
+        self.assertEqual(len(self.cola(id=self.ids[0], limit=1000)['siguientes']), 4)
+        self.assertEqual(len(self.cola(id=self.ids[0], limit=0)['siguientes']), 1)
+        self.assertEqual(self.client.get('/api/cola/', {'id': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/cola/', {'id': 1, 'excluir': '1,a'}).status_code, 400)
+
+
+class DatosCancionTests(TestCase):
+
+    @override_settings(AUDIO_URLS_FIRMADAS=False)
+    def test_metadatos_para_cambiar_de_cancion(self):
+        album = Album.objects.create(titulo='Disco', slug='disco')
+        cancion = Cancion.objects.create(titulo='Tema', slug='tema', album=album, minutos=3, segundos=5,
+                                         archivo='musica/tema.mp3')
+        cancion.artistas.add(Artista.objects.create(nombre='Ana', slug='ana'),
+                             Artista.objects.create(nombre='Luis', slug='luis'))
+        datos = self.client.get(f'/api/cancion/{cancion.id}/').json()
+        self.assertEqual(datos['id'], cancion.id)
+        self.assertEqual(datos['titulo'], 'Tema')
+        self.assertEqual(sorted(datos['artistas']), ['Ana', 'Luis'])
+        self.assertEqual(datos['duracion'], 185)
+        self.assertEqual(datos['duracion_formateada'], '3:05')
+        self.assertEqual(datos['audio_url'], f'/stream/{cancion.id}/')
+        self.assertIsNone(datos['hls_url'])
+
+        sin_artista = Cancion.objects.create(titulo='Solo', slug='solo', archivo='musica/solo.mp3')
+        self.assertEqual(self.client.get(f'/api/cancion/{sin_artista.id}/').json()['artista'], 'Sin Artista')
+
+    def test_no_reproducibles(self):
+        inactiva = Cancion.objects.create(titulo='Baja', slug='baja', archivo='musica/baja.mp3', activa=False)
+        muda = Cancion.objects.create(titulo='Muda', slug='muda')
+        for cancion in (inactiva, muda):
+            self.assertEqual(self.client.get(f'/api/cancion/{cancion.id}/').status_code, 404)
+
+
+class BusquedaTextoCompletoTests(TestCase):
+
+    def setUp(self):
+        self.artista = Artista.objects.create(nombre='Rosalía', slug='rosalia')
+        album = Album.objects.create(titulo='Motomami', slug='motomami')
+        self.saoko = Cancion.objects.create(titulo='Saoko', slug='saoko', album=album, archivo='musica/saoko.mp3')
+        self.saoko.artistas.add(self.artista)
+        self.motomami = Cancion.objects.create(titulo='Motomami', slug='motomami-c', archivo='musica/moto.mp3')
+        self.candy = Cancion.objects.create(titulo='Candy', slug='candy', album=album, archivo='musica/candy.mp3')
+
+    def test_construir_consulta(self):
+        self.assertEqual(busqueda.construir_consulta('hola mundo'), '"hola"* AND "mundo"*')
+        self.assertEqual(busqueda.construir_consulta('hola mundo', todas=False), '"hola"* OR "mundo"*')
+        # Los operadores y comillas del usuario no llegan a FTS5
+        self.assertEqual(busqueda.construir_consulta('"a" OR NEAR(b'), '"a"* AND "OR"* AND "NEAR"* AND "b"*')
+        self.assertEqual(busqueda.construir_consulta('¿?'), '')
+
+    def test_titulo_artista_y_album(self):
+        # Sin tildes, por prefijo y con el título por delante del álbum
+        self.assertEqual(busqueda.buscar_ids('rosalia'), [self.saoko.id])
+        self.assertEqual(busqueda.buscar_ids('sao'), [self.saoko.id])
+        self.assertEqual(busqueda.buscar_ids('motomami')[0], self.motomami.id)
+        self.assertEqual(set(busqueda.buscar_ids('motomami')), {self.saoko.id, self.motomami.id, self.candy.id})
+        self.assertEqual(busqueda.buscar_ids('saoko candy'), [])
+        self.assertEqual(set(busqueda.buscar_ids('saoko candy', todas=False)), {self.saoko.id, self.candy.id})
+        self.assertEqual(busqueda.buscar_ids('NEAR( "'), [])
+
+    def test_indice_sincronizado(self):
+        self.artista.nombre = 'La Rosalía'
+        self.artista.save()
+        self.assertEqual(busqueda.buscar_ids('la rosalia'), [self.saoko.id])
+        Cancion.objects.filter(pk=self.candy.pk).update(activa=False)
+        self.assertNotIn(self.candy.id, busqueda.buscar_ids('motomami'))
+        self.saoko.delete()
+        self.assertEqual(busqueda.buscar_ids('rosalia'), [])
+
+    def test_sin_fts5_usa_icontains(self):
+        with mock.patch.object(busqueda, 'disponible', return_value=False):
+            self.assertEqual(busqueda.buscar_ids('saoko'), [self.saoko.id])
+            self.assertEqual(busqueda.buscar_ids('rosal'), [self.saoko.id])
+            self.assertEqual(set(busqueda.buscar_ids('saoko candy', todas=False)), {self.saoko.id, self.candy.id})
+            self.assertEqual(busqueda.buscar_ids('saoko candy'), [])
+            # Mantenimiento del índice: no hace nada
+            busqueda.indexar_canciones([self.saoko.id])
+            self.assertEqual(busqueda.reconstruir_indice(), 0)
+
+    def test_buscar_musica_redirige_al_reproductor(self):
+        response = self.client.get('/search/', {'q': 'saoko'})
+        self.assertRedirects(response, f'/player/?id={self.saoko.id}', fetch_redirect_response=False)
+
+
+class TrigramasTests(TestCase):
+
+    def setUp(self):
+        difuso.invalidar()
+        self.addCleanup(difuso.invalidar)
+
+    def test_normalizar_y_trigramas(self):
+        self.assertEqual(difuso.normalizar('  ¡Canción  Nº1! '), 'cancion no1')
+        self.assertEqual(difuso.trigramas('Sol'), {'  s', ' so', 'sol', 'ol '})
+        self.assertEqual(difuso.trigramas('?!'), set())
+
+    def test_errores_de_escritura(self):
+        indice = difuso.IndiceTrigramas()
+        indice.agregar(difuso.ARTISTA, 1, 'Shakira')
+        indice.agregar(difuso.ARTISTA, 2, 'Shania Twain')
+        indice.agregar(difuso.CANCION, 3, 'Hips Don\'t Lie')
+        puntuacion, tipo, objeto_id, texto = indice.buscar('Shakria')[0]
+        self.assertEqual((tipo, objeto_id, texto), (difuso.ARTISTA, 1, 'Shakira'))
+        self.assertGreaterEqual(puntuacion, 0.3)
+        self.assertEqual([r[2] for r in indice.buscar('hips dont lie')], [3])
+        self.assertEqual(indice.buscar('hips', tipo=difuso.ARTISTA), [])
+        self.assertEqual(indice.buscar('zzzz'), [])
+
+    def test_actualizar_y_compactar(self):
+        indice = difuso.IndiceTrigramas()
+        indice.agregar(difuso.CANCION, 1, 'Bohemian Rhapsody')
+        indice.agregar(difuso.CANCION, 1, 'Radio Gaga')
+        self.assertEqual(len(indice), 1)
+        self.assertEqual(indice.buscar('bohemian'), [])
+        self.assertEqual(indice.buscar('radio gaga')[0][2], 1)
+        for i in range(2, 1400):
+            indice.agregar(difuso.CANCION, i, f'tema {i}')
+            indice.eliminar(difuso.CANCION, i)
+        # Las entradas borradas se descartan al compactar
+        self.assertLess(len(indice.tipos), 1000)
+        self.assertEqual(indice.buscar('radio gaga')[0][2], 1)
+
+    def test_canciones_sugeridas(self):
+        shakira = Artista.objects.create(nombre='Shakira', slug='shakira')
+        antigua = Cancion.objects.create(titulo='Antigua', slug='antigua')
+        reciente = Cancion.objects.create(titulo='Reciente', slug='reciente')
+        Cancion.objects.filter(pk=antigua.pk).update(fecha_subida=reciente.fecha_subida - timedelta(days=1))
+        shakira.canciones.add(antigua, reciente)
+        self.assertEqual(difuso.canciones_sugeridas('shakria', limit=1), [reciente.id])
+        self.assertEqual(difuso.canciones_sugeridas('shakria'), [reciente.id, antigua.id])
+        # Las señales mantienen el índice ya construido
+        reciente.titulo = 'Waka Waka'
+        reciente.save()
+        self.assertEqual(difuso.canciones_sugeridas('waka wka')[0], reciente.id)
+
+
+class AutocompletadoTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        autocompletado.sugerencias_cache.clear()
+        difuso.invalidar()
+        autocompletado.invalidar()
+        self.cancion = Cancion.objects.create(titulo='Despacito', slug='despacito', archivo='musica/d.mp3')
+
+    def test_lru(self):
+        lru = autocompletado.CacheLRU(2)
+        lru.set('a', 1, ['A'])
+        lru.set('b', 1, ['B'])
+        self.assertEqual(lru.get('a', 1), ['A'])
+        lru.set('c', 1, ['C'])
+        # 'b' era la menos usada
+        self.assertIsNone(lru.get('b', 1))
+        self.assertEqual(lru.get('c', 1), ['C'])
+        # Otra versión del catálogo invalida la entrada
+        self.assertIsNone(lru.get('a', 2))
+        self.assertIsNone(lru.get('a', 1))
+
+    def test_lru_caduca(self):
+        lru = autocompletado.CacheLRU(10, ttl=60)
+        with mock.patch('music.autocompletado.time.monotonic', return_value=1000.0):
+            lru.set('a', 1, ['A'])
+        with mock.patch('music.autocompletado.time.monotonic', return_value=1059.0):
+            self.assertEqual(lru.get('a', 1), ['A'])
+        with mock.patch('music.autocompletado.time.monotonic', return_value=1060.0):
+            self.assertIsNone(lru.get('a', 1))
+
+    def test_etag_y_304(self):
+        response = self.client.get('/api/sugerencias/', {'q': 'Despa'})
+        self.assertEqual([r['id'] for r in response.json()['results']], [self.cancion.id])
+        self.assertIn('max-age=30', response['Cache-Control'])
+        etag = response['ETag']
+        # Mayúsculas y tildes no cambian la clave
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/sugerencias/', {'q': 'despá'}, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_escritura_invalida(self):
+        etag = self.client.get('/api/sugerencias/', {'q': 'despa'})['ETag']
+        with mock.patch('music.autocompletado.time.time', return_value=4102444800):
+            Cancion.objects.create(titulo='Despacio', slug='despacio', archivo='musica/e.mp3')
+        response = self.client.get('/api/sugerencias/', {'q': 'despa'}, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_version_compartida(self):
+        import time
+        from django.core.cache import caches
+        # La versión vive en la caché compartida; el proceso la reutiliza un momento
+        version = autocompletado.version_catalogo()
+        compartida = caches[autocompletado.CACHE]
+        self.assertEqual(compartida.get(autocompletado.CLAVE_VERSION), version)
+        compartida.set(autocompletado.CLAVE_VERSION, version + 1)
+        self.assertEqual(autocompletado.version_catalogo(), version)
+        despues = time.monotonic() + 2
+        with mock.patch('music.autocompletado.time.monotonic', return_value=despues):
+            self.assertEqual(autocompletado.version_catalogo(), version + 1)
+
+
+class BufferReproduccionesTests(TestCase):
+
+    def setUp(self):
+        from .reproducciones import BufferReproducciones
+        self.buffer = BufferReproducciones(intervalo=0, lote=3, max_pendientes=4)
+        self.cancion = Cancion.objects.create(titulo='uno', slug='uno')
+        self.otra = Cancion.objects.create(titulo='dos', slug='dos')
+        self.usuario = User.objects.create_user('oyente', 'oyente@example.com', 'clave-segura-123')
+
+    def test_volcado(self):
+        from .models import Reproduccion
+        self.buffer.registrar(self.cancion.id, self.usuario.id, '127.0.0.1', 'test')
+        self.buffer.registrar(self.cancion.id)
+        self.assertEqual(Reproduccion.objects.count(), 0)
+        with self.assertNumQueries(7):
+            # Comprobaciones, transacción, un UPDATE por canción y un INSERT
+            self.buffer.registrar(self.otra.id)
+        self.assertEqual(self.buffer.pendientes(), 0)
+        self.cancion.refresh_from_db()
+        self.assertEqual(self.cancion.reproducciones, 2)
+        self.assertEqual(Reproduccion.objects.filter(usuario=self.usuario).count(), 1)
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_descarta_canciones_y_usuarios_borrados(self):
+        from .models import Reproduccion
+        self.buffer.registrar(self.cancion.id, self.usuario.id)
+        self.buffer.registrar(self.cancion.id, 999)
+        self.buffer.registrar(998)
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(Reproduccion.objects.count(), 1)
+        self.cancion.refresh_from_db()
+        self.assertEqual(self.cancion.reproducciones, 1)
+
+    def test_fallo_devuelve_los_eventos(self):
+        from django.db import DatabaseError
+        from .models import Reproduccion
+        self.buffer.registrar(self.cancion.id)
+        self.buffer.registrar(self.otra.id)
+        with mock.patch.object(Reproduccion.objects, 'bulk_create', side_effect=DatabaseError('caída')):
+            with self.assertRaises(DatabaseError):
+                self.buffer.flush()
+            # Al llenarse el lote el error se registra sin llegar a la petición
+            with self.assertLogs('music.reproducciones', 'ERROR'):
+                self.buffer.registrar(self.cancion.id)
+        self.assertEqual(self.buffer.pendientes(), 3)
+        self.cancion.refresh_from_db()
+        self.assertEqual(self.cancion.reproducciones, 0)
+
+        self.assertEqual(self.buffer.flush(), 3)
+        self.cancion.refresh_from_db()
+        self.assertEqual(self.cancion.reproducciones, 2)
+        self.assertEqual(Reproduccion.objects.count(), 3)
+
+    def test_hora_del_registro(self):
+        from .models import Reproduccion
+        ayer = timezone.now() - timedelta(days=1)
+        with mock.patch('music.reproducciones.timezone.now', return_value=ayer):
+            self.buffer.registrar(self.cancion.id)
+        # El volcado (o su reintento) no cambia la hora de la reproducción
+        self.buffer.flush()
+        self.assertEqual(Reproduccion.objects.get().fecha_reproduccion, ayer)
+
+    def test_limite_de_pendientes(self):
+        from django.db import DatabaseError
+        self.buffer.eventos = [(self.cancion.id, None, None, None, timezone.now())] * 3
+        with mock.patch('music.reproducciones.transaction.atomic', side_effect=DatabaseError('caída')):
+            with self.assertRaises(DatabaseError):
+                self.buffer.flush()
+        with self.buffer.lock:
+            self.buffer.eventos.extend([(self.otra.id, None, None, None, timezone.now())] * 2)
+        with mock.patch('music.reproducciones.transaction.atomic', side_effect=DatabaseError('caída')), \
+                self.assertLogs('music.reproducciones', 'WARNING'):
+            with self.assertRaises(DatabaseError):
+                self.buffer.flush()
+        # Se pierden los más antiguos
+        self.assertEqual(self.buffer.pendientes(), 4)
+        self.assertEqual(self.buffer.eventos[-1][0], self.otra.id)
+
+
+class AgregacionReproduccionesTests(TestCase):
+
+    def setUp(self):
+        self.artista = Artista.objects.create(nombre='Ana', slug='ana')
+        self.uno = Cancion.objects.create(titulo='uno', slug='uno')
+        self.dos = Cancion.objects.create(titulo='dos', slug='dos')
+        self.uno.artistas.add(self.artista)
+        self.ahora = timezone.now().replace(minute=30, second=0, microsecond=0)
+
+    def reproducir(self, cancion, horas_atras=0, veces=1):
+        from .models import Reproduccion
+        for _ in range(veces):
+            reproduccion = Reproduccion.objects.create(cancion=cancion)
+            Reproduccion.objects.filter(pk=reproduccion.pk) \
+                .update(fecha_reproduccion=self.ahora - timedelta(hours=horas_atras))
+
+    def totales(self, modelo, periodo):
+        return {
+            (fila[0], fila[1]): fila[2]
+            for fila in modelo.objects.filter(periodo=periodo).values_list(
+                'cancion_id' if modelo.__name__ == 'EstadisticaCancion' else 'artista_id', 'inicio', 'total')
+        }
+
+    def test_idempotente_e_incremental(self):
+        from .estadisticas import agregar_reproducciones
+        from .models import EstadisticaArtista, EstadisticaCancion, MarcaAgregacion, Reproduccion
+        self.reproducir(self.uno, veces=3)
+        self.reproducir(self.uno, horas_atras=1)
+        self.reproducir(self.dos, veces=2)
+        self.assertEqual(agregar_reproducciones(), 6)
+        hora = self.ahora.replace(minute=0)
+        antes = self.totales(EstadisticaCancion, 'hora')
+        self.assertEqual(antes[(self.uno.id, hora)], 3)
+        self.assertEqual(antes[(self.uno.id, hora - timedelta(hours=1))], 1)
+        self.assertEqual(antes[(self.dos.id, hora)], 2)
+        self.assertEqual(sum(self.totales(EstadisticaArtista, 'hora').values()), 4)
+
+        # Sin reproducciones nuevas no cambia nada
+        self.assertEqual(agregar_reproducciones(), 0)
+        self.assertEqual(self.totales(EstadisticaCancion, 'hora'), antes)
+
+        self.reproducir(self.dos)
+        self.assertEqual(agregar_reproducciones(), 1)
+        self.assertEqual(self.totales(EstadisticaCancion, 'hora')[(self.dos.id, hora)], 3)
+        self.assertEqual(MarcaAgregacion.objects.get(nombre='reproducciones').ultimo_id,
+                         Reproduccion.objects.latest('id').id)
+
+    def test_por_tramos(self):
+        from .estadisticas import agregar_reproducciones, resumen_reproducciones
+        from .models import EstadisticaCancion
+        self.reproducir(self.uno, veces=5)
+        self.reproducir(self.dos, horas_atras=30, veces=2)
+        self.assertEqual(agregar_reproducciones(lote=2), 7)
+        dias = self.totales(EstadisticaCancion, 'dia')
+        self.assertEqual(sorted(dias.values()), [2, 5])
+        resumen = resumen_reproducciones(dias=7)
+        self.assertEqual(resumen['reproducciones_periodo'], 7)
+        self.assertEqual(resumen['top_canciones'][0]['cancion__id'], self.uno.id)
+
+
+class TendenciasTests(TestCase):
+
+    def setUp(self):
+        from .models import EstadisticaCancion
+        cache.clear()
+        self.hora = timezone.now().replace(minute=0, second=0, microsecond=0)
+        self.canciones = [
+            Cancion.objects.create(titulo=f't{i}', slug=f't{i}', archivo=f'musica/t{i}.mp3') for i in range(4)
+        ]
+        for indice, horas, total in ((0, 0, 1), (1, 1, 100), (2, 3, 9)):
+            EstadisticaCancion.objects.create(cancion=self.canciones[indice], periodo='hora',
+                                              inicio=self.hora - timedelta(hours=horas), total=total)
+        EstadisticaCancion.objects.create(cancion=self.canciones[3], periodo='dia', total=4,
+                                          inicio=self.hora.replace(hour=0) - timedelta(days=20))
+
+    def ids(self, ventana):
+        from . import tendencias
+        return [cancion_id for cancion_id, _ in tendencias.obtener_ranking(ventana)]
+
+    def test_ventanas(self):
+        # La última hora incluye la hora de reloj anterior, no sólo la que está en curso
+        self.assertEqual(set(self.ids('1h')), {self.canciones[0].id, self.canciones[1].id})
+        self.assertEqual(set(self.ids('24h')), {c.id for c in self.canciones[:3]})
+        self.assertEqual(self.ids('30d'), [self.canciones[3].id])
+
+    def test_decaimiento(self):
+        from . import tendencias
+        puntuaciones = dict(tendencias.calcular_ranking('24h'))
+        # Con vida media de 6 h, 9 reproducciones de hace 3 h pesan más que 1 de ahora
+        self.assertGreater(puntuaciones[self.canciones[2].id], puntuaciones[self.canciones[0].id])
+        self.assertLess(puntuaciones[self.canciones[2].id], 9)
+
+    def test_cache_compartida(self):
+        from . import tendencias
+        from .models import EstadisticaCancion, MarcaAgregacion
+        tendencias.refrescar()
+        with self.assertNumQueries(0):
+            tendencias.obtener_ranking('1h')
+        # Datos nuevos sin cambiar la marca: se sigue usando el ranking guardado
+        EstadisticaCancion.objects.create(cancion=self.canciones[3], periodo='hora', inicio=self.hora, total=50)
+        self.assertNotIn(self.canciones[3].id, self.ids('1h'))
+        # Al avanzar la marca y refrescar se recalcula
+        MarcaAgregacion.objects.create(nombre='reproducciones', ultimo_id=1)
+        tendencias.refrescar()
+        self.assertEqual(self.ids('1h')[0], self.canciones[3].id)
+
+    def test_api(self):
+        datos = self.client.get('/api/tendencias/', {'ventana': '1h', 'limit': 1}).json()
+        self.assertEqual(datos['ventana'], '1h')
+        self.assertEqual([c['id'] for c in datos['canciones']], [self.canciones[1].id])
+        self.assertEqual(self.client.get('/api/tendencias/', {'ventana': '2h'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/tendencias/', {'artista': 'x'}).status_code, 400)
+
+
+class PaginacionCursorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # Nombres y fechas repetidos para que el desempate por id importe
+        Artista.objects.bulk_create([Artista(nombre=f'Artista {i % 7:02d}{"" if i < 7 else i}', slug=f'a-{i}')
+                                     for i in range(23)])
+        Album.objects.bulk_create([
+            Album(titulo=f'Album {i % 4}', slug=f'al-{i}',
+                  fecha_lanzamiento=None if i % 5 == 0 else date(2020, 1 + i % 3, 1))
+            for i in range(19)
+        ])
+
+    def recorrer(self, url, clave, limit):
+        vistos, cursor = [], None
+        while True:
+            parametros = {'limit': limit, **({'cursor': cursor} if cursor else {})}
+            datos = self.client.get(url, parametros).json()
+            vistos += [fila['id'] for fila in datos[clave]]
+            cursor = datos['next_cursor']
+            self.assertEqual(datos['has_more'], cursor is not None)
+            if not cursor:
+                return vistos
+
+    def test_artistas_ida_y_vuelta(self):
+        esperado = list(Artista.objects.order_by('nombre', 'id').values_list('id', flat=True))
+        for limit in (1, 5, 50):
+            self.assertEqual(self.recorrer('/api/artistas/', 'artistas', limit), esperado)
+
+    def test_albums_ida_y_vuelta(self):
+        esperado = list(Album.objects.order_by(
+            F('fecha_lanzamiento').desc(nulls_last=True), 'titulo', 'id').values_list('id', flat=True))
+        for limit in (1, 3, 50):
+            self.assertEqual(self.recorrer('/api/albums/', 'albums', limit), esperado)
+
+    def test_inserciones_no_desplazan(self):
+        primera = self.client.get('/api/artistas/', {'limit': 5}).json()
+        Artista.objects.create(nombre='AAA Nuevo', slug='aaa-nuevo')
+        segunda = self.client.get('/api/artistas/', {'limit': 5, 'cursor': primera['next_cursor']}).json()
+        esperado = list(Artista.objects.exclude(slug='aaa-nuevo').order_by('nombre', 'id')
+                        .values_list('id', flat=True)[5:10])
+        self.assertEqual([a['id'] for a in segunda['artistas']], esperado)
+
+    def test_cursor_manipulado(self):
+        from .paginacion import codificar_cursor, decodificar_cursor
+        self.assertEqual(decodificar_cursor(codificar_cursor(['Ñandú', 7]), 2), ['Ñandú', 7])
+        for url, cursor in (
+            ('/api/artistas/', 'no-es-base64!'),
+            ('/api/artistas/', codificar_cursor(['solo uno'])),
+            ('/api/artistas/', codificar_cursor({'nombre': 'x'})),
+            ('/api/artistas/', codificar_cursor(['x', 'no-es-id'])),
+            ('/api/artistas/', codificar_cursor([None, 3])),
+            ('/api/artistas/', 'gA'),
+            ('/api/albums/', codificar_cursor(['2020-13-01', 'x', 1])),
+            ('/api/albums/', codificar_cursor([5, 'x', 1])),
+            ('/api/albums/', codificar_cursor([None, 'x', 'y'])),
+        ):
+            with self.subTest(url=url, cursor=cursor):
+                self.assertEqual(self.client.get(url, {'cursor': cursor}).status_code, 400)
+        self.assertEqual(self.client.get('/api/artistas/', {'limit': 'x'}).status_code, 400)
+
+
+class ContadoresTests(TestCase):
+
+    def setUp(self):
+        self.artista = Artista.objects.create(nombre='Solista', slug='solista')
+        self.otro = Artista.objects.create(nombre='Invitado', slug='invitado')
+        self.album = Album.objects.create(titulo='Debut', slug='debut')
+        self.segundo = Album.objects.create(titulo='Segundo', slug='segundo')
+
+    def crear_cancion(self, slug, album=None, minutos=3, segundos=0):
+        return Cancion.objects.create(titulo=slug, slug=slug, album=album, minutos=minutos,
+                                      segundos=segundos, archivo=f'musica/{slug}.mp3')
+
+    def assertContadores(self, objeto, **esperados):
+        objeto.refresh_from_db()
+        for campo, valor in esperados.items():
+            self.assertEqual(getattr(objeto, campo), valor, campo)
+
+    def test_canciones_de_artista(self):
+        cancion = self.crear_cancion('uno')
+        cancion.artistas.add(self.artista, self.otro)
+        cancion.artistas.add(self.artista)
+        self.assertContadores(self.artista, total_canciones=1)
+        cancion.artistas.remove(self.otro, self.otro)
+        self.assertContadores(self.otro, total_canciones=0)
+        self.otro.canciones.add(cancion)
+        self.assertContadores(self.otro, total_canciones=1)
+        cancion.artistas.clear()
+        self.assertContadores(self.artista, total_canciones=0)
+        self.assertContadores(self.otro, total_canciones=0)
+
+    def test_canciones_de_album(self):
+        cancion = self.crear_cancion('dos', self.album)
+        self.crear_cancion('tres', self.album)
+        self.assertContadores(self.album, total_canciones=2)
+        cancion.album = self.segundo
+        cancion.save()
+        self.assertContadores(self.album, total_canciones=1)
+        self.assertContadores(self.segundo, total_canciones=1)
+        cancion.artistas.add(self.artista)
+        cancion.delete()
+        self.assertContadores(self.segundo, total_canciones=0)
+        self.assertContadores(self.artista, total_canciones=0)
+
+    def test_album_diferido(self):
+        cancion = self.crear_cancion('diferida', self.album)
+        # Guardar sin haber cargado album_id no cambia el álbum ni lo cuenta dos veces
+        diferida = Cancion.objects.only('id', 'titulo').get(pk=cancion.pk)
+        diferida.titulo = 'Renombrada'
+        diferida.save()
+        self.assertContadores(self.album, total_canciones=1, duracion_segundos=180)
+        # Asignado después de cargar: el álbum anterior se lee de la base de datos
+        diferida = Cancion.objects.only('id').get(pk=cancion.pk)
+        diferida.album = self.segundo
+        diferida.save()
+        self.assertContadores(self.album, total_canciones=0, duracion_segundos=0)
+        self.assertContadores(self.segundo, total_canciones=1, duracion_segundos=180)
+
+    def test_albums_de_artista(self):
+        self.album.artistas.add(self.artista)
+        self.segundo.artistas.add(self.artista)
+        self.assertContadores(self.artista, total_albums=2)
+        self.album.delete()
+        self.assertContadores(self.artista, total_albums=1)
+
+    def test_duracion_album(self):
+        cancion = self.crear_cancion('cinco', self.album, minutos=2, segundos=30)
+        self.crear_cancion('seis', self.album, minutos=1, segundos=45)
+        self.assertContadores(self.album, duracion_segundos=255)
+        self.assertEqual(self.album.duracion_total, '4:15')
+        cancion.segundos = 0
+        cancion.save()
+        self.assertContadores(self.album, duracion_segundos=225)
+        cancion.album = self.segundo
+        cancion.save()
+        self.assertContadores(self.album, duracion_segundos=105)
+        self.assertContadores(self.segundo, duracion_segundos=120)
+        # Con campos diferidos se recalcula el total
+        diferida = Cancion.objects.only('id', 'album').get(pk=cancion.pk)
+        Cancion.objects.filter(pk=cancion.pk).update(minutos=5)
+        diferida.save()
+        self.assertContadores(self.segundo, duracion_segundos=300)
+        cancion.refresh_from_db()
+        cancion.delete()
+        self.assertContadores(self.segundo, duracion_segundos=0)
+
+    def test_duracion_playlist(self):
+        playlist = Playlist.objects.create(nombre='Mix', slug='mix')
+        uno = self.crear_cancion('siete', minutos=1)
+        dos = self.crear_cancion('ocho', minutos=2)
+        playlist.canciones.add(uno, dos)
+        self.assertContadores(playlist, duracion_segundos=180)
+        uno.playlists.remove(playlist)
+        uno.playlists.remove(playlist)
+        self.assertContadores(playlist, duracion_segundos=120)
+        dos.minutos = 4
+        dos.save()
+        self.assertContadores(playlist, duracion_segundos=240)
+        dos.delete()
+        self.assertContadores(playlist, duracion_segundos=0)
+
+    def test_recalcular(self):
+        cancion = self.crear_cancion('cuatro', self.album)
+        cancion.artistas.add(self.artista)
+        Artista.objects.update(total_canciones=7, total_albums=7)
+        Album.objects.update(total_canciones=7)
+        contadores.recalcular(Artista, Album, Cancion)
+        self.assertContadores(self.artista, total_canciones=1, total_albums=0)
+        self.assertContadores(self.album, total_canciones=1)
+
+
+def mp3_sintetico(frames=100, xing=False, titulo='Hola', artista='Ana'):
+    """MP3 MPEG-1 capa III a 128 kbps con ID3v2.3; el audio son frames vacíos"""
+    def marco(nombre, datos):
+        return nombre.encode() + struct.pack('>I', len(datos)) + b'\x00\x00' + datos
+
+    cuerpo = marco('TIT2', b'\x03' + titulo.encode()) \
+        + marco('TPE1', b'\x01' + '\ufeff'.encode('utf-16-le') + artista.encode('utf-16-le')) \
+        + marco('TALB', b'\x00Disco') \
+        + marco('APIC', b'\x00image/png\x00\x03\x00PNG')
+    tamano = bytes((len(cuerpo) >> s) & 0x7F for s in (21, 14, 7, 0))
+    cabecera, largo = b'\xff\xfb\x90\x64', 417
+    audio = b''
+    if xing:
+        primero = bytearray(cabecera + bytes(largo - 4))
+        # Xing con número de frames y bytes + tag LAME (retardo 576, relleno 1000)
+        extra = b'Xing' + struct.pack('>III', 3, frames, frames * largo) \
+            + b'LAME3.100' + bytes(12) + bytes((576 >> 4, ((576 & 0xF) << 4) | (1000 >> 8), 1000 & 0xFF))
+        primero[36:36 + len(extra)] = extra
+        audio = bytes(primero)
+    audio += (cabecera + bytes(largo - 4)) * frames
+    return b'ID3\x03\x00\x00' + tamano + cuerpo + audio
+
+
+class MetadatosTests(MediaTemporalMixin, TestCase):
+
+    def test_cbr(self):
+        datos = leer_metadatos(io.BytesIO(mp3_sintetico(frames=100)))
+        self.assertEqual(datos['bitrate'], 128)
+        self.assertFalse(datos['vbr'])
+        self.assertAlmostEqual(datos['duracion'], 100 * 417 * 8 / 128000)
+        self.assertEqual((datos['titulo'], datos['artista'], datos['album']), ('Hola', ['Ana'], 'Disco'))
+        self.assertEqual(datos['portada'], ('image/png', b'PNG'))
+
+    def test_xing_lame(self):
+        datos = leer_metadatos(io.BytesIO(mp3_sintetico(frames=1000, xing=True)))
+        self.assertTrue(datos['vbr'])
+        self.assertAlmostEqual(datos['duracion'], (1000 * 1152 - 576 - 1000) / 44100)
+
+    def test_cabecera_xing_cortada(self):
+        completo = mp3_sintetico(frames=10, xing=True)
+        xing = completo.index(b'Xing')
+        # Sin los flags de la cabecera se estima como CBR
+        self.assertEqual(leer_metadatos(io.BytesIO(completo[:xing + 6]))['bitrate'], 128)
+        for corte in (xing + 10, xing + 14):
+            with self.subTest(corte=corte):
+                self.assertGreaterEqual(leer_metadatos(io.BytesIO(completo[:corte]))['duracion'], 0)
+
+    def test_formulario_mp3_cortado(self):
+        completo = mp3_sintetico(frames=10, xing=True)
+        archivo = SimpleUploadedFile('roto.mp3', completo[:completo.index(b'Xing') + 6], content_type='audio/mpeg')
+        form = CancionForm(data={'activa': 'on', 'titulo': 'Roto'}, files={'archivo': archivo})
+        form.is_valid()
+        self.assertNotIn('archivo', form.errors)
+
+    def test_formulario_completa_campos(self):
+        archivo = SimpleUploadedFile('tema.mp3', mp3_sintetico(frames=3000), content_type='audio/mpeg')
+        form = CancionForm(data={'activa': 'on'}, files={'archivo': archivo})
+        self.assertTrue(form.is_valid(), form.errors)
+        cancion = form.save()
+        self.assertEqual((cancion.titulo, cancion.minutos, cancion.segundos), ('Hola', 1, 18))
+        self.assertEqual(cancion.bitrate, 128)
+        self.assertEqual(cancion.album.titulo, 'Disco')
+        self.assertEqual([a.nombre for a in cancion.artistas.all()], ['Ana'])
+        self.assertTrue(cancion.portada.name.endswith('.png'))
+
+    def test_formulario_acepta_otros_formatos(self):
+        datos = {'activa': 'on', 'titulo': 'Vorbis', 'minutos': 3, 'segundos': 5}
+        archivo = SimpleUploadedFile('tema.ogg', b'OggS\x00\x02' + bytes(200), content_type='audio/ogg')
+        form = CancionForm(data=datos, files={'archivo': archivo})
+        self.assertTrue(form.is_valid(), form.errors)
+        cancion = form.save()
+        self.assertEqual((cancion.titulo, cancion.minutos, cancion.segundos, cancion.bitrate), ('Vorbis', 3, 5, None))
+        # Sin título no hay de dónde sacarlo, pero el archivo no es el error
+        archivo = SimpleUploadedFile('tema.flac', b'fLaC' + bytes(200), content_type='audio/flac')
+        form = CancionForm(data={'activa': 'on'}, files={'archivo': archivo})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(list(form.errors), ['titulo'])
+
+    def test_formulario_album_largo_y_portada_sin_commit(self):
+        metadatos = {'bitrate': 128, 'duracion': 60.0, 'titulo': 'Largo', 'album': 'A' * 150,
+                     'portada': ('image/png', png_sintetico(10, 10))}
+        for _ in range(2):
+            archivo = SimpleUploadedFile('largo.mp3', b'audio', content_type='audio/mpeg')
+            with mock.patch('music.forms.leer_metadatos', return_value=dict(metadatos)):
+                form = CancionForm(data={'activa': 'on'}, files={'archivo': archivo})
+                self.assertTrue(form.is_valid(), form.errors)
+            cancion = form.save(commit=False)
+            # La portada no se escribe hasta guardar la canción
+            self.assertFalse(os.path.isdir(os.path.join(self.media, 'portadas_canciones')))
+        cancion.save()
+        form.save_m2m()
+        self.assertTrue(cancion.portada.storage.exists(cancion.portada.name))
+        # El título recortado encuentra el álbum ya creado
+        self.assertEqual(Album.objects.filter(titulo='A' * 100).count(), 1)
+
+
+class ImportLibraryTests(MediaTemporalMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        origen = tempfile.TemporaryDirectory()
+        self.addCleanup(origen.cleanup)
+        self.origen = origen.name
+        os.makedirs(os.path.join(self.origen, 'ana'))
+        for i in range(3):
+            with open(os.path.join(self.origen, 'ana', f'{i}.mp3'), 'wb') as archivo:
+                archivo.write(mp3_sintetico(frames=500, titulo=f'Tema {i}'))
+        # Copia idéntica: se importa una sola vez
+        with open(os.path.join(self.origen, 'copia.mp3'), 'wb') as archivo:
+            archivo.write(mp3_sintetico(frames=500, titulo='Tema 0'))
+        with open(os.path.join(self.origen, 'roto.mp3'), 'wb') as archivo:
+            archivo.write(b'no es audio')
+
+    def importar(self, *opciones):
+        call_command('import_library', self.origen, '--procesos', '1', *opciones, stdout=io.StringIO())
+
+    def test_importa_y_reanuda(self):
+        self.importar('--dry-run')
+        self.assertFalse(Cancion.objects.exists())
+
+        self.importar('--lote', '2')
+        album = Album.objects.get(titulo='Disco')
+        artista = Artista.objects.get(nombre='Ana')
+        self.assertEqual(Cancion.objects.filter(album=album, artistas=artista).count(), 3)
+        album.refresh_from_db()
+        self.assertEqual((album.total_canciones, album.duracion_segundos), (3, 3 * 13))
+        self.assertEqual((artista.total_canciones, artista.total_albums), (3, 1))
+        self.assertTrue(all(os.path.exists(c.archivo.path) for c in Cancion.objects.all()))
+
+        self.importar()
+        self.assertEqual(Cancion.objects.count(), 3)
+        self.assertEqual(Album.objects.count(), 1)
+
+    def test_rehace_copia_interrumpida(self):
+        from .almacenamiento import calcular_hash, nombre_contenido
+        ruta = os.path.join(self.origen, 'ana', '0.mp3')
+        final = os.path.join(self.media, *nombre_contenido(calcular_hash(ruta), '.mp3').split('/'))
+        # Restos de una copia cortada con el nombre definitivo
+        os.makedirs(os.path.dirname(final))
+        with open(final, 'wb') as archivo:
+            archivo.write(b'cortado')
+        self.importar()
+        with open(final, 'rb') as copia, open(ruta, 'rb') as original:
+            self.assertEqual(copia.read(), original.read())
+        self.assertEqual(os.listdir(os.path.dirname(final)), [os.path.basename(final)])
+
+
+class AlmacenamientoContenidoTests(MediaTemporalMixin, TestCase):
+
+    def subir(self, slug, datos=b'audio', bitrate=None):
+        cancion = Cancion(titulo=slug, slug=slug, bitrate=bitrate)
+        cancion.archivo.save(f'{slug}.mp3', io.BytesIO(datos))
+        return cancion
+
+    def test_subidas_identicas_comparten_archivo(self):
+        uno, dos = self.subir('uno'), self.subir('dos')
+        self.assertEqual(uno.archivo.name, dos.archivo.name)
+        self.assertRegex(uno.archivo.name, r'^musica/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.mp3$')
+
+        ruta = uno.archivo.path
+        with self.captureOnCommitCallbacks(execute=True):
+            uno.delete()
+        self.assertTrue(os.path.exists(ruta))
+        with override_settings(ALMACENAMIENTO_GRACIA=0), self.captureOnCommitCallbacks(execute=True):
+            dos.delete()
+        self.assertFalse(os.path.exists(ruta))
+
+    def test_no_libera_lo_reutilizado_hace_poco(self):
+        from .almacenamiento import almacenamiento, liberar
+        uno = self.subir('uno')
+        ruta = uno.archivo.path
+        os.utime(ruta, (0, 0))
+        # Una subida idéntica reutiliza el archivo antes de que exista su fila
+        self.assertEqual(almacenamiento.save('otra.mp3', io.BytesIO(b'audio')), uno.archivo.name)
+        Cancion.objects.filter(pk=uno.pk).delete()
+        self.assertEqual(liberar([uno.archivo.name]), [])
+        self.assertTrue(os.path.exists(ruta))
+
+        os.utime(ruta, (0, 0))
+        self.assertEqual(liberar([uno.archivo.name]), [uno.archivo.name])
+        self.assertFalse(os.path.exists(ruta))
+
+    def test_subidas_simultaneas_sin_sufijo(self):
+        from .almacenamiento import almacenamiento
+        # Las dos ven que el archivo no existe: la segunda lo reemplaza con los mismos bytes
+        with mock.patch('music.almacenamiento.os.utime', side_effect=FileNotFoundError):
+            uno = almacenamiento.save('uno.mp3', io.BytesIO(b'audio'))
+            dos = almacenamiento.save('dos.mp3', io.BytesIO(b'audio'))
+        self.assertEqual(uno, dos)
+        carpeta = os.path.dirname(almacenamiento.path(uno))
+        self.assertEqual(os.listdir(carpeta), [os.path.basename(uno)])
+        with almacenamiento.open(uno) as archivo:
+            self.assertEqual(archivo.read(), b'audio')
+
+    def test_url_inmutable(self):
+        # A 128 kbps el original ya es la versión definitiva de cualquier calidad
+        cancion = self.subir('tres', bitrate=128)
+        contenido = cancion.archivo.name.rsplit('/', 1)[1][:16]
+        self.client.force_login(User.objects.create_user('oyente', 'oyente@example.com', 'clave-segura-123'))
+        response = self.client.get(f'/stream/{cancion.id}/?v={contenido}')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(response['ETag'], f'"{cancion.archivo.name.rsplit("/", 1)[1][:64]}"')
+        b''.join(response.streaming_content)
+
+
+class VersionesAudioTests(MediaTemporalMixin, TestCase):
+    ajustes = {'AUDIO_URLS_FIRMADAS': False}
+
+    def setUp(self):
+        super().setUp()
+        self.cancion = Cancion(titulo='cuatro', slug='cuatro', bitrate=320)
+        self.cancion.archivo.save('cuatro.mp3', io.BytesIO(b'original'))
+        self.usuario = User.objects.create_user('movil', 'movil@example.com', 'clave-segura-123')
+        ConfiguracionUsuario.objects.create(usuario=self.usuario, calidad_audio='low')
+
+    def contenido(self, url):
+        return b''.join(self.client.get(url).streaming_content)
+
+    def test_encola_solo_calidades_inferiores(self):
+        self.assertEqual(
+            sorted(self.cancion.versiones.values_list('calidad', 'estado')),
+            [('low', 'pendiente'), ('medium', 'pendiente')],
+        )
+
+    def test_entrega_la_calidad_del_usuario(self):
+        url = f'/stream/{self.cancion.id}/'
+        self.client.force_login(self.usuario)
+        # Sin la versión lista se entrega el original
+        self.assertEqual(self.contenido(url), b'original')
+
+        version = self.cancion.versiones.get(calidad='low')
+        version.archivo.save('low.mp3', io.BytesIO(b'baja'), save=False)
+        version.estado = 'lista'
+        version.save()
+        self.assertEqual(self.contenido(url), b'baja')
+        self.assertEqual(self.contenido(f'{url}?calidad=high'), b'original')
+
+    def test_url_fija_el_archivo(self):
+        self.client.force_login(self.usuario)
+        antes = self.client.get(f'/api/cancion/{self.cancion.id}/').json()['audio_url']
+        self.assertIn(f'v={self.cancion.archivo.name.rsplit("/", 1)[1][:16]}', antes)
+
+        version = self.cancion.versiones.get(calidad='low')
+        version.archivo.save('low.mp3', io.BytesIO(b'baja'), save=False)
+        version.estado = 'lista'
+        version.save()
+        # Las peticiones de rango de la URL ya en uso siguen recibiendo el original
+        response = self.client.get(antes, HTTP_RANGE='bytes=2-')
+        self.assertEqual(b''.join(response.streaming_content), b'iginal')
+        self.assertIn('immutable', response['Cache-Control'])
+
+        despues = self.client.get(f'/api/cancion/{self.cancion.id}/').json()['audio_url']
+        self.assertNotEqual(despues, antes)
+        self.assertEqual(self.contenido(despues), b'baja')
+        # Un ?v= que ya no es de la canción vuelve a elegir por calidad, sin cachear
+        response = self.client.get(f'/stream/{self.cancion.id}/?v={"0" * 16}')
+        self.assertEqual(b''.join(response.streaming_content), b'baja')
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+    def test_reclamar(self):
+        from .transcodificacion import reclamar
+        self.assertEqual(len(reclamar(10)), 2)
+        # Ya reclamadas por este proceso: otro no las vuelve a coger
+        self.assertEqual(reclamar(10), [])
+
+        with self.settings(TRANSCODIFICACION_ABANDONO=60):
+            self.cancion.versiones.filter(calidad='low') \
+                .update(fecha_actualizacion=timezone.now() - timedelta(minutes=5))
+            self.assertEqual([version.calidad for version in reclamar(10)], ['low'])
+            self.assertEqual(reclamar(10), [])
+
+    def test_error_sin_ffmpeg(self):
+        with self.settings(FFMPEG_BINARIO='/no/existe/ffmpeg'):
+            from .transcodificacion import procesar_pendientes
+            self.assertEqual(procesar_pendientes(procesos=1), (0, 2))
+        self.assertEqual(self.cancion.versiones.filter(estado='error').count(), 2)
+
+
+class HlsTests(MediaTemporalMixin, TestCase):
+    ajustes = {'AUDIO_URLS_FIRMADAS': False}
+
+    def test_segmentos_alineados_a_frames(self):
+        from .hls import segmentar
+        # 6 s a 44,1 kHz son 230 frames de 1152 muestras
+        segmentos = segmentar(mp3_sintetico(frames=500, xing=True), segundos=6)
+        self.assertEqual(len(segmentos), 3)
+        self.assertAlmostEqual(segmentos[0][1], 230 * 1152 / 44100)
+        self.assertAlmostEqual(sum(duracion for _, duracion in segmentos), 500 * 1152 / 44100)
+        self.assertTrue(all(datos.startswith(b'ID3\x04') for datos, _ in segmentos))
+        self.assertEqual(len(segmentos[2][0]) - len(segmentos[0][0]), (40 - 230) * 417)
+
+    def test_empaqueta_y_sirve_inmutable(self):
+        cancion = Cancion(titulo='cinco', slug='cinco', bitrate=128)
+        cancion.archivo.save('cinco.mp3', io.BytesIO(mp3_sintetico(frames=300)))
+        call_command('package_hls', procesos=1, stdout=io.StringIO())
+
+        cancion.refresh_from_db()
+        self.assertRegex(cancion.hls, r'^hls/[0-9a-f]{2}/[0-9a-f]{64}-original/master\.m3u8$')
+        ruta = cancion.hls.split('/', 1)[1]
+        self.assertEqual(self.client.get(f'/hls/{ruta}').status_code, 403)
+        self.client.force_login(User.objects.create_user('oyente', 'oyente@example.com', 'clave-segura-123'))
+        response = self.client.get(f'/hls/{ruta}')
+        maestra = b''.join(response.streaming_content).decode()
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('original/index.m3u8', maestra)
+        self.assertIn('BANDWIDTH=134400', maestra)
+
+        media = b''.join(self.client.get(f'/hls/{ruta.rsplit("/", 1)[0]}/original/index.m3u8').streaming_content)
+        self.assertIn(b'000.mp3', media)
+        self.assertIn(b'001.mp3', media)
+        self.assertEqual(self.client.get('/hls/../musica/master.m3u8').status_code, 404)
+
+    def test_audio_nuevo_descarta_el_paquete(self):
+        cancion = Cancion(titulo='seis', slug='seis', bitrate=128)
+        cancion.archivo.save('seis.mp3', io.BytesIO(mp3_sintetico(frames=10)))
+        call_command('package_hls', procesos=1, stdout=io.StringIO())
+        cancion.refresh_from_db()
+        self.assertTrue(cancion.hls)
+
+        cancion.archivo.save('otro.mp3', io.BytesIO(mp3_sintetico(frames=20)))
+        cancion.refresh_from_db()
+        self.assertEqual(cancion.hls, '')
+
+    def test_version_nueva_reempaqueta(self):
+        import shutil
+        from .almacenamiento import almacenamiento
+        from .transcodificacion import reclamar, transcodificar
+        cancion = Cancion(titulo='siete', slug='siete', bitrate=320)
+        cancion.archivo.save('siete.mp3', io.BytesIO(mp3_sintetico(frames=10)))
+        call_command('package_hls', procesos=1, incompletas=True, stdout=io.StringIO())
+        cancion.refresh_from_db()
+        anterior = cancion.hls
+
+        with mock.patch('music.transcodificacion._ffmpeg', side_effect=lambda origen, destino, _: shutil.copy(origen, destino)):
+            version, = reclamar(1)
+            self.assertTrue(transcodificar(version))
+        cancion.refresh_from_db()
+        self.assertEqual(cancion.hls, '')
+
+        call_command('package_hls', procesos=1, incompletas=True, stdout=io.StringIO())
+        cancion.refresh_from_db()
+        self.assertNotEqual(cancion.hls, anterior)
+        with almacenamiento.open(cancion.hls, 'r') as maestra:
+            self.assertIn(f'{version.calidad}/index.m3u8', maestra.read())
+
+
+def png_sintetico(ancho=800, alto=600, modo='RGBA'):
+    from PIL import Image
+    salida = io.BytesIO()
+    Image.new(modo, (ancho, alto), (200, 30, 60, 255) if modo == 'RGBA' else (200, 30, 60)).save(salida, 'PNG')
+    return salida.getvalue()
+
+
+class MiniaturasTests(MediaTemporalMixin, TestCase):
+
+    def crear_album(self, al_subir=False):
+        with self.settings(MINIATURAS_AL_SUBIR=al_subir), self.captureOnCommitCallbacks(execute=True):
+            album = Album(titulo='Portada', slug='portada')
+            album.portada.save('portada.png', SimpleUploadedFile('portada.png', png_sintetico()))
+        return album
+
+    def test_genera_al_pedirla(self):
+        from PIL import Image
+        from .miniaturas import url_miniatura
+        album = self.crear_album()
+        for formato, tipo in (('webp', 'image/webp'), ('jpg', 'image/jpeg')):
+            response = self.client.get(url_miniatura(album.portada, 160, formato))
+            self.assertEqual(response['Content-Type'], tipo)
+            imagen = Image.open(io.BytesIO(b''.join(response.streaming_content)))
+            self.assertEqual(imagen.size, (160, 120))
+        # JPEG no tiene canal alfa
+        self.assertEqual(imagen.mode, 'RGB')
+
+        self.assertEqual(self.client.get(f'/miniaturas/100/{album.portada.name}.webp').status_code, 404)
+        self.assertEqual(self.client.get('/miniaturas/160/musica/../settings.py.webp').status_code, 404)
+        self.assertEqual(self.client.get('/miniaturas/160/artistas/no-existe.png.webp').status_code, 404)
+
+    def test_cabeceras_y_bomba_de_descompresion(self):
+        from .miniaturas import url_miniatura
+        album = self.crear_album()
+        response = self.client.get(url_miniatura(album.portada, 160))
+        self.assertIn('immutable', response['Cache-Control'])
+        b''.join(response.streaming_content)
+        # Más del doble de MAX_IMAGE_PIXELS: Pillow se niega a abrirla
+        with mock.patch('PIL.Image.MAX_IMAGE_PIXELS', 1000):
+            self.assertEqual(self.client.get(url_miniatura(album.portada, 320)).status_code, 404)
+
+    def test_al_subir_y_al_cambiar(self):
+        from .miniaturas import nombre_miniatura
+        album = self.crear_album(al_subir=True)
+        anterior = os.path.join(self.media, nombre_miniatura(album.portada.name, 640, 'jpg'))
+        self.assertTrue(os.path.exists(anterior))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            album.portada.save('otra.png', SimpleUploadedFile('otra.png', png_sintetico(100, 100, 'RGB')))
+        self.assertFalse(os.path.exists(anterior))
+        # Una imagen pequeña no se amplía
+        from PIL import Image
+        with Image.open(os.path.join(self.media, nombre_miniatura(album.portada.name, 640, 'webp'))) as imagen:
+            self.assertEqual(imagen.size, (100, 100))
+
+    def test_srcset_en_plantilla(self):
+        from django.template import Context, Template
+        album = self.crear_album()
+        html = Template('{% load miniaturas %}{% imagen_responsive portada "Portada" 180 %}') \
+            .render(Context({'portada': album.portada}))
+        self.assertIn(f'/miniaturas/320/{album.portada.name}.webp 320w', html)
+        self.assertIn(f'src="/miniaturas/320/{album.portada.name}.jpg"', html)
+        self.assertIn('sizes="180px"', html)
+
+
+class PaletaTests(MediaTemporalMixin, TestCase):
+    ajustes = {'MINIATURAS_AL_SUBIR': False}
+
+    @staticmethod
+    def portada():
+        from PIL import Image
+        imagen = Image.new('RGB', (200, 200), (220, 20, 30))
+        imagen.paste((20, 40, 230), (0, 150, 200, 200))
+        salida = io.BytesIO()
+        imagen.save(salida, 'JPEG', quality=95)
+        return salida.getvalue()
+
+    def test_dominante_y_acento(self):
+        from .paleta import extraer
+        dominante, acento = extraer(io.BytesIO(self.portada()))
+        self.assertGreater(int(dominante[1:3], 16), 180)
+        self.assertGreater(int(acento[5:7], 16), 180)
+
+    def test_bomba_de_descompresion(self):
+        album = Album.objects.create(titulo='Enorme', slug='enorme')
+        with mock.patch('PIL.Image.MAX_IMAGE_PIXELS', 1000):
+            album.portada.save('enorme.jpg', SimpleUploadedFile('enorme.jpg', self.portada()))
+        album.refresh_from_db()
+        self.assertEqual((album.color_dominante, album.color_acento), ('', ''))
+
+    def test_al_subir_y_en_lote(self):
+        album = Album.objects.create(titulo='Colores', slug='colores')
+        album.portada.save('colores.jpg', SimpleUploadedFile('colores.jpg', self.portada()))
+        album.refresh_from_db()
+        self.assertRegex(album.color_dominante, r'^#[0-9a-f]{6}$')
+        response = self.client.get(f'/album/{album.id}/')
+        self.assertContains(response, f'linear-gradient(180deg, {album.color_dominante} 0%')
+
+        Album.objects.update(color_dominante='', color_acento='')
+        call_command('extract_palettes', procesos=1, stdout=io.StringIO())
+        self.assertEqual(Album.objects.get().color_dominante, album.color_dominante)
+
+
+class FormaOndaTests(TestCase):
+
+    def test_picos_por_resolucion(self):
+        import numpy as np
+        from .onda import picos
+        tiempo = np.arange(8000 * 10)
+        # 10 s a 8 kHz: silencio la primera mitad y seno a media escala después
+        muestras = np.where(tiempo < 40000, 0, 16384 * np.sin(tiempo / 3)).astype(np.int16)
+        resultado = picos(muestras, (256, 1024, 1000))
+        self.assertEqual({n: len(datos) for n, datos in resultado.items()}, {256: 512, 1000: 2000, 1024: 2048})
+
+        pares = np.frombuffer(resultado[256], dtype=np.int8).reshape(-1, 2)
+        self.assertTrue((pares[:128] == 0).all())
+        self.assertTrue((pares[130:, 0] <= -63).all() and (pares[130:, 1] >= 63).all())
+        # La resolución que no divide a la más fina se reduce igual de bien
+        pares = np.frombuffer(resultado[1000], dtype=np.int8).reshape(-1, 2)
+        self.assertTrue((pares[:499] == 0).all() and (pares[510:, 1] >= 63).all())
+
+    def test_endpoint_inmutable(self):
+        from .models import FormaOnda
+        contenido = 'ab' * 32
+        FormaOnda.objects.create(contenido=contenido, puntos=256, datos=bytes(range(256)) * 2)
+        response = self.client.get(f'/onda/{contenido}/256.bin')
+        self.assertEqual(response.content, bytes(range(256)) * 2)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.client.get(f'/onda/{contenido}/256.bin', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(f'/onda/{contenido}/1024.bin').status_code, 404)
+
+
+class SonoridadTests(TestCase):
+
+    @staticmethod
+    def seno(dbfs, segundos=5, canales=2, frecuencia=997):
+        import numpy as np
+        tiempo = np.arange(48000 * segundos) / 48000
+        onda = 10 ** (dbfs / 20) * np.sin(2 * np.pi * frecuencia * tiempo)
+        return np.stack([onda] * canales, axis=1).astype(np.float32)
+
+    def test_referencia_y_puertas(self):
+        import numpy as np
+        from .sonoridad import pico_real, sonoridad_integrada
+        # Seno de 1 kHz: en estéreo marca su nivel en LUFS, en mono 3 LU menos
+        self.assertAlmostEqual(sonoridad_integrada(self.seno(-20)), -20.0, delta=0.1)
+        self.assertAlmostEqual(sonoridad_integrada(self.seno(-20, canales=1)), -23.0, delta=0.1)
+        # El silencio y los pasajes muy bajos no cuentan (sólo los bloques de transición)
+        con_silencio = np.concatenate([self.seno(-20), np.zeros((48000 * 5, 2), np.float32), self.seno(-45)])
+        self.assertAlmostEqual(sonoridad_integrada(con_silencio), -20.0, delta=0.25)
+        self.assertIsNone(sonoridad_integrada(np.zeros((48000, 2), np.float32)))
+        self.assertAlmostEqual(pico_real(self.seno(-6)), -6.0, delta=0.1)
+
+    def test_ganancias(self):
+        from .sonoridad import ganancia, ganancia_album
+        self.assertEqual(ganancia(-20.0, -10.0), 6.0)
+        # El pico real limita la subida
+        self.assertEqual(ganancia(-20.0, -3.0), 2.0)
+        # Álbum a -12,6 LUFS (media de energía): -1,4 dB, por debajo del límite de pico (-0,5)
+        self.assertEqual(ganancia_album([(-10.0, -0.5, 100), (-20.0, -12.0, 100), (None, None, 100)]), -1.4)
+
+    def test_datos_del_reproductor(self):
+        album = Album.objects.create(titulo='Normalizado', slug='normalizado', ganancia=-2.5)
+        cancion = Cancion.objects.create(titulo='ocho', slug='ocho', archivo='musica/ocho.mp3', album=album)
+        Cancion.objects.filter(pk=cancion.pk).update(ganancia=-4.25)
+        datos = self.client.get(f'/api/cancion/{cancion.id}/').json()
+        self.assertEqual((datos['ganancia'], datos['ganancia_album']), (-4.25, -2.5))
+
+        usuario = User.objects.create_user('oyente', 'oyente@example.com', 'clave-segura-123')
+        ConfiguracionUsuario.objects.create(usuario=usuario, normalizacion='album')
+        self.client.force_login(usuario)
+        response = self.client.get(f'/player/?id={cancion.id}')
+        self.assertContains(response, 'data-normalizacion="album" data-ganancia="-4.25" data-ganancia-album="-2.50"')
+
+    def test_ganancia_de_album_al_cambiar_pistas(self):
+        primero = Album.objects.create(titulo='Primero', slug='primero')
+        segundo = Album.objects.create(titulo='Segundo', slug='segundo')
+        fuerte, suave = (
+            Cancion.objects.create(titulo=titulo, slug=titulo, archivo=f'musica/{titulo}.mp3', album=primero,
+                                   minutos=3, sonoridad=lufs, pico_real=-12.0)
+            for titulo, lufs in (('fuerte', -10.0), ('suave', -20.0))
+        )
+        primero.refresh_from_db()
+        self.assertEqual(primero.ganancia, -1.4)
+
+        suave.album = segundo
+        suave.save()
+        primero.refresh_from_db()
+        segundo.refresh_from_db()
+        self.assertEqual((primero.ganancia, segundo.ganancia), (-4.0, 6.0))
+
+        # Audio nuevo: la medida anterior ya no vale
+        fuerte.archivo = 'musica/otra.mp3'
+        fuerte.save()
+        primero.refresh_from_db()
+        self.assertIsNone(primero.ganancia)
+
+        suave.delete()
+        segundo.refresh_from_db()
+        self.assertIsNone(segundo.ganancia)
+
+    def test_cabeceras_ilegibles_al_decodificar(self):
+        from .sonoridad import decodificar
+        with mock.patch('music.sonoridad.leer_metadatos', side_effect=struct.error('unpack requires a buffer')), \
+                self.settings(FFMPEG_BINARIO='/no/existe/ffmpeg'), self.assertRaises(OSError):
+            decodificar('/no/existe.mp3')
+
+
+class HuellasTests(TestCase):
+
+    @staticmethod
+    def notas(semilla, segundos=20):
+        """Notas de 250 ms con ataque y caída: ocho parciales al azar por nota, a 8 kHz"""
+        import numpy as np
+        azar = np.random.default_rng(semilla)
+        tiempo = np.arange(2000) / 8000
+        notas = [np.exp(-8 * tiempo) * sum(azar.uniform(0.2, 1) * np.sin(2 * np.pi * f * tiempo)
+                                           for f in azar.uniform(100, 3500, 8))
+                 for _ in range(segundos * 4)]
+        return (np.concatenate(notas) * 3000).astype(np.int16)
+
+    def indexar(self, cancion, muestras):
+        from .huellas import calcular
+        from .models import HuellaAcustica
+        valores, tiempos = calcular(muestras)
+        HuellaAcustica.objects.bulk_create(
+            HuellaAcustica(cancion=cancion, valor=v, tiempo=t) for v, t in zip(valores.tolist(), tiempos.tolist()))
+
+    def test_misma_grabacion_en_el_indice(self):
+        import numpy as np
+        from .huellas import calcular, coincidencias, consultados
+        original = self.notas(1)
+        # Otra codificación: medio segundo de silencio delante, la mitad de volumen y ruido
+        copia = np.concatenate([np.zeros(4000, np.int16), original // 2])
+        copia = (copia + np.random.default_rng(0).normal(0, 100, len(copia))).astype(np.int16)
+        misma = Cancion.objects.create(titulo='copia', slug='copia')
+        otra = Cancion.objects.create(titulo='otra', slug='otra')
+        self.indexar(misma, copia)
+        self.indexar(otra, self.notas(2))
+
+        valores, tiempos = calcular(original)
+        puntuaciones = coincidencias(valores, tiempos)
+        self.assertGreater(puntuaciones[misma.id], 0.3 * consultados(valores))
+        self.assertLess(puntuaciones.get(otra.id, 0), 20)
+        self.assertNotIn(misma.id, coincidencias(valores, tiempos, excluir=misma.id))
+
+    def test_informe_y_fusion(self):
+        from .models import EstadisticaCancion, Favorito, HuellaAcustica, Reproduccion
+        from django.utils import timezone
+        buena = Cancion.objects.create(titulo='Tema', slug='tema', bitrate=320, minutos=3)
+        mala = Cancion.objects.create(titulo='Artista - Tema (1)', slug='tema-1', bitrate=128, minutos=3,
+                                      reproducciones=4)
+        distinta = Cancion.objects.create(titulo='Otro tema', slug='otro-tema', bitrate=128)
+        self.indexar(buena, self.notas(3))
+        self.indexar(mala, self.notas(3))
+        self.indexar(distinta, self.notas(4))
+
+        usuario = User.objects.create_user('oyente', 'oyente@example.com', 'clave-segura-123')
+        playlist = Playlist.objects.create(nombre='Mix', slug='mix')
+        playlist.canciones.add(mala)
+        Favorito.objects.create(usuario=usuario, cancion=mala)
+        Reproduccion.objects.create(cancion=mala, usuario=usuario)
+        hora = timezone.now().replace(minute=0, second=0, microsecond=0)
+        EstadisticaCancion.objects.create(cancion=buena, periodo='hora', inicio=hora, total=2)
+        EstadisticaCancion.objects.create(cancion=mala, periodo='hora', inicio=hora, total=3)
+
+        salida = io.StringIO()
+        call_command('find_duplicates', stdout=salida)
+        self.assertIn(f'Conserva #{buena.id}', salida.getvalue())
+        self.assertIn(f'#{mala.id} «Artista - Tema (1)»', salida.getvalue())
+        self.assertNotIn(f'#{distinta.id}', salida.getvalue())
+        self.assertTrue(Cancion.objects.filter(pk=mala.pk).exists())
+
+        call_command('find_duplicates', fusionar=True, stdout=io.StringIO())
+        self.assertFalse(Cancion.objects.filter(pk=mala.pk).exists())
+        self.assertFalse(HuellaAcustica.objects.filter(cancion_id=mala.pk).exists())
+        buena.refresh_from_db()
+        playlist.refresh_from_db()
+        self.assertEqual(buena.reproducciones, 4)
+        self.assertEqual(list(playlist.canciones.all()), [buena])
+        self.assertEqual(playlist.duracion_segundos, 180)
+        self.assertTrue(Favorito.objects.filter(usuario=usuario, cancion=buena).exists())
+        self.assertEqual(Reproduccion.objects.get().cancion, buena)
+        self.assertEqual(EstadisticaCancion.objects.get().total, 5)
+
+
+class LotesSinFfmpegTests(MediaTemporalMixin, TestCase):
+    """Los comandos que decodifican con ffmpeg informan del error de cada archivo y siguen"""
+    ajustes = {'FFMPEG_BINARIO': '/no/existe/ffmpeg'}
+
+    def test_lote_sin_ffmpeg(self):
+        from .models import FormaOnda
+        cancion = Cancion(titulo='siete', slug='siete', bitrate=128)
+        cancion.archivo.save('siete.mp3', io.BytesIO(mp3_sintetico(frames=10)))
+        self.assertEqual(self.client.get(f'/api/cancion/{cancion.id}/').json()['onda_url'],
+                         f'/onda/{cancion.archivo.name.rsplit("/", 1)[1][:64]}/1024.bin')
+
+        for comando in ('build_waveforms', 'analyze_loudness', 'fingerprint_audio'):
+            with self.subTest(comando=comando):
+                errores = io.StringIO()
+                call_command(comando, procesos=1, stdout=io.StringIO(), stderr=errores)
+                self.assertIn('/no/existe/ffmpeg', errores.getvalue())
+        cancion.refresh_from_db()
+        self.assertIsNone(cancion.sonoridad)
+        self.assertFalse(cancion.huellas.exists())
+        self.assertFalse(FormaOnda.objects.exists())
+
+
+class RecomendacionesTests(TestCase):
+
+    def setUp(self):
+        self.canciones = [
+            Cancion.objects.create(titulo=f'r{i}', slug=f'r{i}', archivo=f'musica/r{i}.mp3') for i in range(5)
+        ]
+        self.usuarios = [User.objects.create_user(f'oyente{i}', f'oyente{i}@example.com', 'clave-segura-123')
+                         for i in range(3)]
+
+    def escuchar(self, usuario, *pasos):
+        """Reproducciones de `usuario`: pasos (índice de canción, minutos desde el inicio)"""
+        from django.utils import timezone
+        from .models import Reproduccion
+        inicio = timezone.now() - timedelta(days=1)
+        for indice, minutos in pasos:
+            reproduccion = Reproduccion.objects.create(cancion=self.canciones[indice], usuario=usuario)
+            Reproduccion.objects.filter(pk=reproduccion.pk).update(fecha_reproduccion=inicio + timedelta(minutes=minutos))
+
+    def ids(self, *indices):
+        return [self.canciones[i].id for i in indices]
+
+    def test_reconstruccion_y_similares(self):
+        from .models import Favorito
+        from .recomendaciones import recomendadas
+        a, b, c, d, e = self.canciones
+        # La 3 se escucha dos horas después: es otra sesión y no se relaciona con las demás
+        self.escuchar(self.usuarios[0], (0, 0), (1, 4), (2, 8), (3, 130))
+        self.escuchar(self.usuarios[1], (0, 0), (1, 3))
+        Favorito.objects.create(usuario=self.usuarios[2], cancion=c)
+        Favorito.objects.create(usuario=self.usuarios[2], cancion=e)
+        salida = io.StringIO()
+        call_command('build_recommendations', completo=True, stdout=salida)
+        self.assertIn('Matriz reconstruida: 4 pares', salida.getvalue())
+
+        self.assertEqual(recomendadas(a.id, 10), self.ids(1, 2))
+        self.assertEqual(recomendadas(c.id, 10), self.ids(4, 1, 0))
+        self.assertEqual(recomendadas(d.id, 10), [])
+        datos = self.client.get(f'/api/similares/{c.id}/?limit=2').json()
+        self.assertEqual([cancion['id'] for cancion in datos['canciones']], self.ids(4, 1))
+
+        # Una canción desactivada deja de recomendarse sin reconstruir nada
+        Cancion.objects.filter(pk=e.pk).update(activa=False)
+        datos = self.client.get(f'/api/similares/{c.id}/').json()
+        self.assertEqual([cancion['id'] for cancion in datos['canciones']], self.ids(1, 0))
+        # Ni una sin archivo de audio
+        Cancion.objects.filter(pk=b.pk).update(archivo='')
+        self.assertEqual(recomendadas(c.id, 10, reproducibles=True), self.ids(0))
+
+    def test_incremental_igual_que_reconstruir(self):
+        from .models import Coocurrencia, Recomendacion
+        from .recomendaciones import recomendadas, reconstruir
+
+        def estado():
+            matriz = {(f.cancion_id, f.otra_id): round(f.peso, 6) for f in Coocurrencia.objects.all()}
+            return matriz, [(f, c, round(p, 6)) for f, c, p in Recomendacion.objects.order_by('cancion_id', 'posicion')
+                            .values_list('cancion_id', 'recomendada_id', 'puntuacion')]
+
+        self.escuchar(self.usuarios[0], (0, 0), (1, 4))
+        call_command('build_recommendations', completo=True, stdout=io.StringIO())
+        # La sesión continúa (la 2 se une a las dos anteriores) y otro oyente empieza una nueva
+        self.escuchar(self.usuarios[0], (2, 8), (3, 200))
+        self.escuchar(self.usuarios[1], (3, 0), (4, 2))
+        salida = io.StringIO()
+        call_command('build_recommendations', stdout=salida)
+        self.assertIn('4 reproducciones nuevas', salida.getvalue())
+        incremental = estado()
+
+        reconstruir()
+        self.assertEqual(incremental, estado())
+        self.assertEqual(recomendadas(self.canciones[2].id, 1), self.ids(1))
+
+        salida = io.StringIO()
+        call_command('build_recommendations', stdout=salida)
+        self.assertIn('0 reproducciones nuevas', salida.getvalue())
+
+    def test_incremental_reordena_a_quien_recomienda(self):
+        from .recomendaciones import recomendadas
+        self.escuchar(self.usuarios[0], (0, 0), (1, 4))
+        self.escuchar(self.usuarios[1], (0, 0), (2, 3))
+        call_command('build_recommendations', completo=True, stdout=io.StringIO())
+        self.assertEqual(recomendadas(self.canciones[0].id, 2), self.ids(1, 2))
+        # La 1 suma apariciones sin la 0: la 0 no cambia de filas, pero la 1 baja en su lista
+        self.escuchar(self.usuarios[2], (1, 0))
+        salida = io.StringIO()
+        call_command('build_recommendations', stdout=salida)
+        self.assertIn('2 canciones recalculadas', salida.getvalue())
+        self.assertEqual(recomendadas(self.canciones[0].id, 2), self.ids(2, 1))
+
+    def test_cola_sigue_con_recomendadas(self):
+        ultima = self.canciones[-1]
+        self.escuchar(self.usuarios[0], (4, 0), (2, 3), (0, 6))
+        call_command('build_recommendations', completo=True, stdout=io.StringIO())
+
+        datos = self.client.get(f'/api/cola/?id={ultima.id}&limit=3').json()
+        self.assertEqual(datos['recomendadas'], self.ids(2, 0))
+        # Sin más recomendadas, se completa dando la vuelta
+        self.assertEqual(datos['siguientes'], self.ids(2, 0, 1))
+
+        datos = self.client.get(f'/api/cola/?id={self.canciones[2].id}&limit=2&radio=1&excluir={ultima.id}').json()
+        self.assertEqual(datos['siguientes'], self.ids(0, 1))
+        self.assertEqual(datos['recomendadas'], self.ids(0))
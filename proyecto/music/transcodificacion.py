@@ -0,0 +1,180 @@
+"""
+Versiones de cada canción a 128/192/320 kbps según ConfiguracionUsuario.calidad_audio.
+
+Al guardar una canción con audio nuevo se crean sus VersionAudio en estado
+'pendiente' (sólo las de bitrate inferior al original: nunca se sube la
+calidad). `manage.py transcode_audio` las reclama y las genera con ffmpeg
+en segundo plano. Mientras una versión no está lista se entrega el
+original. La URL del reproductor lleva la huella del archivo elegido
+(ver entrega.url_audio), así que una versión que termina a mitad de la
+reproducción no cambia los bytes de una URL ya en uso.
+"""
+import logging
+import os
+import re
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from . import lotes
+from .almacenamiento import almacenamiento, huella, liberar, nombre_contenido
+from .models import Cancion, ConfiguracionUsuario, VersionAudio
+
+logger = logging.getLogger(__name__)
+
+CALIDADES = {
+    'low': 128,
+    'medium': 192,
+    'high': 320,
+}
+
+
+def calidad_defecto():
+    return getattr(settings, 'AUDIO_CALIDAD_DEFECTO', 'high')
+
+
+def _abandono():
+    # Segundos en 'procesando' tras los que se da por muerto al proceso que la reclamó
+    return getattr(settings, 'TRANSCODIFICACION_ABANDONO', 1800)
+
+
+def calidades_necesarias(cancion):
+    """Calidades que merece la pena generar: las de bitrate menor que el original"""
+    if not cancion.archivo:
+        return []
+    if not cancion.bitrate:
+        return list(CALIDADES)
+    return [calidad for calidad, bitrate in CALIDADES.items() if bitrate < cancion.bitrate]
+
+
+def encolar(cancion):
+    """(Re)crea en estado pendiente las versiones de una canción con audio nuevo"""
+    # Los archivos de las versiones anteriores se liberan desde music.signals
+    VersionAudio.objects.filter(cancion=cancion).delete()
+    VersionAudio.objects.bulk_create([
+        VersionAudio(cancion=cancion, calidad=calidad, bitrate=CALIDADES[calidad])
+        for calidad in calidades_necesarias(cancion)
+    ])
+
+
+def calidad_usuario(usuario):
+    if usuario is None or not usuario.is_authenticated:
+        return calidad_defecto()
+    calidad = ConfiguracionUsuario.objects.filter(usuario=usuario) \
+        .values_list('calidad_audio', flat=True).first()
+    return calidad or calidad_defecto()
+
+
+def seleccionar_archivo(cancion, calidad):
+    """La versión lista de la calidad pedida o, si no la hay, el original"""
+    objetivo = CALIDADES.get(calidad, CALIDADES[calidad_defecto()])
+    if cancion.bitrate and cancion.bitrate <= objetivo:
+        return cancion.archivo
+    version = VersionAudio.objects.filter(cancion=cancion, calidad=calidad, estado='lista') \
+        .exclude(archivo='').exclude(archivo__isnull=True).only('archivo').first()
+    return version.archivo if version else cancion.archivo
+
+
+def archivo_por_huella(cancion, contenido):
+    """
+    El original o la versión lista de la canción cuyo hash empieza por
+    `contenido` (el ?v= de la URL), o None si ya no existe ninguno.
+    """
+    if not re.fullmatch(r'[0-9a-f]{16,64}', contenido or ''):
+        return None
+    if (huella(cancion.archivo.name) or '').startswith(contenido):
+        return cancion.archivo
+    version = VersionAudio.objects.filter(
+        cancion=cancion, estado='lista', archivo__startswith=nombre_contenido(contenido),
+    ).only('archivo').first()
+    return version.archivo if version else None
+
+
+def _ffmpeg(origen, destino, bitrate):
+    binario = getattr(settings, 'FFMPEG_BINARIO', 'ffmpeg')
+    subprocess.run(
+        [binario, '-nostdin', '-y', '-v', 'error', '-i', origen, '-vn', '-map_metadata', '-1',
+         '-codec:a', 'libmp3lame', '-b:a', f'{bitrate}k', '-f', 'mp3', destino],
+        check=True, capture_output=True, timeout=getattr(settings, 'FFMPEG_TIMEOUT', 600),
+    )
+
+
+def transcodificar(version):
+    """Genera el archivo de una VersionAudio y actualiza su estado"""
+    origen = version.cancion.archivo
+    descriptor, temporal = tempfile.mkstemp(suffix='.mp3')
+    os.close(descriptor)
+    try:
+        _ffmpeg(origen.path, temporal, version.bitrate)
+        with open(temporal, 'rb') as archivo:
+            nombre = almacenamiento.save('version.mp3', File(archivo))
+    except (OSError, subprocess.SubprocessError) as error:
+        detalle = lotes.detalle_error(error, 2000)
+        VersionAudio.objects.filter(pk=version.pk) \
+            .update(estado='error', error=detalle, fecha_actualizacion=timezone.now())
+        logger.warning('No se pudo generar %s: %s', version, detalle)
+        return False
+    finally:
+        os.remove(temporal)
+
+    # Si mientras tanto cambió el audio, la versión se borró y este archivo sobra
+    actualizadas = VersionAudio.objects.filter(pk=version.pk, estado='procesando') \
+        .update(estado='lista', archivo=nombre, error='', fecha_actualizacion=timezone.now())
+    if not actualizadas:
+        liberar([nombre])
+        return False
+    # El paquete HLS no la incluye: package_hls escribirá otro con esta variante
+    Cancion.objects.filter(pk=version.cancion_id).exclude(hls='').update(hls='')
+    return True
+
+
+def _transcodificar_en_hilo(version):
+    try:
+        return transcodificar(version)
+    finally:
+        connections.close_all()
+
+
+def reclamar(limite):
+    """
+    Marca como 'procesando' hasta `limite` versiones pendientes (o que otro
+    proceso dejó a medias hace más de TRANSCODIFICACION_ABANDONO segundos)
+    y las devuelve.
+    """
+    ahora = timezone.now()
+    disponibles = Q(estado='pendiente') | \
+        Q(estado='procesando', fecha_actualizacion__lt=ahora - timedelta(seconds=_abandono()))
+    ids = list(VersionAudio.objects.filter(disponibles).order_by('id').values_list('id', flat=True)[:limite])
+    reclamadas = []
+    for version_id in ids:
+        # UPDATE condicional (select_for_update no bloquea en SQLite): si otro proceso
+        # la reclamó entre la lectura y aquí, no cambia ninguna fila
+        if VersionAudio.objects.filter(disponibles, id=version_id) \
+                .update(estado='procesando', fecha_actualizacion=ahora):
+            reclamadas.append(version_id)
+    if not reclamadas:
+        return []
+    return list(VersionAudio.objects.filter(id__in=reclamadas).select_related('cancion'))
+
+
+def procesar_pendientes(limite=50, procesos=2):
+    """
+    Genera en paralelo (hilos que lanzan ffmpeg) un lote de versiones
+    pendientes; procesos=1 las genera en este hilo. Devuelve (listas, errores)
+    """
+    versiones = reclamar(limite)
+    if not versiones:
+        return 0, 0
+    if procesos == 1:
+        resultados = [transcodificar(version) for version in versiones]
+    else:
+        with ThreadPoolExecutor(max_workers=procesos) as executor:
+            resultados = list(executor.map(_transcodificar_en_hilo, versiones))
+    return resultados.count(True), resultados.count(False)
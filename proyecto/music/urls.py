@@ -7,6 +7,11 @@ urlpatterns = [
     
     # Reproductor
     path('player/', views.index, name='player'),
+    path('stream/<int:cancion_id>/', views.stream_cancion, name='stream_cancion'),
+    path('audio/<int:cancion_id>/', views.audio_firmado, name='audio_firmado'),
+    path('hls/<path:ruta>', views.hls_archivo, name='hls_archivo'),
+    path('miniaturas/<int:tamano>/<path:ruta>', views.miniatura, name='miniatura'),
+    path('onda/<str:contenido>/<int:puntos>.bin', views.forma_onda, name='forma_onda'),
     
     # Redirección después de login
     path('redirect/', views.redirect_based_on_role, name='redirect_based_on_role'),
@@ -20,6 +25,11 @@ urlpatterns = [
     
     # APIs
     path('api/sugerencias/', views.sugerencias_busqueda, name='api_sugerencias'),
+    path('api/cola/', views.cola_reproduccion, name='api_cola'),
+    path('api/cancion/<int:cancion_id>/', views.datos_cancion, name='api_cancion'),
+    path('api/reproduccion/<int:cancion_id>/', views.registrar_reproduccion, name='api_reproduccion'),
+    path('api/tendencias/', views.tendencias_api, name='api_tendencias'),
+    path('api/similares/<int:cancion_id>/', views.canciones_similares, name='api_similares'),
     path('api/artistas/', views.cargar_mas_artistas, name='cargar_mas_artistas'),
     path('api/albums/', views.cargar_mas_albums, name='cargar_mas_albums'),
     
@@ -1,11 +1,19 @@
-import json
+from datetime import date
 from django.shortcuts import render, redirect, get_object_or_404
 from django.db import models 
 from django.contrib import messages
-from django.db.models import Q, Count
-from functools import reduce
-from .models import Cancion, Artista, Album
-from django.http import JsonResponse
+from django.db.models import Q
+from django.db.models.fields.files import FieldFile
+from .models import Cancion, Artista, Album, ConfiguracionUsuario, FormaOnda
+from django.http import JsonResponse, Http404, HttpResponse, HttpResponseForbidden, HttpResponseNotAllowed, HttpResponseNotModified
+from django.conf import settings
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from PIL import Image
+from .streaming import servir_archivo
+from .paginacion import codificar_cursor, decodificar_cursor, leer_limite
+from . import autocompletado, busqueda, difuso, estadisticas, hls, miniaturas, onda, paleta, recomendaciones, reproducciones, tendencias, transcodificacion
+from django.views.decorators.http import require_POST
+from .entrega import get_backend, url_audio, url_hls, verificar_firma
 
 
 
@@ -25,6 +33,21 @@ def redirect_based_on_role(request):
         return redirect('admin_dashboard')
     return redirect('library')  # Cambia 'index' por 'library'
 
+def canciones_reproducibles():
+    """Canciones activas que tienen archivo de audio"""
+    return Cancion.objects.filter(activa=True).exclude(
+        models.Q(archivo__exact='') | models.Q(archivo__isnull=True)
+    )
+
+def _preferencias(usuario):
+    """(calidad de audio, normalización 'pista'/'album'/'no') del usuario en una consulta"""
+    calidad, modo = ConfiguracionUsuario.objects.filter(usuario=usuario) \
+        .values_list('calidad_audio', 'normalizacion').first() or (None, None)
+    return (
+        calidad or transcodificacion.calidad_defecto(),
+        modo or ConfiguracionUsuario._meta.get_field('normalizacion').default,
+    )
+
 @login_required
 def index(request):
     """Página principal - Si hay ID muestra reproductor, sino muestra biblioteca"""
@@ -41,24 +64,20 @@ def index(request):
     try:
         print(f"DEBUG: Buscando canción ID: {cancion_id}")  # <-- Agrega esto
         
-        # Obtener todas las canciones activas CON archivo
-        todas_canciones = Cancion.objects.filter(activa=True).exclude(
-            models.Q(archivo__exact='') | models.Q(archivo__isnull=True)
-        )
-        lista_ids = list(todas_canciones.values_list('id', flat=True))
-        
-        print(f"DEBUG: Canciones con archivo disponibles: {lista_ids}")  # <-- Agrega esto
+        # Canciones activas CON archivo (la cola se pide aparte a /api/cola/)
+        todas_canciones = canciones_reproducibles()
         
         # Obtener la canción solicitada
-        cancion = Cancion.objects.get(id=cancion_id, activa=True)
+        cancion = Cancion.objects.select_related('album').get(id=cancion_id, activa=True)
         print(f"DEBUG: Canción encontrada: {cancion.titulo}")  # <-- Agrega esto
         
         # Verificar que tenga archivo
         if not cancion.archivo or not cancion.archivo.name:
             print(f"DEBUG: Canción no tiene archivo")  # <-- Agrega esto
             messages.warning(request, "Esta canción no tiene archivo de audio")
-            if lista_ids:
-                cancion = Cancion.objects.get(id=lista_ids[0])
+            alternativa = todas_canciones.order_by('id').first()
+            if alternativa:
+                cancion = alternativa
                 print(f"DEBUG: Usando canción alternativa: {cancion.id}")  # <-- Agrega esto
             else:
                 # No hay canciones con archivo, redirigir a biblioteca
@@ -72,28 +91,24 @@ def index(request):
         messages.error(request, "Canción no encontrada")
         return redirect('library')
     
-    # Preparar datos para el reproductor
-    artistas = Artista.objects.all()
-    albums = Album.objects.all()
-    
     print(f"DEBUG: Mostrando reproductor con canción: {cancion.titulo}")  # <-- Agrega esto
+    calidad, normalizacion = _preferencias(request.user)
     return render(request, 'music/index.html', {
         'cancion': cancion,
-        'artistas': artistas,
-        'albums': albums,
-        'lista_ids': json.dumps(lista_ids),
+        'audio_url': url_audio(cancion, calidad),
+        'hls_url': url_hls(cancion),
+        'onda_url': onda.url_onda(cancion),
+        'normalizacion': normalizacion,
     })
 @login_required
 def library(request):
     """Vista para mostrar la biblioteca de música"""
     try:
-        # Obtener artistas ordenados por nombre, con conteo de canciones
-        artistas = Artista.objects.annotate(
-            num_canciones=Count('canciones')
-        ).order_by('nombre')[:12]
+        # Obtener artistas ordenados por nombre (el conteo de canciones es un campo)
+        artistas = Artista.objects.order_by('nombre')[:12]
         
-        # Obtener álbumes ordenados por fecha de lanzamiento
-        albums = Album.objects.all().order_by('-fecha_lanzamiento')[:8]
+        # Obtener álbumes ordenados por fecha de lanzamiento (con sus artistas en una consulta)
+        albums = Album.objects.prefetch_related('artistas').order_by('-fecha_lanzamiento')[:8]
         
         # Obtener todas las canciones para conteos
         total_canciones = Cancion.objects.count()
@@ -164,34 +179,28 @@ def library(request):
             artistas_formateados.append({
                 'id': artista.id,
                 'nombre': artista.nombre,
-                'num_canciones': artista.num_canciones,
+                'num_canciones': artista.total_canciones,
             })
         
-        # Formatear la información del álbum
-        albums_formateados = []
-        for album in albums:
-            # Obtener artistas del álbum
-            artistas_album = album.artistas.all()
-            artistas_nombres = ", ".join([artista.nombre for artista in artistas_album])
-            
-            albums_formateados.append({
-                'id': album.id,
-                'titulo': album.titulo,
-                'artistas': artistas_nombres,
-                'portada': album.portada,
-                'fecha_lanzamiento': album.fecha_lanzamiento,
-            })
+        # Tendencias de las últimas 24h (ranking precalculado)
+        ranking = [cancion_id for cancion_id, _ in tendencias.obtener_ranking('24h')[:12]]
+        por_id = Cancion.objects.filter(activa=True).select_related('album') \
+            .prefetch_related('artistas').in_bulk(ranking)
+        canciones_tendencia = [por_id[i] for i in ranking if i in por_id]
         
         # Obtener canciones recientes y todas las canciones
-        canciones_recientes = Cancion.objects.order_by('-id')[:12]
-        todas_las_canciones = Cancion.objects.all().order_by('titulo')
+        canciones_recientes = list(Cancion.objects.select_related('album')
+                                   .prefetch_related('artistas').order_by('-id')[:12])
+        todas_las_canciones = Cancion.objects.select_related('album') \
+            .prefetch_related('artistas').order_by('titulo')
         
         context = {
             'artistas': artistas_formateados,
-            'albums': albums_formateados,
+            'albums': albums,
             'playlists': playlists,
             'podcasts': podcasts,
             'canciones_recientes': canciones_recientes,
+            'canciones_tendencia': canciones_tendencia,
             'todas_las_canciones': todas_las_canciones,
             'total_artistas': Artista.objects.count(),
             'total_albums': Album.objects.count(),
@@ -221,27 +230,23 @@ def buscar_musica(request):
         # Si no hay consulta, redirigir a la biblioteca
         return redirect('library')  # Ya está bien
 
-    # Búsqueda por Título + Artista
-    resultados = Cancion.objects.filter(
-        Q(titulo__icontains=query) | Q(artistas__nombre__icontains=query),
-        activa=True
-    ).distinct()
+    # Búsqueda por Título + Artista + Álbum en el índice de texto completo
+    resultados = busqueda.buscar_ids(query, limit=1)
 
-    if resultados.exists():
+    if resultados:
         # CAMBIA ESTA LÍNEA: Redirigir al reproductor con el ID
-        return redirect(f'/player/?id={resultados.first().id}')
+        return redirect(f'/player/?id={resultados[0]}')
     
-    # Si no hay exacto, buscamos sugerencias por palabras sueltas
-    palabras = query.split()
-    sugerencias = Cancion.objects.filter(
-        reduce(lambda x, y: x | y, [Q(titulo__icontains=p) | Q(artistas__nombre__icontains=p) for p in palabras]),
-        activa=True
-    ).distinct()
-
-    if sugerencias.exists():
-        messages.info(request, f"No encontramos '{query}', pero quizás quisiste decir: {sugerencias.first().titulo}")
+    # Si no hay exacto, buscamos candidatos parecidos (errores de escritura)
+    # y, si tampoco hay, coincidencias por palabras sueltas
+    sugerencias = difuso.canciones_sugeridas(query, limit=1) \
+        or busqueda.buscar_ids(query, limit=1, todas=False)
+
+    if sugerencias:
+        sugerencia = Cancion.objects.only('id', 'titulo').get(id=sugerencias[0])
+        messages.info(request, f"No encontramos '{query}', pero quizás quisiste decir: {sugerencia.titulo}")
         # CAMBIA ESTA LÍNEA: Redirigir al reproductor con el ID
-        return redirect(f'/player/?id={sugerencias.first().id}')
+        return redirect(f'/player/?id={sugerencia.id}')
     else:
         messages.error(request, f"No encontramos resultados para '{query}'.")
         # Si hay canción actual, mantenerla, sino ir a biblioteca
@@ -250,15 +255,14 @@ def buscar_musica(request):
             return redirect(f'/player/?id={current_id}')
         return redirect('library')
 
-def sugerencias_busqueda(request):
-    query = request.GET.get('q', '').strip()
-    if len(query) < 1:
-        return JsonResponse({'results': []})
-
-    # Buscamos canciones por título o por el nombre de sus artistas
-    canciones = Cancion.objects.filter(
-        Q(titulo__icontains=query) | Q(artistas__nombre__icontains=query)
-    ).distinct()[:5]
+def _calcular_sugerencias(query, limit=5):
+    # Buscamos canciones por título, artistas o álbum (ordenadas por relevancia)
+    ids = busqueda.buscar_ids(query, limit=limit)
+    if len(ids) < limit:
+        # Completar con sugerencias tolerantes a errores de escritura
+        ids += [i for i in difuso.canciones_sugeridas(query, limit=limit) if i not in ids][:limit - len(ids)]
+    por_id = Cancion.objects.prefetch_related('artistas').in_bulk(ids)
+    canciones = [por_id[i] for i in ids if i in por_id]
 
     results = []
     for c in canciones:
@@ -267,41 +271,230 @@ def sugerencias_busqueda(request):
             'id': c.id,
             'titulo': c.titulo,
             'artista': artistas,
-            'portada': c.portada.url if c.portada else None
+            'portada': miniaturas.url_miniatura(c.portada, 64),
         })
-    
-    return JsonResponse({'results': results})
+    return results
+
+
+def sugerencias_busqueda(request):
+    query = request.GET.get('q', '').strip()
+    clave = autocompletado.clave(query)
+    if len(clave) < 1:
+        return JsonResponse({'results': []})
+
+    # El ETag depende de la versión del catálogo: si no ha cambiado, 304 sin tocar la BD
+    version = autocompletado.version_catalogo()
+    etag = autocompletado.etag(version, clave)
+    if etag in [e.strip() for e in request.headers.get('If-None-Match', '').split(',')]:
+        response = HttpResponseNotModified()
+    else:
+        results = autocompletado.sugerencias_cache.get(clave, version)
+        if results is None:
+            results = _calcular_sugerencias(query)
+            autocompletado.sugerencias_cache.set(clave, version, results)
+        response = JsonResponse({'results': results})
+
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=getattr(settings, 'SUGERENCIAS_MAX_AGE', 30))
+    return response
+
+
+def cola_reproduccion(request):
+    """
+    API con la ventana de la cola alrededor de la canción actual.
+    Usa el id como cursor (keyset), así que el coste depende del tamaño
+    de la ventana y no del catálogo. Al llegar al final sigue con las
+    recomendadas para la canción actual (y con ?radio=1 solo con ellas,
+    sin repetir las de ?excluir=); si no hay, se da la vuelta.
+    """
+    try:
+        actual = int(request.GET.get('id', 0))
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+        excluir = {int(i) for i in request.GET.get('excluir', '').split(',')[:100] if i}
+    except ValueError:
+        return JsonResponse({'error': 'Parámetros inválidos'}, status=400)
+
+    reproducibles = canciones_reproducibles().order_by()
+    ids = reproducibles.values_list('id', flat=True)
+
+    siguientes = [] if request.GET.get('radio') == '1' else list(ids.filter(id__gt=actual).order_by('id')[:limit])
+    recomendadas = []
+    if len(siguientes) < limit:
+        # Fin de la cola: canciones que suelen escucharse con la actual
+        recomendadas = recomendaciones.recomendadas(
+            actual, limit - len(siguientes), excluir=excluir | set(siguientes) | {actual}, reproducibles=True,
+        )
+        siguientes += recomendadas
+    if len(siguientes) < limit:
+        # Sin recomendaciones suficientes: vuelta al principio de la lista
+        siguientes += list(ids.filter(id__lt=actual).exclude(id__in=recomendadas)
+                           .order_by('id')[:limit - len(siguientes)])
+
+    anteriores = list(ids.filter(id__lt=actual).order_by('-id')[:limit])
+    if len(anteriores) < limit:
+        # Vuelta desde el final de la lista
+        anteriores += list(ids.filter(id__gt=actual).order_by('-id')[:limit - len(anteriores)])
+
+    return JsonResponse({
+        'actual': actual,
+        'siguientes': siguientes,
+        'anteriores': anteriores,
+        'recomendadas': recomendadas,
+    })
+
+
+def serializar_cancion(cancion, calidad=None):
+    """Datos mínimos que necesita el reproductor para cambiar de canción"""
+    artistas = [a.nombre for a in cancion.artistas.all()]
+    return {
+        'id': cancion.id,
+        'titulo': cancion.titulo,
+        'artistas': artistas,
+        'artista': ", ".join(artistas) if artistas else 'Sin Artista',
+        'portada': miniaturas.url_miniatura(cancion.portada, 640),
+        'audio_url': url_audio(cancion, calidad),
+        'hls_url': url_hls(cancion),
+        'onda_url': onda.url_onda(cancion),
+        # dB medidos en el servidor (music/sonoridad.py); None si aún no se han medido
+        'ganancia': cancion.ganancia,
+        'ganancia_album': cancion.album.ganancia if cancion.album_id else None,
+        'duracion': cancion.duracion_en_segundos,
+        'duracion_formateada': cancion.duracion_formateada,
+    }
+
+
+def datos_cancion(request, cancion_id):
+    """API con los metadatos de una canción para cambiarla sin recargar el reproductor"""
+    cancion = get_object_or_404(
+        canciones_reproducibles().select_related('album').prefetch_related('artistas'),
+        id=cancion_id,
+    )
+    return JsonResponse(serializar_cancion(cancion, _calidad_pedida(request)))
+
+
+@require_POST
+def registrar_reproduccion(request, cancion_id):
+    """API que anota una reproducción; se guarda en el siguiente volcado por lotes"""
+    reproducciones.registrar(request, cancion_id)
+    return JsonResponse({'ok': True}, status=202)
+
+
+def tendencias_api(request):
+    """API de tendencias: ?ventana=1h|24h|7d|30d y opcionalmente &artista=<id> o &genero=<id>"""
+    ventana = request.GET.get('ventana', tendencias.VENTANA_DEFECTO)
+    if ventana not in tendencias.VENTANAS:
+        return JsonResponse({'error': f'Ventana inválida. Opciones: {", ".join(tendencias.VENTANAS)}'}, status=400)
+    try:
+        artista_id = int(request.GET['artista']) if request.GET.get('artista') else None
+        genero_id = int(request.GET['genero']) if request.GET.get('genero') else None
+        limit = min(max(int(request.GET.get('limit', 20)), 1), tendencias.TAMANO_RANKING)
+    except ValueError:
+        return JsonResponse({'error': 'Parámetros inválidos'}, status=400)
+
+    ranking = tendencias.obtener_ranking(ventana, artista_id, genero_id)[:limit]
+    por_id = Cancion.objects.prefetch_related('artistas').in_bulk([cancion_id for cancion_id, _ in ranking])
+
+    data = []
+    for cancion_id, puntuacion in ranking:
+        cancion = por_id.get(cancion_id)
+        if cancion is None or not cancion.activa:
+            continue
+        data.append({
+            'id': cancion.id,
+            'titulo': cancion.titulo,
+            'artista': ", ".join(a.nombre for a in cancion.artistas.all()),
+            'portada': miniaturas.url_miniatura(cancion.portada, 160),
+            'puntuacion': puntuacion,
+        })
+
+    return JsonResponse({'ventana': ventana, 'canciones': data})
+
+
+def canciones_similares(request, cancion_id):
+    """API con las canciones similares precalculadas (manage.py build_recommendations)"""
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), recomendaciones.vecinas())
+    except ValueError:
+        return JsonResponse({'error': 'Parámetros inválidos'}, status=400)
+
+    reproducibles = canciones_reproducibles()
+    ids = recomendaciones.recomendadas(cancion_id, limit, reproducibles=True)
+    por_id = reproducibles.select_related('album').prefetch_related('artistas').in_bulk(ids)
+
+    data = []
+    for cancion in (por_id[i] for i in ids if i in por_id):
+        data.append({
+            'id': cancion.id,
+            'titulo': cancion.titulo,
+            'artista': ", ".join(a.nombre for a in cancion.artistas.all()),
+            'portada': miniaturas.url_miniatura(cancion.imagen_portada, 64),
+        })
+
+    return JsonResponse({'cancion': cancion_id, 'canciones': data})
 
 
 def cargar_mas_artistas(request):
-    """API para cargar más artistas"""
-    offset = int(request.GET.get('offset', 0))
-    limit = int(request.GET.get('limit', 12))
-    
-    artistas = Artista.objects.annotate(
-        num_canciones=Count('canciones')
-    ).order_by('nombre')[offset:offset + limit]
-    
+    """API para cargar más artistas (paginación por cursor sobre nombre, id)"""
+    try:
+        limit = leer_limite(request, 12)
+        cursor = request.GET.get('cursor')
+        artistas = Artista.objects.order_by('nombre', 'id')
+        if cursor:
+            nombre, ultimo_id = decodificar_cursor(cursor, 2)
+            artistas = artistas.filter(Q(nombre__gt=nombre) | Q(nombre=nombre, id__gt=ultimo_id))
+    except ValueError:
+        return JsonResponse({'error': 'Parámetros inválidos'}, status=400)
+
+    # Se pide una fila de más para saber si hay otra página sin hacer COUNT(*)
+    artistas = list(artistas[:limit + 1])
+    has_more = len(artistas) > limit
+    artistas = artistas[:limit]
+
     data = []
     for artista in artistas:
         data.append({
             'id': artista.id,
             'nombre': artista.nombre,
-            'num_canciones': artista.num_canciones,
+            'num_canciones': artista.total_canciones,
         })
     
     return JsonResponse({
         'artistas': data,
-        'has_more': Artista.objects.count() > offset + limit
+        'has_more': has_more,
+        'next_cursor': codificar_cursor([artistas[-1].nombre, artistas[-1].id]) if has_more else None,
     })
 
 
+def _filtro_cursor_albums(fecha, titulo, ultimo_id):
+    """Filas posteriores a (fecha, titulo, id) en el orden -fecha (nulos al final), titulo, id"""
+    mismo_titulo = Q(titulo__gt=titulo) | Q(titulo=titulo, id__gt=ultimo_id)
+    if fecha is None:
+        return Q(fecha_lanzamiento__isnull=True) & mismo_titulo
+    return (
+        Q(fecha_lanzamiento__lt=fecha)
+        | Q(fecha_lanzamiento__isnull=True)
+        | (Q(fecha_lanzamiento=fecha) & mismo_titulo)
+    )
+
+
 def cargar_mas_albums(request):
-    """API para cargar más álbumes"""
-    offset = int(request.GET.get('offset', 0))
-    limit = int(request.GET.get('limit', 8))
-    
-    albums = Album.objects.all().order_by('-fecha_lanzamiento')[offset:offset + limit]
+    """API para cargar más álbumes (paginación por cursor sobre -fecha, titulo, id)"""
+    try:
+        limit = leer_limite(request, 8)
+        cursor = request.GET.get('cursor')
+        albums = Album.objects.order_by(
+            models.F('fecha_lanzamiento').desc(nulls_last=True), 'titulo', 'id'
+        ).prefetch_related('artistas')
+        if cursor:
+            fecha, titulo, ultimo_id = decodificar_cursor(cursor, 3)
+            fecha = date.fromisoformat(fecha) if fecha else None
+            albums = albums.filter(_filtro_cursor_albums(fecha, titulo, ultimo_id))
+    except (ValueError, TypeError):
+        return JsonResponse({'error': 'Parámetros inválidos'}, status=400)
+
+    albums = list(albums[:limit + 1])
+    has_more = len(albums) > limit
+    albums = albums[:limit]
     
     data = []
     for album in albums:
@@ -312,13 +505,19 @@ def cargar_mas_albums(request):
             'id': album.id,
             'titulo': album.titulo,
             'artistas': artistas_nombres,
-            'portada_url': album.portada.url if album.portada else None,
+            'portada_url': miniaturas.url_miniatura(album.portada, 320),
             'fecha_lanzamiento': album.fecha_lanzamiento.strftime('%d/%m/%Y') if album.fecha_lanzamiento else None,
         })
     
+    ultimo = albums[-1] if albums else None
     return JsonResponse({
         'albums': data,
-        'has_more': Album.objects.count() > offset + limit
+        'has_more': has_more,
+        'next_cursor': codificar_cursor([
+            ultimo.fecha_lanzamiento.isoformat() if ultimo.fecha_lanzamiento else None,
+            ultimo.titulo,
+            ultimo.id,
+        ]) if has_more else None,
     })
 
 
@@ -327,7 +526,7 @@ def artista_detalle(request, artista_id):
     artista = get_object_or_404(Artista, id=artista_id)
     
     # Obtener canciones del artista
-    canciones = Cancion.objects.filter(artistas=artista)
+    canciones = Cancion.objects.filter(artistas=artista).select_related('album')
     
     # Obtener álbumes del artista
     albums = Album.objects.filter(artistas=artista)
@@ -336,8 +535,9 @@ def artista_detalle(request, artista_id):
         'artista': artista,
         'canciones': canciones,
         'albums': albums,
-        'total_canciones': canciones.count(),
-        'total_albums': albums.count(),
+        'total_canciones': artista.total_canciones,
+        'total_albums': artista.total_albums,
+        'fondo_cabecera': paleta.degradado(artista, 180),
     }
     
     return render(request, 'music/artista_detalle.html', context)
@@ -348,33 +548,139 @@ def album_detalle(request, album_id):
     album = get_object_or_404(Album, id=album_id)
     
     # Obtener canciones del álbum
-    canciones = Cancion.objects.filter(album=album)
+    canciones = Cancion.objects.filter(album=album).prefetch_related('artistas')
     
     # Obtener artistas del álbum
     artistas = album.artistas.all()
     
-    # Calcular duración total del álbum
-    duracion_total_minutos = sum(c.minutos for c in canciones)
-    duracion_total_segundos = sum(c.segundos for c in canciones)
-    duracion_total_minutos += duracion_total_segundos // 60
-    duracion_total_segundos = duracion_total_segundos % 60
-    
-    # Calcular valor de fondo (solo el valor para evitar errores de sintaxis en el template)
-    background_value = "linear-gradient(135deg, #667eea 0%, #764ba2 100%)"
+    # Calcular valor de fondo (solo el valor para evitar errores de sintaxis en el template).
+    # Los colores de la portada ya están guardados: el degradado se pinta antes que la imagen
+    degradado = paleta.degradado(album) or "linear-gradient(135deg, #667eea 0%, #764ba2 100%)"
+    background_value = degradado
     if album.portada:
-        background_value = f"url('{album.portada.url}')"
+        background_value = f"url('{miniaturas.url_miniatura(album.portada, 640)}'), {degradado}"
 
     context = {
         'album': album,
         'canciones': canciones,
         'artistas': artistas,
-        'total_canciones': canciones.count(),
-        'duracion_total': f"{duracion_total_minutos}:{str(duracion_total_segundos).zfill(2)}",
+        # Totales guardados en el álbum (ver music/contadores.py)
+        'total_canciones': album.total_canciones,
+        'duracion_total': album.duracion_total,
         'background_value': background_value,
+        'fondo_cabecera': paleta.degradado(album, 180),
     }
     
     return render(request, 'music/album_detalle.html', context)
 
+def _calidad_pedida(request):
+    """?calidad= si es válida; si no, la de la configuración del usuario"""
+    calidad = request.GET.get('calidad')
+    if calidad in transcodificacion.CALIDADES:
+        return calidad
+    return transcodificacion.calidad_usuario(request.user)
+
+def _archivo_pedido(request, cancion):
+    """
+    (archivo, fijado): el archivo cuya huella lleva ?v= (ver entrega.url_audio)
+    o, sin ella o si ya no existe, el que toca según la calidad pedida
+    """
+    archivo = transcodificacion.archivo_por_huella(cancion, request.GET.get('v'))
+    if archivo is not None:
+        return archivo, True
+    return transcodificacion.seleccionar_archivo(cancion, _calidad_pedida(request)), False
+
+def stream_cancion(request, cancion_id):
+    """Entrega el audio de una canción con soporte de Range para poder adelantar sin recargar"""
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    # Sólo con sesión iniciada o con una firma válida (ver entrega.firmar_url_audio)
+    if not request.user.is_authenticated and \
+            not verificar_firma(cancion_id, request.GET.get('e'), request.GET.get('s'), request.GET.get('v')):
+        return HttpResponseForbidden("Se requiere sesión o un enlace firmado")
+
+    cancion = get_object_or_404(Cancion, id=cancion_id, activa=True)
+    if not cancion.archivo:
+        raise Http404("La canción no tiene archivo de audio")
+
+    # Con ?v= la URL entrega siempre los mismos bytes: es inmutable
+    archivo, inmutable = _archivo_pedido(request, cancion)
+    respuesta = servir_archivo(request, archivo, inmutable=inmutable)
+    # Audio protegido: sólo la caché del navegador, nunca una compartida
+    patch_cache_control(respuesta, private=True)
+    patch_vary_headers(respuesta, ['Cookie'])
+    return respuesta
+
+def hls_archivo(request, ruta):
+    """Listas y segmentos HLS: su ruta depende del contenido, así que se cachean para siempre"""
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    # Las listas enlazan los segmentos con rutas relativas, que no pueden llevar firma
+    if not request.user.is_authenticated:
+        return HttpResponseForbidden("Se requiere sesión")
+
+    partes = ruta.split('/')
+    if '..' in partes or '' in partes or not ruta.endswith(('.m3u8', '.mp3')):
+        raise Http404("Archivo HLS no válido")
+    archivo = FieldFile(None, Cancion._meta.get_field('archivo'), f'{hls.CARPETA}/{ruta}')
+    if not archivo.storage.exists(archivo.name):
+        raise Http404("Archivo HLS no encontrado")
+    tipo = 'application/vnd.apple.mpegurl' if ruta.endswith('.m3u8') else 'audio/mpeg'
+    respuesta = servir_archivo(request, archivo, content_type=tipo, inmutable=True)
+    patch_cache_control(respuesta, private=True)
+    patch_vary_headers(respuesta, ['Cookie'])
+    return respuesta
+
+def forma_onda(request, contenido, puntos):
+    """Picos de la forma de onda (pares int8 mínimo/máximo): dependen sólo del audio y no caducan"""
+    etag = f'"{contenido}-{puntos}"'
+    if etag in [e.strip() for e in request.headers.get('If-None-Match', '').split(',')]:
+        response = HttpResponseNotModified()
+    else:
+        datos = FormaOnda.objects.filter(contenido=contenido, puntos=puntos) \
+            .values_list('datos', flat=True).first()
+        if datos is None:
+            raise Http404("Forma de onda no calculada")
+        response = HttpResponse(bytes(datos), content_type='application/octet-stream')
+
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=31536000, immutable=True)
+    return response
+
+
+def miniatura(request, tamano, ruta):
+    """Miniatura de una imagen del catálogo; se genera la primera vez que se pide"""
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+
+    nombre, _, formato = ruta.rpartition('.')
+    if not miniaturas.valida(nombre, tamano, formato):
+        raise Http404("Miniatura no válida")
+    try:
+        generada = miniaturas.generar(nombre, tamano, formato)
+    except FileNotFoundError:
+        raise Http404("Imagen no encontrada")
+    except (OSError, ValueError, Image.DecompressionBombError):
+        raise Http404("La imagen no se puede leer")
+    archivo = FieldFile(None, Artista._meta.get_field('imagen'), generada)
+    # El nombre de la miniatura sale del de la imagen, que no se reescribe: no caduca
+    return servir_archivo(request, archivo, content_type=miniaturas.FORMATOS[formato][1], inmutable=True)
+
+def audio_firmado(request, cancion_id):
+    """Valida la URL firmada y delega la entrega del archivo en el backend configurado"""
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+
+    if not verificar_firma(cancion_id, request.GET.get('e'), request.GET.get('s'), request.GET.get('v')):
+        return HttpResponseForbidden("Enlace inválido o caducado")
+
+    cancion = get_object_or_404(Cancion.objects.only('id', 'archivo', 'bitrate'), id=cancion_id, activa=True)
+    if not cancion.archivo:
+        raise Http404("La canción no tiene archivo de audio")
+
+    archivo, _ = _archivo_pedido(request, cancion)
+    return get_backend().responder(request, archivo)
+
 from django.contrib.auth import login
 from django.contrib.auth.models import Group
 from .forms import CustomUserCreationForm, ArtistaForm, AlbumForm, CancionForm
@@ -399,11 +705,14 @@ def signup(request):
 @login_required
 @user_passes_test(es_administrador)
 def admin_dashboard(request):
-    return render(request, 'music/admin_dashboard.html', {
+    context = {
         'total_canciones': Cancion.objects.count(),
         'total_artistas': Artista.objects.count(),
         'total_albums': Album.objects.count(),
-    })
+    }
+    # Estadísticas desde las tablas agregadas (manage.py aggregate_plays)
+    context.update(estadisticas.resumen_reproducciones())
+    return render(request, 'music/admin_dashboard.html', context)
 
 # --- CRUD VIEWS ---
 
@@ -458,6 +767,9 @@ class AlbumListView(AdminRequiredMixin, ListView):
     context_object_name = 'albums'
     paginate_by = 20
 
+    def get_queryset(self):
+        return Album.objects.prefetch_related('artistas')
+
 class AlbumCreateView(AdminRequiredMixin, CreateView):
     model = Album
     form_class = AlbumForm
@@ -493,6 +805,9 @@ class CancionListView(AdminRequiredMixin, ListView):
     context_object_name = 'canciones'
     paginate_by = 20
 
+    def get_queryset(self):
+        return Cancion.objects.select_related('album').prefetch_related('artistas')
+
 class CancionCreateView(AdminRequiredMixin, CreateView):
     model = Cancion
     form_class = CancionForm